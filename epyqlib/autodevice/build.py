@@ -11,6 +11,7 @@ import attr
 import canmatrix.formats
 
 import epyqlib.device
+import epyqlib.matrixcache
 
 
 class InvalidAutoParametersDeviceError(Exception):
@@ -220,7 +221,7 @@ class Builder:
             with open(can_path, 'wb') as f:
                 f.write(can_contents)
 
-            matrix, = canmatrix.formats.loadp(os.fspath(can_path)).values()
+            matrix, = epyqlib.matrixcache.loadp(can_path).values()
             neo = epyqlib.canneo.Neo(
                 matrix=matrix,
                 frame_class=epyqlib.nv.Frame,
@@ -2,12 +2,12 @@ import collections
 import enum
 import json
 
-import canmatrix.formats
 import twisted.internet.defer
 
 import PyQt5.QtWidgets
 
 import epyqlib.canneo
+import epyqlib.matrixcache
 import epyqlib.nv
 import epyqlib.pm.valuesetmodel
 import epyqlib.twisted.nvs
@@ -75,7 +75,7 @@ class DeviceExtension:
             self.load_parameters)
 
         matrix_nv = list(
-            canmatrix.formats.loadp(self.device().can_path).values())[0]
+            epyqlib.matrixcache.loadp(self.device().can_path).values())[0]
         self.frames_nv = epyqlib.canneo.Neo(
             matrix=matrix_nv,
             frame_class=epyqlib.nv.Frame,
@@ -0,0 +1,265 @@
+import bisect
+import collections
+import json
+import logging
+import math
+import os
+import time
+
+import attr
+import epyqlib.canneo
+import epyqlib.utils.qt
+
+# See file COPYING in this source tree
+__copyright__ = 'Copyright 2018, EPC Power Corp.'
+__license__ = 'GPLv2+'
+
+
+logger = logging.getLogger(__name__)
+
+
+default_latency_bounds = (
+    0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1,
+)
+
+# Latencies outside this range come from interfaces not timestamping
+# against the wall clock and are not recorded.
+maximum_latency = 60
+
+
+def frame_bits(message):
+    """Bits on the wire for the message, ignoring stuff bits."""
+    # SOF, arbitration, control, CRC, ACK, EOF and interframe space
+    overhead = 67 if message.id_type else 47
+
+    return overhead + 8 * message.dlc
+
+
+def format_key(key):
+    id, extended = key
+
+    return epyqlib.canneo.format_identifier(id, extended)
+
+
+@attr.s
+class Histogram:
+    """Counts of values falling at or below each bound with a final bucket
+    for those above the last.
+    """
+    bounds = attr.ib(default=default_latency_bounds, converter=tuple)
+    counts = attr.ib(init=False)
+    count = attr.ib(default=0, init=False)
+    total = attr.ib(default=0, init=False)
+    maximum = attr.ib(default=None, init=False)
+
+    def __attrs_post_init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, fraction):
+        """The bound of the bucket holding the given fraction of values, or
+        the maximum if it is beyond the last bound.
+        """
+        if self.count == 0:
+            return None
+
+        needed = math.ceil(fraction * self.count)
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= needed:
+                return bound
+
+        return self.maximum
+
+    def to_dict(self):
+        return {
+            'bounds': list(self.bounds),
+            'counts': list(self.counts),
+            'count': self.count,
+            'mean': self.total / self.count if self.count > 0 else None,
+            'maximum': self.maximum,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+        }
+
+
+@attr.s
+class Metrics:
+    """Traffic counters for a bus proxy.
+
+    Counting is a few dict updates per message so it can be left enabled.
+    :meth:`received` is called from the receive thread and
+    :meth:`dispatched` from either the receive thread or, when receiving in
+    batches, the GUI thread.  :meth:`transmitted`, :meth:`dropped` and
+    :meth:`snapshot` are called from the GUI thread.  Received and
+    transmitted bits are counted separately so that each counter is updated
+    from only one thread.  Rates cover the time since the previous snapshot and the bus
+    load needs the ``bitrate``.
+    """
+    bitrate = attr.ib(default=None)
+    enabled = attr.ib(default=True)
+    clock = attr.ib(default=time.monotonic, repr=False)
+    rx_counts = attr.ib(default=attr.Factory(collections.Counter))
+    tx_counts = attr.ib(default=attr.Factory(collections.Counter))
+    dropped_counts = attr.ib(
+        default=attr.Factory(
+            lambda: collections.defaultdict(collections.Counter),
+        ),
+    )
+    latency = attr.ib(default=attr.Factory(Histogram))
+    gauges = attr.ib(default=attr.Factory(dict), repr=False)
+    rx_bits = attr.ib(default=0)
+    tx_bits = attr.ib(default=0)
+    _previous = attr.ib(default=None, init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self._previous = self._totals()
+
+    def received(self, message):
+        if not self.enabled:
+            return
+
+        self.rx_counts[(message.arbitration_id, bool(message.id_type))] += 1
+        self.rx_bits += frame_bits(message)
+
+    def transmitted(self, message):
+        if not self.enabled:
+            return
+
+        self.tx_counts[(message.arbitration_id, bool(message.id_type))] += 1
+        self.tx_bits += frame_bits(message)
+
+    def dropped(self, message, reason):
+        if not self.enabled:
+            return
+
+        key = (message.arbitration_id, bool(message.id_type))
+        self.dropped_counts[reason][key] += 1
+
+    def dispatched(self, messages):
+        """Record the time from reception to now for the messages about to
+        be handed to listeners.
+        """
+        if not self.enabled:
+            return
+
+        now = time.time()
+        for message in messages:
+            timestamp = message.timestamp
+            if not timestamp:
+                continue
+
+            latency = now - timestamp
+            if 0 <= latency < maximum_latency:
+                self.latency.add(latency)
+
+    def add_gauge(self, name, gauge):
+        """Report the result of calling gauge, such as a queue length, in
+        snapshots.
+        """
+        self.gauges[name] = gauge
+
+    def reset(self):
+        self.rx_counts.clear()
+        self.tx_counts.clear()
+        self.dropped_counts.clear()
+        self.latency = Histogram(bounds=self.latency.bounds)
+        self.rx_bits = 0
+        self.tx_bits = 0
+        self._previous = self._totals()
+
+    def _totals(self):
+        return (
+            self.clock(),
+            dict(self.rx_counts),
+            dict(self.tx_counts),
+            self.rx_bits + self.tx_bits,
+        )
+
+    def snapshot(self):
+        """A JSON serializable summary of the traffic so far."""
+        previous_time, previous_rx, previous_tx, previous_bits = self._previous
+        self._previous = now, rx, tx, bits = self._totals()
+        elapsed = now - previous_time
+
+        def rates(counts, previous):
+            if elapsed <= 0:
+                return {}
+
+            return {
+                format_key(key): (count - previous.get(key, 0)) / elapsed
+                for key, count in sorted(counts.items())
+            }
+
+        bus_load = None
+        if self.bitrate and elapsed > 0:
+            bus_load = 100 * (bits - previous_bits) / (self.bitrate * elapsed)
+
+        return {
+            'elapsed': elapsed,
+            'rx': {
+                'total': sum(rx.values()),
+                'rates': rates(rx, previous_rx),
+            },
+            'tx': {
+                'total': sum(tx.values()),
+                'rates': rates(tx, previous_tx),
+            },
+            'bus_load_percent': bus_load,
+            'dropped': {
+                reason: {
+                    format_key(key): count
+                    for key, count in sorted(dict(counts).items())
+                }
+                for reason, counts in sorted(dict(self.dropped_counts).items())
+            },
+            'gauges': {
+                name: gauge()
+                for name, gauge in sorted(self.gauges.items())
+            },
+            'latency': self.latency.to_dict(),
+        }
+
+
+class MetricsReporter:
+    """Periodically log snapshots of named metrics as JSON and optionally
+    write the latest to a file.
+    """
+    def __init__(self, metrics, interval=10, path=None, level=logging.INFO):
+        self.metrics = metrics
+        self.path = path
+        self.level = level
+
+        self.timer = epyqlib.utils.qt.create_timer()
+        self.timer.setInterval(round(1000 * interval))
+        self.timer.timeout.connect(self.report)
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def report(self):
+        snapshots = {
+            name: metrics.snapshot()
+            for name, metrics in self.metrics.items()
+        }
+        text = json.dumps(snapshots, sort_keys=True)
+
+        logger.log(self.level, 'Bus metrics: {}'.format(text))
+
+        if self.path is not None:
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w') as f:
+                f.write(text)
+            os.replace(temporary, self.path)
+
+        return snapshots
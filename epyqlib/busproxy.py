@@ -4,10 +4,18 @@
 
 import can
 import can.interfaces.pcan
+import collections
+import contextlib
+import functools
 import logging
+import queue
+import select
+import socket
+import threading
 import time
 
 from epyqlib.canneo import QtCanListener
+import epyqlib.busmetrics
 import epyqlib.utils.qt
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QApplication
@@ -17,24 +25,429 @@ __copyright__ = 'Copyright 2016, EPC Power Corp.'
 __license__ = 'GPLv2+'
 
 
+logger = logging.getLogger(__name__)
+
+
+id_masks = {
+    False: 0x7FF,
+    True: 0x1FFFFFFF,
+}
+
+
+def acceptance_filters(keys, limit=None):
+    """Build python-can filters accepting exactly the (id, extended) keys.
+
+    Ids are combined into as few id/mask filters as possible without
+    accepting any other id.  If a limit is given and more filters are
+    needed then the filters which lose the fewest mask bits when combined
+    are merged, accepting some unrequested ids, until it is met.
+    """
+    filters = []
+
+    for extended, full_mask in sorted(id_masks.items()):
+        ids = {id for id, key_extended in keys if key_extended == extended}
+        filters.extend(
+            {'can_id': value, 'can_mask': mask, 'extended': extended}
+            for value, mask in sorted(minimal_masks(ids, full_mask))
+        )
+
+    if limit is not None:
+        while len(filters) > limit:
+            merged = merge_closest_filters(filters)
+            if merged is None:
+                break
+
+            filters = merged
+
+    return filters
+
+
+def minimal_masks(ids, full_mask):
+    # Quine-McCluskey style: repeatedly combine terms differing in a single
+    # bit to find the prime implicants and then greedily pick those covering
+    # the most ids still not covered.
+    terms = {(id, full_mask) for id in ids}
+    primes = set()
+
+    while len(terms) > 0:
+        combined = set()
+        used = set()
+
+        for value, mask in terms:
+            bits = mask
+            while bits:
+                bit = bits & -bits
+                bits ^= bit
+
+                other = (value ^ bit, mask)
+                if other in terms:
+                    combined.add((value & ~bit, mask & ~bit))
+                    used.add((value, mask))
+                    used.add(other)
+
+        primes |= terms - used
+        terms = combined
+
+    uncovered = set(ids)
+    chosen = []
+
+    while len(uncovered) > 0:
+        covers = {
+            prime: {id for id in uncovered if id & prime[1] == prime[0]}
+            for prime in primes
+        }
+        prime = max(
+            sorted(covers),
+            key=lambda prime: len(covers[prime]),
+        )
+        chosen.append(prime)
+        uncovered -= covers[prime]
+
+    return chosen
+
+
+def merge_closest_filters(filters):
+    def merged(a, b):
+        mask = a['can_mask'] & b['can_mask'] & ~(a['can_id'] ^ b['can_id'])
+
+        return {
+            'can_id': a['can_id'] & mask,
+            'can_mask': mask,
+            'extended': a['extended'],
+        }
+
+    candidates = (
+        merged(a, b)
+        for i, a in enumerate(filters)
+        for b in filters[i + 1:]
+        if a['extended'] == b['extended']
+    )
+    combined = max(
+        candidates,
+        key=lambda candidate: bin(candidate['can_mask']).count('1'),
+        default=None,
+    )
+
+    if combined is None:
+        return None
+
+    def covered(f):
+        return (
+            f['extended'] == combined['extended']
+            and f['can_mask'] & combined['can_mask'] == combined['can_mask']
+            and f['can_id'] & combined['can_mask'] == combined['can_id']
+        )
+
+    return [f for f in filters if not covered(f)] + [combined]
+
+
+class TransmitQueue:
+    """Send messages to a python-can bus from a dedicated thread.
+
+    Messages are spaced by at least ``gap`` seconds to avoid forcing
+    SocketCAN off bus when bursting.  A send raising ``can.CanError``, such
+    as for a full transmit buffer, is retried after ``retry_delay`` up to
+    ``retries`` more times before the message is dropped.  ``sent`` is
+    emitted, in the thread the queue was created in, with each message
+    actually sent and its ``on_success`` callable.
+    """
+    sent = epyqlib.utils.qt.Signal('PyQt_PyObject', 'PyQt_PyObject')
+    dropped = epyqlib.utils.qt.Signal('PyQt_PyObject')
+
+    def __init__(self, bus, gap=0.0005, maximum_length=1000, retries=20,
+                 retry_delay=0.005):
+        self.bus = bus
+        self.gap = gap
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self._queue = queue.Queue(maxsize=maximum_length)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='{} transmit'.format(bus),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def put(self, msg, on_success=None):
+        """Queue a message for sending.  Returns False without queueing if
+        the queue is full or stopped.
+        """
+        if self._stopping.is_set():
+            return False
+
+        try:
+            self._queue.put_nowait((msg, on_success))
+        except queue.Full:
+            logger.warning('Transmit queue full, dropping {}'.format(msg))
+            return False
+
+        return True
+
+    def length(self):
+        return self._queue.qsize()
+
+    def stop(self):
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+        self._thread.join()
+
+    def _run(self):
+        last = None
+
+        while not self._stopping.is_set():
+            item = self._queue.get()
+            if item is None:
+                continue
+
+            msg, on_success = item
+
+            for attempt in range(self.retries + 1):
+                if last is not None:
+                    remaining = last + self.gap - time.perf_counter()
+                    if remaining > 0:
+                        time.sleep(remaining)
+
+                if self._stopping.is_set():
+                    return
+
+                last = time.perf_counter()
+
+                try:
+                    # TODO: I would use message=message (or msg=msg) but:
+                    #       https://bitbucket.org/hardbyte/python-can/issues/52/inconsistent-send-signatures
+                    self.bus.send(msg)
+                except can.CanError:
+                    time.sleep(self.retry_delay)
+                else:
+                    self.sent.emit(msg, on_success)
+                    break
+            else:
+                logger.warning('Failed to send {}'.format(msg))
+                self.dropped.emit(msg)
+
+
+class ReceiveService:
+    """Read any number of python-can buses from a single thread.
+
+    Buses providing a ``fileno()`` are waited on together with
+    ``select()``, others are polled every ``poll_interval`` seconds.  Each
+    message read is passed to the ``on_message_received()`` of the listener
+    the bus was added with.  The thread runs only while buses are attached.
+    """
+    def __init__(self, poll_interval=0.002, timeout=1):
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._listeners = {}
+        self._selectable = {}
+        self._thread = None
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+
+    def add(self, bus, listener):
+        try:
+            fileno = bus.fileno()
+        except (AttributeError, NotImplementedError, OSError, ValueError):
+            fileno = -1
+
+        with self._lock:
+            self._listeners[bus] = listener
+            if fileno >= 0:
+                self._selectable[bus] = fileno
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name='epyqlib.busproxy.ReceiveService',
+                    daemon=True,
+                )
+                self._thread.start()
+
+        self._wake()
+
+    def remove(self, bus):
+        """Stop reading the bus.  Once this returns the bus will not be read
+        again so it may be shut down.
+        """
+        with self._lock:
+            self._listeners.pop(bus, None)
+            self._selectable.pop(bus, None)
+
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(b'\0')
+        except OSError:
+            pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if len(self._listeners) == 0:
+                    self._thread = None
+                    return
+
+                selectable = dict(self._selectable)
+                polled = len(self._listeners) > len(selectable)
+
+            timeout = self.poll_interval if polled else self.timeout
+
+            try:
+                ready, _, _ = select.select(
+                    [self._wake_reader.fileno(), *selectable.values()],
+                    [],
+                    [],
+                    timeout,
+                )
+            except (OSError, ValueError):
+                # Likely a bus removed, and its descriptor closed, since the
+                # snapshot was taken.  Any bus still attached whose
+                # descriptor is unusable is polled instead.
+                with self._lock:
+                    self._drop_unselectable()
+                continue
+
+            if self._wake_reader.fileno() in ready:
+                try:
+                    while self._wake_reader.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+            ready = set(ready)
+
+            with self._lock:
+                for bus, listener in tuple(self._listeners.items()):
+                    fileno = self._selectable.get(bus)
+                    if fileno is not None and fileno not in ready:
+                        continue
+
+                    try:
+                        self._read(bus=bus, listener=listener)
+                    except Exception:
+                        logger.exception('Stopped reading {}'.format(bus))
+                        self._listeners.pop(bus, None)
+                        self._selectable.pop(bus, None)
+
+    def _drop_unselectable(self):
+        for bus, fileno in tuple(self._selectable.items()):
+            try:
+                select.select([fileno], [], [], 0)
+            except (OSError, ValueError):
+                logger.warning(
+                    'Unable to select on {}, polling instead'.format(bus),
+                )
+                del self._selectable[bus]
+
+    @staticmethod
+    def _read(bus, listener):
+        if not isinstance(bus, can.BusABC):
+            while True:
+                message = bus.recv(timeout=0)
+                if message is None:
+                    return
+
+                listener.on_message_received(message)
+
+        # BusABC.recv(timeout=0) returns None for a message rejected by
+        # filters applied in software even when more are waiting so the
+        # filtering is done here to read everything available.
+        while True:
+            message, filtered = bus._recv_internal(timeout=0)
+            if message is None:
+                return
+
+            if filtered or bus._matches_filters(message):
+                listener.on_message_received(message)
+
+
+_receive_service = None
+
+
+def shared_receive_service():
+    """The ReceiveService used by default by all BusProxy instances."""
+    global _receive_service
+
+    if _receive_service is None:
+        _receive_service = ReceiveService()
+
+    return _receive_service
+
+
+@contextlib.contextmanager
+def timed(timings, name):
+    """Record the seconds taken by the block in the timings dict."""
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+        logger.debug('{} took {:.3f} seconds'.format(name, timings[name]))
+
+
 class BusProxy:
     went_offline = epyqlib.utils.qt.Signal()
 
     def __init__(self, bus=None, timeout=0.1, transmit=True, filters=None,
-                 auto_disconnect=True):
+                 auto_disconnect=True, batch_receive=False,
+                 automatic_filters=False, filter_limit=None,
+                 transmit_gap=0.0005, receive_service=None,
+                 reset_timeout=0.5, reset_settle=0.05):
         self.filters = filters
         self.auto_disconnect = auto_disconnect
 
+        # When enabled, and no filters have been set explicitly, the bus is
+        # set to accept only the ids the listeners want unless all traffic
+        # has been requested.
+        self.automatic_filters = automatic_filters
+        self.filter_limit = filter_limit
+
         self.timeout = timeout
-        self.notifier = NotifierProxy(self)
-        self.real_notifier = None
+        # Traffic counters, see epyqlib.busmetrics.Metrics.snapshot()
+        self.metrics = epyqlib.busmetrics.Metrics()
+        self.metrics.add_gauge(
+            'transmit_queue',
+            lambda: (
+                0
+                if self.transmit_queue is None
+                else self.transmit_queue.length()
+            ),
+        )
+        self.notifier = NotifierProxy(
+            self,
+            batch=batch_receive,
+            metrics=self.metrics,
+        )
+        self.notifier.keys_changed.connect(self.update_filters)
+        if receive_service is None:
+            receive_service = shared_receive_service()
+        self.receive_service = receive_service
         self.tx_notifier = NotifierProxy(None)
+        self.transmit_gap = transmit_gap
+        self.transmit_queue = None
+        self.reset_timeout = reset_timeout
+        # The status can still read ok from before a reset so it is only
+        # trusted once seen not ok or after this many seconds.
+        self.reset_settle = reset_settle
+        # Seconds taken by the latest detach, attach, reset and overall
+        # set_bus() for looking into slow connects and disconnects.
+        self.timings = {}
         self.bus = None
         self.set_bus(bus)
 
         self._transmit = transmit
 
-        self.flash_timer = QtCore.QTimer()
+        self.flash_timer = epyqlib.utils.qt.create_timer()
         self.flash_timer.setSingleShot(True)
         self.flash_timer.setInterval(10 * 1000)
         self.flash_timer.timeout.connect(self.stop_flashing)
@@ -55,9 +468,10 @@ class BusProxy:
 
     def _send(self, msg, on_success=None, passive=False):
         if self.bus is not None and (self._transmit or passive):
-            # TODO: this (the silly sleep) is really hacky and shouldn't be needed but it seems
-            #       to be to keep from forcing socketcan offbus.  the issue
-            #       can be recreated with the following snippet.
+            # Real buses are sent to from a paced queue in another thread.
+            # Sending a burst with no gap has been seen to force socketcan
+            # off bus.  The issue can be recreated with the following
+            # snippet.
             # import can
             # import time
             # bus = can.interface.Bus(bustype='socketcan', channel='can0')
@@ -98,30 +512,17 @@ class BusProxy:
                 #       messages later
                 msg.timestamp = None
 
-                try:
-                    # TODO: I would use message=message (or msg=msg) but:
-                    #       https://bitbucket.org/hardbyte/python-can/issues/52/inconsistent-send-signatures
-                    self.bus.send(msg)
-                except can.CanError:
-                    # TODO: specifically implemented for a transmit queue
-                    #       full situation to avoid infinite dialogs
-                    self.set_bus()
-
-                # TODO: get a real value for sent, but for now python-can
-                #       doesn't provide that info.  also, it would be async...
-                sent = True
-
-                time.sleep(0.0005)
-
-                if sent:
-                    self.tx_notifier.message_received(message=msg)
-
-                    if on_success is not None:
-                        on_success()
+                # Sent means queued, on_success is called once the message
+                # has actually been handed to the bus.
+                sent = self.transmit_queue.put(msg, on_success=on_success)
+                if not sent:
+                    self.metrics.dropped(msg, reason='transmit_queue_full')
             else:
                 # TODO: I would use message=message (or msg=msg) but:
                 #       https://bitbucket.org/hardbyte/python-can/issues/52/inconsistent-send-signatures
                 sent = self.bus._send(msg, on_success=on_success, passive=passive)
+                if sent:
+                    self.metrics.transmitted(msg)
 
             if self.auto_disconnect:
                 self.verify_bus_ok()
@@ -163,36 +564,58 @@ class BusProxy:
         if self.bus is not None:
             return self.bus.flash(False)
 
+    def transmitted(self, msg, on_success):
+        self.metrics.transmitted(msg)
+        self.tx_notifier.message_received(message=msg)
+
+        if on_success is not None:
+            on_success()
+
+    def transmit_dropped(self, msg):
+        self.metrics.dropped(msg, reason='transmit_retries')
+
     def terminate(self):
         self.set_bus()
         logging.debug('{} terminated'.format(object.__repr__(self)))
 
     def set_bus(self, bus=None):
+        with timed(self.timings, 'set_bus'):
+            self._set_bus(bus=bus)
+
+    def _set_bus(self, bus):
         was_online = self.bus is not None
 
         if was_online:
-            if isinstance(self.bus, can.BusABC):
-                self.real_notifier.stop()
-                time.sleep(1.1 * self.timeout)
-            else:
-                self.bus.notifier.remove(self.notifier)
-                self.bus.tx_notifier.remove(self.tx_notifier)
-            self.bus.shutdown()
+            with timed(self.timings, 'detach'):
+                if isinstance(self.bus, can.BusABC):
+                    self.transmit_queue.stop()
+                    self.transmit_queue = None
+                    self.receive_service.remove(self.bus)
+                else:
+                    self.bus.notifier.remove(self.notifier)
+                    self.bus.tx_notifier.remove(self.tx_notifier)
+                self.bus.shutdown()
         self.bus = bus
 
         if self.bus is not None:
-            self.set_filters(self.filters)
-            if isinstance(self.bus, can.BusABC):
-                self.real_notifier = can.Notifier(
-                    bus=self.bus,
-                    listeners=[self.notifier],
-                    timeout=self.timeout)
-            else:
-                self.bus.notifier.add(self.notifier)
-                self.bus.tx_notifier.add(self.tx_notifier)
-                self.real_notifier = None
-        else:
-            self.real_notifier = None
+            with timed(self.timings, 'attach'):
+                self.update_filters()
+                if isinstance(self.bus, can.BusABC):
+                    self.receive_service.add(
+                        bus=self.bus,
+                        listener=self.notifier,
+                    )
+                    self.transmit_queue = TransmitQueue(
+                        bus=self.bus,
+                        gap=self.transmit_gap,
+                    )
+                    self.transmit_queue.sent.connect(self.transmitted)
+                    self.transmit_queue.dropped.connect(
+                        self.transmit_dropped,
+                    )
+                else:
+                    self.bus.notifier.add(self.notifier)
+                    self.bus.tx_notifier.add(self.tx_notifier)
 
         self.reset()
 
@@ -210,51 +633,301 @@ class BusProxy:
 
     def reset(self):
         if self.bus is not None:
-            if isinstance(self.bus, can.interfaces.pcan.PcanBus):
-                self.bus.reset()
-                # TODO: do this a better way
-                # Give PCAN a chance to actually reset and avoid immediate
-                # send failures
-                time.sleep(0.500)
-            else:
-                # TODO: support socketcan
-                if hasattr(self.bus, 'reset'):
+            with timed(self.timings, 'reset'):
+                if isinstance(self.bus, can.interfaces.pcan.PcanBus):
                     self.bus.reset()
+                    # Give PCAN a chance to actually reset and avoid
+                    # immediate send failures
+                    self.wait_for_status_ok(
+                        timeout=self.reset_timeout,
+                        settle=self.reset_settle,
+                    )
+                else:
+                    # TODO: support socketcan
+                    if hasattr(self.bus, 'reset'):
+                        self.bus.reset()
+
+    def wait_for_status_ok(self, timeout, interval=0.005, settle=0):
+        """Poll the bus status until it is ok or the timeout passes.
+        An ok status is only accepted after the status has been not ok or
+        settle seconds have passed.  Returns whether the status became ok.
+        """
+        start = time.perf_counter()
+        end = start + timeout
+        settled = start + settle
+        left_ok = False
+
+        while True:
+            ok = self.bus.status_is_ok()
+            if ok and (left_ok or time.perf_counter() >= settled):
+                return True
+
+            left_ok = left_ok or not ok
+
+            if time.perf_counter() >= end:
+                return False
+
+            time.sleep(interval)
 
     def set_filters(self, filters):
         self.filters = filters
+        self.update_filters()
+
+    def receive_all(self, requester, enable=True):
+        """Accept all traffic, overriding automatic filters, while any
+        requester has it enabled.
+        """
+        self.notifier.receive_all(requester=requester, enable=enable)
+
+    def active_filters(self):
+        if self.filters is not None:
+            return self.filters
+
+        if not self.automatic_filters:
+            return None
+
+        keys = self.notifier.receive_keys()
+        if keys is None or len(keys) == 0:
+            return None
+
+        return acceptance_filters(keys=keys, limit=self.filter_limit)
+
+    def update_filters(self):
         real_bus = self.bus
-        if real_bus is not None:
-            if hasattr(real_bus, 'setFilters'):
-                real_bus.setFilters(can_filters=filters)
+        if real_bus is None:
+            return
+
+        # A parent proxy merges the keys of its listeners, including this
+        # proxy's notifier, into its own filters.
+        if not isinstance(real_bus, can.BusABC):
+            return
+
+        real_bus.set_filters(self.active_filters())
 
 
 class NotifierProxy(QtCanListener):
-    def __init__(self, bus, listeners=[], filtered_ids=None, parent=None):
+    drain_requested = epyqlib.utils.qt.Signal()
+    keys_changed = epyqlib.utils.qt.Signal()
+
+    def __init__(self, bus, listeners=[], filtered_ids=None, batch=False,
+                 metrics=None, parent=None):
         super().__init__(receiver=self.message_received, parent=parent)
 
+        # Counts received messages and the latency to their dispatch to
+        # listeners when set.
+        self.metrics = metrics
+
         # TODO: consider a WeakSet, though this may presently
         #       be keeping objects alive
-        self.listeners = set(listeners)
+        self.listeners = set()
+        # Listeners receiving every message and, for the rest, those
+        # subscribed to each (id, extended) key.
+        self._unrouted = set()
+        self._routes = collections.defaultdict(set)
+        self._keys = {}
+        self._keys_changed_slots = {}
+        self._observers = set()
+        self._receive_all_requests = set()
+        for listener in listeners:
+            self.add(listener)
+
         if filtered_ids is None:
             self.filtered_ids = None
         else:
             self.filtered_ids = set(filtered_ids)
 
+        # When batching, messages arriving on the notifier thread are
+        # queued and a single drain is requested of the thread this proxy
+        # was created in.  Listeners are then handed everything queued so
+        # far as one list.
+        self.batch = batch
+        self._pending = collections.deque()
+        self._drain_scheduled = False
+        self.drain_requested.connect(self.drain, QtCore.Qt.QueuedConnection)
+
+        if self.metrics is not None:
+            self.metrics.add_gauge('receive_pending', self.pending_length)
+
+    def pending_length(self):
+        return len(self._pending)
+
     def message_received(self, message):
-        if (self.filtered_ids is None or
+        if self.metrics is not None:
+            self.metrics.received(message)
+
+        if self.batch:
+            self._pending.append(message)
+
+            if not self._drain_scheduled:
+                self._drain_scheduled = True
+                self.drain_requested.emit()
+        elif (self.filtered_ids is None or
                 message.arbitration_id in self.filtered_ids):
-            for listener in tuple(self.listeners):
+            if self.metrics is not None:
+                self.metrics.dispatched((message,))
+
+            for listener in self.routed_listeners(message):
                 listener.message_received_signal.emit(message)
 
-    def add(self, listener):
+    def routed_listeners(self, message):
+        listeners = tuple(self._unrouted)
+
+        routed = self._routes.get(
+            (message.arbitration_id, bool(message.id_type)),
+        )
+        if routed:
+            listeners += tuple(routed)
+
+        return listeners
+
+    def drain(self):
+        # Clear the flag before popping so that a message queued during the
+        # drain will request another one rather than be left behind.
+        self._drain_scheduled = False
+
+        messages = []
+        while True:
+            try:
+                messages.append(self._pending.popleft())
+            except IndexError:
+                break
+
+        if len(messages) > 0:
+            self._deliver(messages)
+
+    def messages_received(self, messages):
+        if self.metrics is not None:
+            for message in messages:
+                self.metrics.received(message)
+
+        self._deliver(messages)
+
+    def _deliver(self, messages):
+        if self.filtered_ids is not None:
+            messages = [
+                message for message in messages
+                if message.arbitration_id in self.filtered_ids
+            ]
+
+        if len(messages) == 0:
+            return
+
+        if self.metrics is not None:
+            self.metrics.dispatched(messages)
+
+        batches = collections.OrderedDict(
+            (listener, messages) for listener in tuple(self._unrouted)
+        )
+
+        if len(self._routes) > 0:
+            for message in messages:
+                routed = self._routes.get(
+                    (message.arbitration_id, bool(message.id_type)),
+                )
+                if not routed:
+                    continue
+
+                for listener in tuple(routed):
+                    batches.setdefault(listener, []).append(message)
+
+        for listener, batch in batches.items():
+            listener.messages_received(batch)
+
+    def receive_all(self, requester, enable=True):
+        """Report that all messages are wanted, regardless of the keys of
+        the listeners, while any requester has it enabled.
+        """
+        if enable:
+            self._receive_all_requests.add(requester)
+        else:
+            self._receive_all_requests.discard(requester)
+
+        self.keys_changed.emit()
+
+    def receive_keys(self):
+        receiving_all = (
+            len(self._receive_all_requests) > 0
+            or len(self._unrouted - self._observers) > 0
+        )
+        if receiving_all:
+            keys = None
+        else:
+            keys = set(self._routes)
+
+        if self.filtered_ids is not None:
+            if keys is None:
+                keys = {
+                    (id, extended)
+                    for id in self.filtered_ids
+                    for extended in (False, True)
+                }
+            else:
+                keys = {key for key in keys if key[0] in self.filtered_ids}
+
+        return keys
+
+    def add(self, listener, keys=None, observer=False):
+        """Add a listener to receive messages with the given (id, extended)
+        keys.  If no keys are passed then those reported by the listener's
+        ``receive_keys()``, if any, are used.  Listeners with neither
+        receive all messages.  Adding a listener again updates its keys.
+        Listeners with a ``keys_changed`` signal are re-added when it is
+        emitted.
+
+        An observer receives every message that reaches this proxy but its
+        keys are not reported by :meth:`receive_keys` so it does not widen
+        bus filters.  See :meth:`receive_all` for when it needs everything.
+        """
+        if observer:
+            self._observers.add(listener)
+
+        if keys is None:
+            receive_keys = getattr(listener, 'receive_keys', None)
+            if receive_keys is not None:
+                keys = receive_keys()
+
+        self._unroute(listener)
         self.listeners.add(listener)
 
+        if keys is None:
+            self._unrouted.add(listener)
+        else:
+            keys = frozenset((id, bool(extended)) for id, extended in keys)
+            self._keys[listener] = keys
+            for key in keys:
+                self._routes[key].add(listener)
+
+        keys_changed = getattr(listener, 'keys_changed', None)
+        if keys_changed is not None and listener not in self._keys_changed_slots:
+            slot = functools.partial(self.add, listener)
+            keys_changed.connect(slot)
+            self._keys_changed_slots[listener] = slot
+
+        self.keys_changed.emit()
+
     def discard(self, listener):
-        self.listeners.discard(listener)
+        if listener in self.listeners:
+            self.remove(listener)
 
     def remove(self, listener):
         self.listeners.remove(listener)
+        self._observers.discard(listener)
+        self._unroute(listener)
+
+        slot = self._keys_changed_slots.pop(listener, None)
+        if slot is not None:
+            listener.keys_changed.disconnect(slot)
+
+        self.keys_changed.emit()
+
+    def _unroute(self, listener):
+        self._unrouted.discard(listener)
+
+        for key in self._keys.pop(listener, ()):
+            routed = self._routes[key]
+            routed.discard(listener)
+            if len(routed) == 0:
+                del self._routes[key]
 
 
 if __name__ == '__main__':
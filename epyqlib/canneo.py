@@ -1,17 +1,17 @@
 import can
 from canmatrix import canmatrix
+import collections.abc
 import copy
 import decimal
-import epyqlib.utils.general
 import functools
-import itertools
 import locale
 import logging
 import math
-from PyQt5.QtCore import (QObject, QTimer, Qt)
+from PyQt5.QtCore import (QObject, Qt)
 import re
 import struct
 import sys
+import threading
 
 import epyqlib.utils.qt
 
@@ -32,127 +32,266 @@ class NotFoundError(Exception):
     pass
 
 
+class AmbiguousNameError(Exception):
+    pass
+
+
 nothing = object()
+ambiguous = object()
 
+# Distinct raw values whose display strings each Signal keeps formatted.
+strings_cache_size = 256
 
-@functools.lru_cache(4096)
-def pack_bitstring(length, is_float, value, signed):
-    if is_float:
-        # TODO: CAMPid 097897541967932453154321546542175421549
-        types = {
-            32: '>f',
-            64: '>d'
-        }
 
-        float_type = types.get(length)
+def index_add(index, key, item):
+    if key in index:
+        item = ambiguous
 
-        if float_type is None:
-            raise Exception(
-                'float type only supports lengths in [{}]'.
-                    format(', '.join([str(t) for t in types.keys()]))
-            )
+    index[key] = item
 
-        x, = struct.pack(float_type, value)
 
-        bitstring = ''.join('{:08b}'.format(b) for b in x)
-    else:
-        b = value.to_bytes(math.ceil(length/8), byteorder='big',
-                             signed=signed)
-        b = '{:0{}b}'.format(int.from_bytes(b, byteorder='big'),
-                             length)
-        bitstring = b[:length]
+def index_get(index, key, kind):
+    item = index.get(key)
 
-    return bitstring
+    if item is ambiguous:
+        raise AmbiguousNameError(
+            'Multiple {} found for: {!r}'.format(kind, key))
 
+    return item
 
-@functools.lru_cache(4096)
-def unpack_bitstring(length, is_float, is_signed, bits):
-    if is_float:
-        # TODO: CAMPid 097897541967932453154321546542175421549
-        types = {
-            32: '>f',
-            64: '>d'
-        }
 
-        float_type = types.get(length)
+# TODO: CAMPid 097897541967932453154321546542175421549
+float_formats = {
+    32: '>f',
+    64: '>d',
+}
 
-        if float_type is None:
-            raise Exception(
-                'float type only supports lengths in [{}]'.
-                    format(', '.join([str(t) for t in types.keys()]))
-            )
 
-        value, = struct.unpack(
-            float_type,
-            bytes(int(''.join(b), 2)
-                      for b in epyqlib.utils.general.grouper(bits, 8))
+def float_format(length):
+    format = float_formats.get(length)
+
+    if format is None:
+        raise Exception(
+            'float type only supports lengths in [{}]'.
+                format(', '.join([str(t) for t in float_formats.keys()]))
         )
-    else:
-        value = int(bits, 2)
 
-        if is_signed and bits[0] == '1':
-            value -= (1 << len(bits))
+    return format
+
+
+class Field:
+    """The position of a signal within a frame's payload expressed as a
+    shift and mask against the payload read as a single integer.  Little
+    endian signals are located in the payload read as a little endian
+    integer and big endian signals in the payload read as a big endian
+    integer.
+    """
 
-    return value
+    def __init__(self, signal, length):
+        self.signal = signal
+        self.little_endian = bool(signal.little_endian)
+        self.size = signal.signal_size
+        self.mask = (1 << self.size) - 1
 
+        if self.little_endian:
+            self.shift = signal.start_bit
+        else:
+            self.shift = (8 * length) - signal.start_bit - self.size
+
+        # The span of payload bytes holding the field and the shift within
+        # them, for reading a lone field such as a multiplexer without
+        # converting the whole payload.
+        if self.little_endian:
+            self.first_byte = self.shift // 8
+            self.last_byte = (self.shift + self.size - 1) // 8
+        else:
+            self.first_byte = length - 1 - (self.shift + self.size - 1) // 8
+            self.last_byte = length - 1 - self.shift // 8
+        self.byte_shift = self.shift % 8
+        self.byteorder = 'little' if self.little_endian else 'big'
+
+        self.float = bool(signal.float)
+        self.signed = bool(signal.signed) and not self.float
+        self.sign_bit = 1 << (self.size - 1)
+
+        # Match the byte granularity of int.to_bytes() that the packing
+        # has historically been limited by.
+        byte_bits = 8 * math.ceil(self.size / 8)
+        if self.signed:
+            self.minimum = -(1 << (byte_bits - 1))
+            self.maximum = (1 << (byte_bits - 1)) - 1
+        else:
+            self.minimum = 0
+            self.maximum = (1 << byte_bits) - 1
 
-@functools.lru_cache(4096)
-def bytes_to_bitstrings(data):
-    b = tuple('{:08b}'.format(b) for b in data)
-    little = ''.join(reversed(b))
-    big = ''.join(b)
+    def unpack(self, little, big):
+        raw = ((little if self.little_endian else big) >> self.shift) & self.mask
 
-    return little, big
+        if self.float:
+            value, = struct.unpack(
+                float_format(self.size),
+                raw.to_bytes(self.size // 8, byteorder='big'),
+            )
+        elif self.signed and raw & self.sign_bit:
+            value = raw - (1 << self.size)
+        else:
+            value = raw
 
+        return value
 
-@functools.lru_cache(4096)
-def bitstring_to_signal_list(signals, big, little):
-    unpacked = []
-    for signal in signals:
-        if signal.little_endian:
-            least = 64 - signal.start_bit
-            most = least - signal.signal_size
+    def extract(self, data):
+        """Read the raw unsigned value of the field directly from the bytes
+        that hold it.
+        """
+        if len(data) <= self.last_byte:
+            data = bytes(data).ljust(self.last_byte + 1, b'\0')
 
-            bits = little[most:least]
+        if self.first_byte == self.last_byte:
+            raw = data[self.first_byte] >> self.byte_shift
         else:
-            most = signal.start_bit
-            least = most + signal.signal_size
+            raw = int.from_bytes(
+                data[self.first_byte:self.last_byte + 1],
+                byteorder=self.byteorder,
+            ) >> self.byte_shift
+
+        return raw & self.mask
+
+    def pack(self, value):
+        if self.float:
+            raw = int.from_bytes(
+                struct.pack(float_format(self.size), value),
+                byteorder='big',
+            )
+        else:
+            if not self.minimum <= value <= self.maximum:
+                raise OverflowError('{} out of range [{}, {}]'.format(
+                    value,
+                    self.minimum,
+                    self.maximum,
+                ))
 
-            bits = big[most:least]
+            raw = value
 
-        unpacked.append(signal.unpack_bitstring(bits))
-    return unpacked
+        return (raw & self.mask) << self.shift
 
+    def unpack_array(self, little, big):
+        import numpy
 
-@functools.lru_cache(4096)
-def signals_to_bytes(length, signals, data):
-    little_bits = [None] * (length * 8)
-    big_bits = list(little_bits)
-    for value, signal in zip(data, signals):
-        bits = signal.pack_bitstring(value)
+        word = little if self.little_endian else big
+        raw = (word >> numpy.uint64(self.shift)) & numpy.uint64(self.mask)
 
-        if signal.little_endian:
-            least = 64 - signal.start_bit
-            most = least - signal.signal_size
+        if self.float:
+            float_format(self.size)
+            if self.size == 32:
+                return raw.astype(numpy.uint32).view(numpy.float32)
 
-            little_bits[most:least] = bits
-        else:
-            most = signal.start_bit
-            least = most + signal.signal_size
-
-            big_bits[most:least] = bits
-    little_bits = reversed(tuple(epyqlib.utils.general.grouper(
-        little_bits, 8)))
-    little_bits = tuple(itertools.chain(*little_bits))
-    bitstring = ''.join(
-        next(x for x in (l, b, '0') if x is not None)
-        # l if l != ' ' else (b if b != ' ' else '0')
-        for l, b in zip(little_bits, big_bits)
-    )
-    return bytes(
-        int(''.join(b), 2)
-        for b in epyqlib.utils.general.grouper(bitstring, 8)
-    )
+            return raw.view(numpy.float64)
+
+        if not self.signed:
+            return raw
+
+        if self.size == 64:
+            return raw.view(numpy.int64)
+
+        sign_bit = numpy.uint64(self.sign_bit)
+
+        return (raw ^ sign_bit).astype(numpy.int64) - numpy.int64(self.sign_bit)
+
+
+class Codec:
+    """Packs and unpacks a frame's signals using integer shift and mask
+    operations.  The layout of the signals is compiled once up front so
+    no per-message string manipulation is needed.
+    """
+
+    def __init__(self, length, signals):
+        self.length = length
+        self.fields = tuple(
+            Field(signal=signal, length=length)
+            for signal in signals
+        )
+        self.little_fields = tuple(f for f in self.fields if f.little_endian)
+        self.big_fields = tuple(f for f in self.fields if not f.little_endian)
+
+    def normalize(self, data):
+        data = bytes(data)
+
+        if len(data) != self.length:
+            data = data[:self.length].ljust(self.length, b'\0')
+
+        return data
+
+    def unpack(self, data):
+        data = self.normalize(data)
+
+        little = int.from_bytes(data, byteorder='little')
+        big = int.from_bytes(data, byteorder='big')
+
+        return [field.unpack(little, big) for field in self.fields]
+
+    def pack(self, values):
+        little = 0
+        big = 0
+
+        for value, field in zip(values, self.fields):
+            if value is None:
+                value = field.signal.value
+            if value is None:
+                value = 0
+
+            try:
+                bits = field.pack(value)
+            except OverflowError as e:
+                signal = field.signal
+                names = (signal.frame.name, signal.frame.mux_name, signal.name)
+                name = ':'.join(name for name in names if name is not None)
+                raise UnableToPackError(
+                    'Unable to pack {value} into {name} with range '
+                    '[{minimum}, {maximum}]'.format(
+                        value=value,
+                        name=name,
+                        minimum=signal.raw_minimum,
+                        maximum=signal.raw_maximum,
+                    )
+                ) from e
+
+            if field.little_endian:
+                little |= bits
+            else:
+                big |= bits
+
+        little = little.to_bytes(self.length, byteorder='little')
+        big |= int.from_bytes(little, byteorder='big')
+
+        return big.to_bytes(self.length, byteorder='big')
+
+    def unpack_array(self, data):
+        """Unpack an N x length array of payload bytes into one raw value
+        array per field.  Payloads of up to eight bytes are supported.
+        """
+        import numpy
+
+        if self.length > 8:
+            raise Exception(
+                'Array unpacking only supports payloads up to 8 bytes long',
+            )
+
+        data = numpy.asarray(data, dtype=numpy.uint8)
+        if data.ndim != 2:
+            raise ValueError('Expected a two dimensional array of payloads')
+
+        data = data[:, :self.length]
+        rows, columns = data.shape
+
+        little = numpy.zeros((rows, 8), dtype=numpy.uint8)
+        little[:, :columns] = data
+        little = little.view('<u8')[:, 0].astype(numpy.uint64)
+
+        big = numpy.zeros((rows, 8), dtype=numpy.uint8)
+        big[:, 8 - self.length:8 - self.length + columns] = data
+        big = big.view('>u8')[:, 0].astype(numpy.uint64)
+
+        return [field.unpack_array(little, big) for field in self.fields]
 
 
 class Signal:
@@ -194,6 +333,11 @@ class Signal:
         except ValueError:
             self.offset = 0
 
+        # Float copies of the scaling for display and other uses that do not
+        # need the exact decimal results of to_human() and from_human().
+        self.float_factor = float(1 if self.factor is None else self.factor)
+        self.float_offset = float(0 if self.offset is None else self.offset)
+
         if signal.multiplex == 'Multiplexor':
             self.multiplex = True
         else:
@@ -208,6 +352,7 @@ class Signal:
         self.unit = signal.unit # {str} ''
         self.enumeration = {int(k): v for k, v in signal.values.items()} # {dict} {'0': 'Disable', '2': 'Error', '1': 'Enable', '3': 'N/A'}
         self.enumeration_name = signal.enumeration
+        self._enumeration_indexes = None
         self.signed = signal.is_signed
         if self.multiplex is True:
             self.signed = False
@@ -234,9 +379,10 @@ class Signal:
 
         self._format = None
 
-        self.full_string, self.short_string, self.enumeration_text = (
-            self.format_strings(value=self.value)
-        )
+        self._strings = {}
+
+        set_locale()
+
         if connect is not None:
             self.connect(connect)
 
@@ -252,6 +398,9 @@ class Signal:
         return self.offset + (value * self.factor)
 
     def from_human(self, value):
+        if isinstance(value, float):
+            return round((value - self.float_offset) / self.float_factor)
+
         return round((value - self.offset) / self.factor)
 
     def get_human_value(self, for_file=False, column=None, value=nothing):
@@ -268,23 +417,9 @@ class Signal:
 
     def calc_human_value(self, raw_value):
         # TODO: handle offset
-        locale.setlocale(locale.LC_ALL, '')
-
         if isinstance(raw_value, str):
-            enumeration_strings = self.enumeration_strings()
-            if len(enumeration_strings) > 0:
-                try:
-                    index = enumeration_strings.index(raw_value)
-                except ValueError:
-                    enumeration_strings = self.enumeration_strings(
-                        include_values=True)
-                    if len(enumeration_strings) > 0:
-                        try:
-                            index = enumeration_strings.index(raw_value)
-                        except ValueError:
-                            index = int(raw_value)
-
-                value = index
+            if len(self.enumeration) > 0:
+                value = self.enumeration_index(raw_value)
             else:
                 value = decimal.Decimal(locale.delocalize(raw_value))
         else:
@@ -319,6 +454,29 @@ class Signal:
 
         return format.format(v=value, s=self.enumeration[value])
 
+    def enumeration_index(self, string):
+        """The position of an enumeration string, with or without the value
+        included, within enumeration_strings().  Strings that are not in the
+        enumeration are parsed as an integer.
+        """
+        if self._enumeration_indexes is None:
+            indexes = {}
+            for include_values in (False, True):
+                strings = self.enumeration_strings(
+                    include_values=include_values,
+                )
+                for index, s in enumerate(strings):
+                    indexes.setdefault((include_values, s), index)
+
+            self._enumeration_indexes = indexes
+
+        for include_values in (False, True):
+            index = self._enumeration_indexes.get((include_values, string))
+            if index is not None:
+                return index
+
+        return int(string)
+
     def enumeration_strings(self, include_values=False):
         items = list(self.enumeration)
         items.sort()
@@ -389,6 +547,9 @@ class Signal:
         if self.value != value or force:
             self.value = value
 
+            if self.frame is not None:
+                self.frame.signal_changed()
+
             if value not in self.enumeration:
                 # TODO: this should be a subclass or something
                 if self.hexadecimal_output:
@@ -398,20 +559,49 @@ class Signal:
                     # TODO: and _offset...
 
                     self.scaled_value = (
-                        self.offset + (self.value * self.factor)
+                        self.float_offset
+                        + (float(self.value) * self.float_factor)
                     )
 
                     value = self.scaled_value
 
-            self.full_string, self.short_string, self.enumeration_text = (
-                self.format_strings(value=value_parameter)
-            )
-
             if value_parameter is None:
                 self.value_changed.emit(float('nan'))
             else:
                 self.value_changed.emit(value)
 
+    @property
+    def full_string(self):
+        return self.strings()[0]
+
+    @property
+    def short_string(self):
+        return self.strings()[1]
+
+    @property
+    def enumeration_text(self):
+        return self.strings()[2]
+
+    def strings(self):
+        """The display strings for the present value.  They are only
+        formatted when read and are memoized by raw value so that repeated
+        values, such as enumerations and status bits, are formatted once.
+        """
+        value = self.value
+
+        try:
+            return self._strings[value]
+        except KeyError:
+            pass
+
+        strings = self.format_strings(value=value)
+
+        if len(self._strings) >= strings_cache_size:
+            self._strings.clear()
+        self._strings[value] = strings
+
+        return strings
+
     def format_strings(self, value):
         if value is None or (type(value) is float and math.isnan(value)):
             full_string = '-'
@@ -438,7 +628,7 @@ class Signal:
                     # TODO: and _offset...
 
                     scaled_value = (
-                        self.offset + (value * self.factor)
+                        self.float_offset + (float(value) * self.float_factor)
                     )
 
                     full_string = self.format_float(scaled_value)
@@ -479,29 +669,12 @@ class Signal:
 
         return formatted
 
-    def pack_bitstring(self, value=None):
-        if value is None:
-            value = self.value
-        if value is None:
-            value = 0
 
-        try:
-            return pack_bitstring(self.signal_size, self.float, value, self.signed)
-        except OverflowError as e:
-            names = (self.frame.name, self.frame.mux_name, self.name)
-            name = ':'.join(name for name in names if name is not None)
-            raise UnableToPackError(
-                'Unable to pack {value} into {name} with range '
-                '[{minimum}, {maximum}]'.format(
-                    value=value,
-                    name=name,
-                    minimum=self.raw_minimum,
-                    maximum=self.raw_maximum,
-                )
-            ) from e
-
-    def unpack_bitstring(self, bits):
-        return unpack_bitstring(self.signal_size, self.float, self.signed, bits)
+@functools.lru_cache(maxsize=None)
+def set_locale():
+    # Applied once, the user's locale is used for parsing and formatting
+    # human values.
+    locale.setlocale(locale.LC_ALL, '')
 
 
 @functools.lru_cache(10000)
@@ -533,6 +706,16 @@ class QtCanListener(can.Listener):
 
         self.message_received_signal.emit(msg)
 
+    def messages_received(self, messages):
+        for message in messages:
+            self.message_received_signal.emit(message)
+
+    def receive_keys(self):
+        """The (id, extended) keys of the messages this listener wants, or
+        None for all messages.
+        """
+        return None
+
     def move_to_thread(self, thread):
         signal = type(self).message_received_signal
         signal.qobject_host(self).moveToThread(thread)
@@ -569,12 +752,20 @@ class Frame(QtCanListener):
         self._cyclic_period = None
         self.user_send_control = True
         self.block_cyclic = False
-        self.timer = QTimer()
+        self.timer = epyqlib.utils.qt.create_timer()
         self.timer.timeout.connect(self._update_and_send)
 
         self.format_str = None
         self.data = None
 
+        # Signal writes mark the frame dirty so that cyclic sends only
+        # repack and rebuild the message when something has changed.  They
+        # also forget the last received payload so that it will be decoded
+        # again if it repeats.
+        self.dirty = True
+        self._message = None
+        self._received_data = None
+
         self.signals = []
         for signal in frame.signals:
             # TODO: CAMPid 03549854754276996754265427 (repeated <summary> check)
@@ -590,23 +781,21 @@ class Frame(QtCanListener):
                         str(signal.multiplex) == multiplex_value):
                 neo_signal = signal_class(signal=signal, frame=self)
 
-                factor = neo_signal.factor
-                if factor is None:
-                    factor = 1
-
-                offset = neo_signal.offset
-                if offset is None:
-                    offset = decimal.Decimal('0')
-
-                default_value = neo_signal.default_value
-                if default_value is None:
-                    default_value = 0
-
                 if set_value_to_default:
-                    neo_signal.set_human_value(
-                        offset + (default_value * factor))
+                    # The default is already raw so skip the round trip
+                    # through the human value.
+                    default_value = neo_signal.default_value
+                    if default_value is None:
+                        default_value = 0
+
+                    neo_signal.set_value(round(default_value))
 
         self.signals = tuple(self.signals)
+        self._codec = None
+
+        self._signals_by_name = {}
+        for signal in self.signals:
+            index_add(self._signals_by_name, signal.name, signal)
 
         self.mux_value = None
         if self.mux_name is not None:
@@ -615,17 +804,22 @@ class Frame(QtCanListener):
                     self.mux_value = signal.multiplex
                     break
 
+    @property
+    def codec(self):
+        if self._codec is None:
+            self._codec = Codec(length=self.size, signals=self.signals)
+
+        return self._codec
+
     def _update_and_send(self):
         if not self.block_cyclic:
             self._send(update=True)
 
     def signal_by_name(self, name):
-        try:
-            return next(s for s in self.signals if s.name == name)
-        except StopIteration:
-            return None
+        return index_get(self._signals_by_name, name, 'signals')
 
     def update_from_signals(self, function=None, data=None, only_return=False):
+        from_signal_values = data is None and function is None
         if data is None:
             data = self
 
@@ -633,6 +827,10 @@ class Frame(QtCanListener):
 
         if not only_return:
             self.data = data
+            self._message = None
+            # Data not packed from the signal values is replaced by them on
+            # the next updating send as it was before sends were cached.
+            self.dirty = not from_signal_values
 
         return data
 
@@ -654,28 +852,79 @@ class Frame(QtCanListener):
                 data.append(value)
             data = tuple(data)
 
-        return signals_to_bytes(self.size, self.signals, data)
+        return self.codec.pack(data)
 
     def unpack(self, data, report_error=True, only_return=False):
         rx_length = len(data)
         if rx_length != self.size and report_error:
             print('Received message 0x{self.id:08X} with length {rx_length}, expected {self.size}'.format(**locals()))
         else:
-            little, big = bytes_to_bitstrings(bytes(data))
-
-            unpacked = bitstring_to_signal_list(self.signals, big, little)
-
             if only_return:
-                return dict(zip(self.signals, unpacked))
+                return dict(zip(self.signals, self.codec.unpack(data)))
 
-            for s, v in zip(self.signals, unpacked):
+            data = bytes(data)
+            if data == self._received_data:
+                return
+
+            for s, v in zip(self.signals, self.codec.unpack(data)):
                 s.set_value(v)
 
+            self._received_data = data
+
+    def unpack_array(self, data, scaled=True, enumerated=True):
+        """Unpack an N x 8 array of payload bytes into a dict of one NumPy
+        array per signal.  Unlike unpack(), the signals' values are left
+        untouched and nothing is emitted.
+
+        Scaled signals are returned as float arrays.  With ``enumerated``
+        set, signals with an enumeration are returned as object arrays
+        holding the enumeration string wherever one is defined for the raw
+        value.
+        """
+        import numpy
+
+        unpacked = {}
+
+        for signal, raw in zip(self.signals, self.codec.unpack_array(data)):
+            value = raw
+
+            if scaled and not signal.hexadecimal_output:
+                factor = 1 if signal.factor is None else signal.factor
+                offset = 0 if signal.offset is None else signal.offset
+                value = float(offset) + (raw.astype(numpy.float64) * float(factor))
+
+            if enumerated and len(signal.enumeration) > 0:
+                keys = numpy.array(sorted(signal.enumeration))
+                strings = numpy.array(
+                    [signal.enumeration[key] for key in keys],
+                    dtype=object,
+                )
+                indexes = numpy.searchsorted(keys, raw).clip(0, len(keys) - 1)
+                found = keys[indexes] == raw
+                value = numpy.where(
+                    found,
+                    strings[indexes],
+                    value.astype(object),
+                )
+
+            unpacked[signal] = value
+
+        return unpacked
+
     def _send(self, update=False):
-        if update:
+        if update and self.dirty:
             self.data = self.pack(self)
+            self.dirty = False
+            self._message = None
+
+        if self._message is None:
+            self._message = self.to_message()
+
+        self.send.emit(self._message, None)
 
-        self.send.emit(self.to_message(), None)
+    def signal_changed(self):
+        self.dirty = True
+        self._received_data = None
 
     def _sent(self):
         pass
@@ -733,21 +982,22 @@ class Frame(QtCanListener):
             elif self.mux_frame is self:
                 # print(self, self.name, self.mux_name, self.mux_frame, self.mux_frame.name, self.mux_frame.mux_name)
 
-                unpacked = self.mux_frame.unpack(msg.data, only_return=True)
-                mux_signal, = unpacked
+                multiplex_frame = self.multiplex_frames.get(
+                    self.codec.fields[0].extract(msg.data),
+                )
 
                 # TODO: this if added to avoid exceptions temporarily
-                if mux_signal.value in self.multiplex_frames:
-                    unpacked = (
-                        self.multiplex_frames[mux_signal.value]
-                            .message_received(msg)
-                    )
+                if multiplex_frame is not None:
+                    unpacked = multiplex_frame.message_received(msg)
             else:
                 self.unpack(msg.data)
                 unpacked = True
 
         return unpacked
 
+    def receive_keys(self):
+        return {(self.id, self.extended)}
+
     def terminate(self):
         callers = tuple(r for r in self._cyclic_requests)
         for caller in callers:
@@ -756,33 +1006,96 @@ class Frame(QtCanListener):
         logging.debug('{} terminated'.format(object.__repr__(self)))
 
 
-@functools.lru_cache(1024)
-def frame_by_id(id, frames):
-    found = (
-        f for f in frames
-        if f.id == id and f.mux_name is None
-    )
-
-    try:
-        frame, = found
-    except ValueError:
-        return None
+def copy_multiplex_signal(multiplex_signal):
+    return canmatrix.Signal(
+            name=multiplex_signal.name,
+            startBit=multiplex_signal.startBit,
+            size=multiplex_signal.size,
+            is_little_endian=multiplex_signal.is_little_endian,
+            is_signed=multiplex_signal.is_signed,
+            factor=multiplex_signal.factor,
+            offset=multiplex_signal.offset,
+            min=multiplex_signal.min,
+            max=multiplex_signal.max,
+            unit=multiplex_signal.unit,
+            multiplex=multiplex_signal.multiplex)
+
+
+class MultiplexFrames(collections.abc.Mapping):
+    """The frames of a multiplexed message keyed by multiplexer value.  Each
+    frame is built by ``build(value, name)`` the first time it is accessed.
+    """
+
+    def __init__(self, names, build):
+        self.names = dict(names)
+        self._build = build
+        self._frames = {}
+
+        self._values_by_name = {}
+        for value, name in self.names.items():
+            index_add(self._values_by_name, name, value)
+
+    def __getitem__(self, value):
+        try:
+            return self._frames[value]
+        except KeyError:
+            pass
+
+        frame = self._build(value, self.names[value])
+        self._frames[value] = frame
+
+        return frame
+
+    def __contains__(self, value):
+        return value in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def by_name(self, name):
+        value = index_get(self._values_by_name, name, 'frames')
+        if value is None:
+            return None
 
-    return frame
+        return self[value]
 
 
 class Neo(QtCanListener):
     def __init__(self, matrix, frame_class=Frame, signal_class=Signal,
                  rx_interval=0, bus=None, node_id_adjust=None,
-                 strip_summary=True, parent=None):
-        super().__init__(self.message_received, parent=parent)
+                 strip_summary=True, coalesce_interval=None,
+                 lazy_multiplex=False, parent=None):
+        # When coalescing, message_received_signal still carries every
+        # message for consumers that need the full stream while frames
+        # are only handed the latest message per id and mux at each flush.
+        super().__init__(
+            self.message_received if coalesce_interval is None else self.post,
+            parent=parent,
+        )
 
         self.bus = None
+        # Counts frames dropped for arriving within the rx interval
+        self.metrics = getattr(bus, 'metrics', None)
 
         self.frame_rx_timestamps = {}
         self.frame_rx_interval = rx_interval
 
-        frames = []
+        self._mailbox = {}
+        self._mailbox_lock = threading.Lock()
+        self.coalesce_timer = None
+        if coalesce_interval is not None:
+            self.coalesce_timer = epyqlib.utils.qt.create_timer()
+            self.coalesce_timer.setInterval(round(1000 * coalesce_interval))
+            self.coalesce_timer.timeout.connect(self.flush)
+            self.coalesce_timer.start()
+
+        self._frames = ()
+        self._frames_by_id = {}
+        self._frames_by_path = {}
+        self._multiplex_fields = {}
 
         for frame in matrix.frames:
             if node_id_adjust is not None:
@@ -807,7 +1120,7 @@ class Neo(QtCanListener):
                 #     signal = signal_class(signal=signal, frame=neo_frame)
                 #     signal.set_human_value(signal.default_value *
                 #                            signal.factor[float])
-                frames.append(neo_frame)
+                self.add_frame(neo_frame)
             else:
                 # Make a frame with just the multiplexor entry for
                 # parsing messages later
@@ -822,80 +1135,41 @@ class Neo(QtCanListener):
                         frame.attributes['GenMsgCycleTime']
                     )
                 multiplex_frame.extended = frame.extended
-                matrix_signal = canmatrix.Signal(
-                        name=multiplex_signal.name,
-                        startBit=multiplex_signal.startBit,
-                        size=multiplex_signal.size,
-                        is_little_endian=multiplex_signal.is_little_endian,
-                        is_signed=multiplex_signal.is_signed,
-                        factor=multiplex_signal.factor,
-                        offset=multiplex_signal.offset,
-                        min=multiplex_signal.min,
-                        max=multiplex_signal.max,
-                        unit=multiplex_signal.unit,
-                        multiplex=multiplex_signal.multiplex)
-                multiplex_frame.addSignal(matrix_signal)
+                multiplex_frame.addSignal(
+                    copy_multiplex_signal(multiplex_signal),
+                )
                 multiplex_neo_frame = frame_class(
                     frame=multiplex_frame,
                     strip_summary=strip_summary,
                 )
                 multiplex_neo_frame.mux_frame = multiplex_neo_frame
-                frames.append(multiplex_neo_frame)
 
                 multiplex_neo_frame.multiplex_signal =\
                     multiplex_neo_frame.signals[0]
 
-                multiplex_neo_frame.multiplex_frames = {}
-
-                for multiplex_value, multiplex_name in multiplex_signal.values.items():
-                    # For each multiplexed frame, make a frame with
-                    # just those signals.
-                    matrix_frame = canmatrix.Frame(
-                            name=frame.name,
-                            id=frame.id,
-                            size=frame.size,
-                            transmitters=list(frame.transmitters))
-                    matrix_frame.extended = frame.extended
-                    if 'GenMsgCycleTime' in frame.attributes:
-                        matrix_frame.addAttribute(
-                            'GenMsgCycleTime',
-                            frame.attributes['GenMsgCycleTime']
-                        )
-                    matrix_frame.addAttribute('mux_name', multiplex_name)
-                    matrix_frame.addComment(multiplex_signal.comments[int(
-                        multiplex_value)])
-                    matrix_signal = canmatrix.Signal(
-                            name=multiplex_signal.name,
-                            startBit=multiplex_signal.startBit,
-                            size=multiplex_signal.size,
-                            is_little_endian=multiplex_signal.is_little_endian,
-                            is_signed=multiplex_signal.is_signed,
-                            factor=multiplex_signal.factor,
-                            offset=multiplex_signal.offset,
-                            min=multiplex_signal.min,
-                            max=multiplex_signal.max,
-                            unit=multiplex_signal.unit,
-                            multiplex=multiplex_signal.multiplex)
-                    # neo_signal = signal_class(signal=matrix_signal, frame=multiplex_neo_frame)
-                    matrix_frame.addSignal(matrix_signal)
-
-                    for signal in frame.signals:
-                        if signal.multiplex == multiplex_value:
-                            matrix_frame.addSignal(signal)
-
-                    neo_frame = frame_class(
-                        frame=matrix_frame,
+                signals_by_multiplex = {}
+                for signal in frame.signals:
+                    signals_by_multiplex.setdefault(
+                        signal.multiplex, [],
+                    ).append(signal)
+
+                multiplex_neo_frame.multiplex_frames = MultiplexFrames(
+                    names=multiplex_signal.values,
+                    build=functools.partial(
+                        self._build_multiplex_frame,
+                        frame=frame,
+                        multiplex_signal=multiplex_signal,
+                        signals_by_multiplex=signals_by_multiplex,
                         mux_frame=multiplex_neo_frame,
+                        frame_class=frame_class,
                         strip_summary=strip_summary,
-                    )
-                    for signal in neo_frame.signals:
-                        if signal.multiplex is True:
-                            signal.set_value(multiplex_value)
-                    frames.append(neo_frame)
-                    multiplex_neo_frame.\
-                        multiplex_frames[multiplex_value] = neo_frame
+                    ),
+                )
+                self.add_frame(multiplex_neo_frame)
 
-        self.frames = tuple(frames)
+                if not lazy_multiplex:
+                    for _ in multiplex_neo_frame.multiplex_frames.values():
+                        pass
 
         if bus is not None:
             self.set_bus(bus=bus)
@@ -909,94 +1183,250 @@ class Neo(QtCanListener):
         for frame in self.frames:
             frame.send.connect(self.bus.send)
 
-    def frame_by_id(self, id):
-        return frame_by_id(id, self.frames)
-
-    def frame_by_name(self, name):
-        try:
-            return next(f for f in self.frames if f.name == name)
-        except StopIteration:
-            return None
+    def _build_multiplex_frame(self, multiplex_value, multiplex_name, frame,
+                               multiplex_signal, signals_by_multiplex,
+                               mux_frame, frame_class, strip_summary):
+        # For each multiplexed frame, make a frame with
+        # just those signals.
+        matrix_frame = canmatrix.Frame(
+                name=frame.name,
+                id=frame.id,
+                size=frame.size,
+                transmitters=list(frame.transmitters))
+        matrix_frame.extended = frame.extended
+        if 'GenMsgCycleTime' in frame.attributes:
+            matrix_frame.addAttribute(
+                'GenMsgCycleTime',
+                frame.attributes['GenMsgCycleTime']
+            )
+        matrix_frame.addAttribute('mux_name', multiplex_name)
+        matrix_frame.addComment(multiplex_signal.comments[int(
+            multiplex_value)])
+        matrix_frame.addSignal(copy_multiplex_signal(multiplex_signal))
+
+        for signal in signals_by_multiplex.get(multiplex_value, ()):
+            matrix_frame.addSignal(signal)
+
+        neo_frame = frame_class(
+            frame=matrix_frame,
+            mux_frame=mux_frame,
+            strip_summary=strip_summary,
+        )
+        for signal in neo_frame.signals:
+            if signal.multiplex is True:
+                signal.set_value(multiplex_value)
 
-    def signal_by_path(self, *elements):
-        i = iter(elements)
+        self.add_frame(neo_frame)
+        if self.bus is not None:
+            neo_frame.send.connect(self.bus.send)
+
+        return neo_frame
+
+    @property
+    def frames(self):
+        return self._frames
+
+    @frames.setter
+    def frames(self, frames):
+        self._frames = ()
+        self._frames_by_id = {}
+        self._frames_by_path = {}
+        self._multiplex_fields = {}
+
+        for frame in frames:
+            self.add_frame(frame)
+
+    def add_frame(self, frame):
+        """Append a frame and index it by name and for dispatch of received
+        messages.  Multiplexed frames are indexed by their base frame name
+        and mux name and are otherwise reached through the multiplexer
+        value.  Base frames sharing an id are ambiguous and are indexed as
+        None.
+        """
+        self._frames += (frame,)
+
+        if frame.mux_name is not None:
+            index_add(
+                self._frames_by_path,
+                (frame.mux_frame.name, frame.mux_name),
+                frame,
+            )
+            return
 
-        def get_next(i):
-            try:
-                return next(i)
-            except StopIteration as e:
-                raise NotFoundError(repr(elements)) from e
+        index_add(self._frames_by_path, (frame.name,), frame)
 
-        element = get_next(i)
+        key = (frame.id, frame.extended)
 
-        frame = self.frame_by_name(element)
+        if key in self._frames_by_id:
+            self._frames_by_id[key] = None
+            self._multiplex_fields.pop(key, None)
+            return
 
-        if frame is None:
-            raise NotFoundError(repr(elements))
+        self._frames_by_id[key] = frame
 
         if hasattr(frame, 'multiplex_frames'):
-            element = get_next(i)
+            self._multiplex_fields[key] = frame.codec.fields[0]
 
-            frames = (
-                f for f in frame.multiplex_frames.values()
-                if f.mux_name == element
-            )
-            try:
-                [frame] = frames
-            except ValueError:
-                raise NotFoundError(repr(elements))
+    def frame_by_id(self, id, extended=None):
+        if extended is not None:
+            return self._frames_by_id.get((id, bool(extended)))
+
+        found = [
+            self._frames_by_id[key]
+            for key in ((id, False), (id, True))
+            if key in self._frames_by_id
+        ]
+
+        try:
+            frame, = found
+        except ValueError:
+            return None
+
+        return frame
+
+    def frame_by_name(self, name):
+        return index_get(self._frames_by_path, (name,), 'frames')
+
+    def _frame_by_path(self, path):
+        frame = index_get(self._frames_by_path, path, 'frames')
+
+        if frame is None and len(path) == 2:
+            # the multiplexed frame may not have been built yet
+            base_frame = index_get(self._frames_by_path, path[:1], 'frames')
+            if hasattr(base_frame, 'multiplex_frames'):
+                frame = base_frame.multiplex_frames.by_name(path[1])
 
-        element = get_next(i)
+        return frame
 
-        signal = frame.signal_by_name(element)
+    def signal_by_path(self, *elements):
+        """Find a signal by frame name, mux name for multiplexed frames, and
+        signal name.
+        """
+        frame = None
+        if len(elements) >= 2:
+            frame = self._frame_by_path(elements[:-1])
+
+        if frame is None or hasattr(frame, 'multiplex_frames'):
+            raise NotFoundError(repr(elements))
+
+        signal = frame.signal_by_name(elements[-1])
         if signal is None:
             raise NotFoundError(repr(elements))
 
         return signal
 
+    def unpack_arrays(self, identifiers, data, scaled=True, enumerated=True):
+        """Unpack a recorded trace given as an array of N arbitration ids and
+        an N x 8 array of payload bytes.  Rows are grouped by frame and, for
+        multiplexed frames, by multiplexer value.
+
+        Returns a dict mapping each frame present in the trace to a tuple of
+        the row indexes belonging to it and the result of
+        Frame.unpack_array() for those rows.
+        """
+        import numpy
+
+        identifiers = numpy.asarray(identifiers)
+        data = numpy.asarray(data, dtype=numpy.uint8)
+
+        unpacked = {}
+
+        for identifier in numpy.unique(identifiers):
+            rows, = numpy.nonzero(identifiers == identifier)
+
+            frame = self.frame_by_id(int(identifier))
+            if frame is None:
+                continue
+
+            if not hasattr(frame, 'multiplex_frames'):
+                groups = ((frame, rows),)
+            else:
+                multiplex_values, = frame.codec.unpack_array(data[rows])
+                groups = []
+                for multiplex_value in numpy.unique(multiplex_values):
+                    multiplex_frame = frame.multiplex_frames.get(
+                        int(multiplex_value),
+                    )
+                    if multiplex_frame is not None:
+                        groups.append((
+                            multiplex_frame,
+                            rows[multiplex_values == multiplex_value],
+                        ))
+
+            for group_frame, group_rows in groups:
+                unpacked[group_frame] = (
+                    group_rows,
+                    group_frame.unpack_array(
+                        data[group_rows],
+                        scaled=scaled,
+                        enumerated=enumerated,
+                    ),
+                )
+
+        return unpacked
+
     def get_multiplex(self, message):
-        base_frame = self.frame_by_id(message.arbitration_id)
+        key = (message.arbitration_id, bool(message.id_type))
+        base_frame = self._frames_by_id.get(key)
 
-        if not hasattr(base_frame, 'multiplex_frames'):
-            frame = base_frame
-            multiplex_value = None
-        else:
-            # finish the multiplex thing
-            base_frame.unpack(message.data, report_error=False)
-            multiplex_value = base_frame.multiplex_signal.value
-            try:
-                frame = base_frame.multiplex_frames[multiplex_value]
-            except KeyError:
-                return (base_frame, None)
+        field = self._multiplex_fields.get(key)
+        if field is None:
+            return (base_frame, None)
+
+        multiplex_value = field.extract(message.data)
+        try:
+            frame = base_frame.multiplex_frames[multiplex_value]
+        except KeyError:
+            return (base_frame, None)
 
         return (frame, multiplex_value)
 
+    def post(self, msg):
+        """Keep the message until the next flush, replacing any earlier
+        one with the same id and mux.
+        """
+        key = (msg.arbitration_id, bool(msg.id_type))
+        field = self._multiplex_fields.get(key)
+        if field is not None:
+            key += (field.extract(msg.data),)
+
+        with self._mailbox_lock:
+            self._mailbox[key] = msg
+
+    def flush(self):
+        """Deliver the latest message received for each id and mux since
+        the previous flush.  Called periodically when coalescing.
+        """
+        with self._mailbox_lock:
+            mailbox = self._mailbox
+            self._mailbox = {}
+
+        for msg in mailbox.values():
+            self.message_received(msg)
+
     def message_received(self, msg):
-        frame = self.frame_by_id(msg.arbitration_id)
+        frame = self._frames_by_id.get(
+            (msg.arbitration_id, bool(msg.id_type)),
+        )
         if frame is not None:
             last = self.frame_rx_timestamps.get(frame,
                                                 -self.frame_rx_interval)
             if msg.timestamp - last >= self.frame_rx_interval:
                 self.frame_rx_timestamps[frame] = msg.timestamp
                 frame.message_received_signal.emit(msg)
+            elif self.metrics is not None:
+                self.metrics.dropped(msg, reason='rx_interval')
+
+    def receive_keys(self):
+        return set(self._frames_by_id)
 
     def terminate(self):
+        if self.coalesce_timer is not None:
+            self.coalesce_timer.stop()
+
         for frame in self.frames:
             frame.terminate()
 
-        cached_functions = (
-            pack_bitstring,
-            unpack_bitstring,
-            bytes_to_bitstrings,
-            bitstring_to_signal_list,
-            signals_to_bytes,
-        )
-
-        for f in cached_functions:
-            logging.debug('epyqlib.canneo.{}(): {}'.format(
-                f.__name__,
-                f.cache_info(),
-            ))
         logging.debug('{} terminated'.format(object.__repr__(self)))
 
 
@@ -0,0 +1,295 @@
+import logging
+
+import attr
+
+import epyqlib.simulatedbus
+import epyqlib.twisted.cancalibrationprotocol as ccp
+
+# See file COPYING in this source tree
+__copyright__ = 'Copyright 2018, EPC Power Corp.'
+__license__ = 'GPLv2+'
+
+
+logger = logging.getLogger(__name__)
+
+
+# TODO: magic number 5!
+upload_payload_length = 5
+
+
+@attr.s
+class Fault:
+    """Answer the next ``count`` commands with ``code`` by replying with
+    ``status``, or not at all if ``status`` is None.
+    """
+    code = attr.ib(converter=ccp.CommandCode)
+    status = attr.ib(default=None)
+    count = attr.ib(default=1)
+
+
+@attr.s
+class Target:
+    """Answer CCP commands as the bootloader or the data logger of a device
+    would.
+
+    Memory is held per address extension as a bytearray with two bytes per
+    address, the usual layout for the DSPs at the other end of
+    :class:`epyqlib.twisted.cancalibrationprotocol.Handler`.  Downloaded
+    bytes are stored as they arrive on the bus and uploads send them back
+    the same way.  Memory not yet written reads as ``fill``.
+
+    Replies to commands listed in ``delays`` are held back by the given
+    number of seconds when the target is used through
+    :class:`epyqlib.simulatedbus.SimulatedBus` or
+    :class:`epyqlib.simulatedbus.Server`.  See :meth:`inject_fault` for
+    failing commands on purpose.
+    """
+    command_id = attr.ib(default=ccp.bootloader_can_id)
+    reply_id = attr.ib(default=ccp.bootloader_can_id)
+    endianness = attr.ib(default='big')
+    version = attr.ib(default=(1, 0))
+    dsp_code = attr.ib(default=ccp.DspCode._28335)
+    password = attr.ib(default=ccp.Password.dsp_flash)
+    memory = attr.ib(default=attr.Factory(dict))
+    fill = attr.ib(default=0xFF)
+    delays = attr.ib(default=attr.Factory(dict))
+    faults = attr.ib(default=attr.Factory(list))
+    connected = attr.ib(default=False)
+    unlocked = attr.ib(default=False)
+    continuous_crc = attr.ib(default=None)
+    command_counts = attr.ib(default=attr.Factory(dict))
+    _address_extension = attr.ib(default=None, init=False, repr=False)
+    _offset = attr.ib(default=0, init=False, repr=False)
+    _crc = attr.ib(default=None, init=False, repr=False)
+    _crc_length = attr.ib(default=0, init=False, repr=False)
+
+    def inject_fault(self, code, status=None, count=1):
+        self.faults.append(Fault(code=code, status=status, count=count))
+
+    def read(self, address_extension, address, octets):
+        start = 2 * address
+        self._reserve(address_extension, start + octets)
+
+        return bytes(self.memory[address_extension][start:start + octets])
+
+    def write(self, address_extension, address, data):
+        self._write_bytes(address_extension, 2 * address, data)
+
+    def _reserve(self, address_extension, length):
+        memory = self.memory.setdefault(address_extension, bytearray())
+        if len(memory) < length:
+            memory.extend([self.fill] * (length - len(memory)))
+
+        return memory
+
+    def _write_bytes(self, address_extension, offset, data):
+        data = bytes(data)
+        memory = self._reserve(address_extension, offset + len(data))
+        memory[offset:offset + len(data)] = data
+
+    def _fault(self, code):
+        for fault in self.faults:
+            if fault.code == code and fault.count > 0:
+                fault.count -= 1
+                if fault.count == 0:
+                    self.faults.remove(fault)
+
+                return fault
+
+        return None
+
+    def __call__(self, message):
+        if (message.arbitration_id != self.command_id
+                or not message.id_type
+                or len(message.data) != 8
+                or message.data[0] == 0xFF):
+            return ()
+
+        packet = ccp.Packet.from_message(message=message)
+
+        try:
+            code = packet.command_code
+        except ValueError:
+            code = None
+
+        if code is not None:
+            self.command_counts[code] = self.command_counts.get(code, 0) + 1
+
+        if not self.connected and code is not ccp.CommandCode.connect:
+            return ()
+
+        fault = self._fault(code) if code is not None else None
+        if fault is not None:
+            if fault.status is None:
+                return ()
+
+            return self._replies(
+                code=code,
+                packet=packet,
+                payloads=[()],
+                status=fault.status,
+            )
+
+        handler = {
+            ccp.CommandCode.connect: self._connect,
+            ccp.CommandCode.disconnect: self._disconnect,
+            ccp.CommandCode.set_mta: self._set_mta,
+            ccp.CommandCode.unlock: self._unlock,
+            ccp.CommandCode.download: self._download,
+            ccp.CommandCode.download_6: self._download_6,
+            ccp.CommandCode.upload: self._upload,
+            ccp.CommandCode.build_checksum: self._build_checksum,
+            ccp.CommandCode.clear_memory: self._clear_memory,
+        }.get(code)
+
+        if handler is None:
+            status, payloads = ccp.CommandStatus.unknown_command, [()]
+        else:
+            status, payloads = handler(packet.payload)
+
+        return self._replies(
+            code=code,
+            packet=packet,
+            payloads=payloads,
+            status=status,
+        )
+
+    def _replies(self, code, packet, payloads, status):
+        delay = self.delays.get(code, 0)
+
+        replies = []
+        for payload in payloads:
+            reply = ccp.BootloaderReply(
+                code=ccp.CommandStatus(status),
+                arbitration_id=self.reply_id,
+            )
+            reply.message.data[0] = 0xFF
+            reply.command_counter = packet.command_counter
+            payload = bytes(payload)
+            reply.payload[0:len(payload)] = payload
+
+            message = reply.message
+            if delay > 0:
+                message = epyqlib.simulatedbus.Delayed(
+                    message=message,
+                    delay=delay,
+                )
+            replies.append(message)
+
+        return replies
+
+    def _connect(self, payload):
+        self.connected = True
+        self.unlocked = False
+
+        major, minor = self.version
+        return ccp.CommandStatus.acknowledge, [
+            [major, minor, *int(self.dsp_code).to_bytes(2, 'big')],
+        ]
+
+    def _disconnect(self, payload):
+        self.connected = False
+        self.unlocked = False
+
+        return ccp.CommandStatus.acknowledge, [()]
+
+    def _set_mta(self, payload):
+        self._address_extension = payload[1]
+        address = int.from_bytes(bytes(payload[2:6]), self.endianness)
+        self._offset = 2 * address
+        self._crc = None
+        self._crc_length = 0
+
+        return ccp.CommandStatus.acknowledge, [()]
+
+    def _unlock(self, payload):
+        section = int.from_bytes(bytes(payload[1:3]), self.endianness)
+        if section != self.password:
+            return ccp.CommandStatus.access_denied, [()]
+
+        self.unlocked = True
+
+        return ccp.CommandStatus.acknowledge, [()]
+
+    def _flash_locked(self):
+        return (
+            self._address_extension == ccp.AddressExtension.flash_memory
+            and not self.unlocked
+        )
+
+    def _store(self, data):
+        if self._address_extension is None:
+            return ccp.CommandStatus.command_syntax, [()]
+
+        if self._flash_locked():
+            return ccp.CommandStatus.access_locked, [()]
+
+        self._write_bytes(self._address_extension, self._offset, data)
+        self._offset += len(data)
+
+        self._crc = ccp.crc(data=data, crc=self._crc)
+        self.continuous_crc = ccp.crc(data=data, crc=self.continuous_crc)
+        self._crc_length += len(data)
+
+        return ccp.CommandStatus.acknowledge, [()]
+
+    def _download(self, payload):
+        length = payload[0]
+        if not 0 < length <= 5:
+            return ccp.CommandStatus.parameters_out_of_range, [()]
+
+        return self._store(data=bytes(payload[1:1 + length]))
+
+    def _download_6(self, payload):
+        return self._store(data=bytes(payload[0:6]))
+
+    def _upload(self, payload):
+        if self._address_extension is None:
+            return ccp.CommandStatus.command_syntax, [()]
+
+        octets = payload[0]
+        if octets == 0:
+            return ccp.CommandStatus.parameters_out_of_range, [()]
+
+        memory = self._reserve(self._address_extension, self._offset + octets)
+        data = bytes(memory[self._offset:self._offset + octets])
+        self._offset += octets
+
+        return ccp.CommandStatus.acknowledge, [
+            data[i:i + upload_payload_length]
+            for i in range(0, octets, upload_payload_length)
+        ]
+
+    def _build_checksum(self, payload):
+        length = int.from_bytes(bytes(payload[0:4]), self.endianness)
+        checksum = int.from_bytes(bytes(payload[4:6]), self.endianness)
+
+        if length == 0:
+            expected = self.continuous_crc
+        elif length == self._crc_length:
+            expected = self._crc
+        else:
+            expected = None
+
+        self._crc = None
+        self._crc_length = 0
+
+        if checksum != expected:
+            logger.debug(
+                'Checksum mismatch: expected {} but got {:04X}'.format(
+                    expected,
+                    checksum,
+                ),
+            )
+            return ccp.CommandStatus.operational_failure, [()]
+
+        return ccp.CommandStatus.acknowledge, [()]
+
+    def _clear_memory(self, payload):
+        if self._flash_locked():
+            return ccp.CommandStatus.access_locked, [()]
+
+        self.memory.pop(ccp.AddressExtension.flash_memory, None)
+        self.continuous_crc = None
+
+        return ccp.CommandStatus.acknowledge, [()]
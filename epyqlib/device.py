@@ -7,11 +7,11 @@ logger = logging.getLogger(__name__)
 
 import attr
 import can
-import canmatrix.formats
 import collections
 import epyqlib.canneo
 import epyqlib.deviceextension
 import epyqlib.faultlogmodel
+import epyqlib.matrixcache
 try:
     import epyqlib.resources.code
 except ImportError:
@@ -174,7 +174,7 @@ def ignore_timeout(failure):
 
 
 def load_matrix(path):
-    matrix = list(canmatrix.formats.loadp(path).values())[0]
+    matrix = list(epyqlib.matrixcache.loadp(path).values())[0]
 
     if hasattr(matrix, 'load_errors'):
         # https://github.com/ebroecker/canmatrix/pull/199
@@ -190,6 +190,7 @@ def load_matrix(path):
 class Device:
     def __init__(self, *args, **kwargs):
         self.bus = None
+        self.rx = None
         self.from_zip = False
 
         if kwargs.get('file', None) is not None:
@@ -207,6 +208,9 @@ class Device:
 
     def terminate(self):
         if self.bus is not None:
+            if self.rx is not None:
+                self.bus.receive_all(requester=self.rx, enable=False)
+
             while self.notifiees:
                 self.bus.notifier.discard(self.notifiees.pop())
 
@@ -547,6 +551,7 @@ class Device:
 
         self.nv_looping_set = None
         self.nv_tab_looping_set = None
+        self.rx = None
 
         self.rx_interval = rx_interval
         self.serial_number = serial_number
@@ -599,10 +604,11 @@ class Device:
                 signal_class=epyqlib.txrx.SignalNode,
                 node_id_adjust=self.node_id_adjust,
                 strip_summary=False,
+                lazy_multiplex=True,
             )
 
             rx = epyqlib.txrx.TxRx(tx=False, neo=neo_rx)
-            notifiees.append(rx)
+            self.rx = rx
             rx_model = epyqlib.txrx.TxRxModel(rx)
 
             # TODO: put this all in the model...
@@ -861,8 +867,7 @@ class Device:
             self.ui.tabs.removeTab(self.ui.tabs.indexOf(self.ui.variables))
         if Tabs.nv not in tabs:
             self.ui.tabs.removeTab(self.ui.tabs.indexOf(self.ui.nv))
-        else:
-            self.ui.tabs.currentChanged.connect(self.tab_changed)
+        self.ui.tabs.currentChanged.connect(self.tab_changed)
         if Tabs.scripting not in tabs:
             self.ui.tabs.removeTab(self.ui.tabs.indexOf(self.ui.scripting))
         if Tabs.fault_log not in tabs:
@@ -1018,6 +1023,7 @@ class Device:
         monitor_frames = epyqlib.canneo.Neo(
             matrix=monitor_matrix,
             node_id_adjust=self.node_id_adjust,
+            lazy_multiplex=True,
         )
         monitor_frame = monitor_frames.frame_by_name(
             can_configuration.monitor_frame,
@@ -1096,9 +1102,21 @@ class Device:
         for notifiee in notifiees:
             self.bus.notifier.add(notifiee)
 
+        # The raw receive view shows everything on the bus but only needs
+        # it while shown, see tab_changed().
+        if self.rx is not None:
+            self.notifiees.append(self.rx)
+            self.bus.notifier.add(self.rx, observer=True)
+            self.receive_all_for_rx(index=self.ui.tabs.currentIndex())
+
         self.extension.post()
 
     def tab_changed(self, index):
+        self.receive_all_for_rx(index=index)
+
+        if self.ui.tabs.indexOf(self.ui.nv) == -1:
+            return
+
         tabs = {
             self.ui.tabs.indexOf(x)
             for x in (self.ui.nv, self.ui.scripting)
@@ -1110,6 +1128,13 @@ class Device:
             self.nv_looping_set.start()
             self.nv_tab_looping_set.stop()
 
+    def receive_all_for_rx(self, index):
+        if self.rx is not None and self.bus is not None:
+            self.bus.receive_all(
+                requester=self.rx,
+                enable=index == self.ui.tabs.indexOf(self.ui.txrx),
+            )
+
     def absolute_path(self, path=''):
         # TODO: CAMPid 9549757292917394095482739548437597676742
         if not QFileInfo(path).isAbsolute():
@@ -1234,6 +1259,9 @@ class FrameTimeout(epyqlib.canneo.QtCanListener):
             self.present = True
             self.found.emit()
 
+    def receive_keys(self):
+        return self.frame.receive_keys()
+
     def terminate(self):
         self.timer.stop()
 
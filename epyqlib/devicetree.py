@@ -137,7 +137,10 @@ class Bus(TreeNode):
         self._checked = Columns.fill(Qt.Unchecked)
 
         self.bus = epyqlib.busproxy.BusProxy(
-            transmit=self.checked(Columns.indexes.transmit))
+            transmit=self.checked(Columns.indexes.transmit),
+            batch_receive=True,
+            automatic_filters=True,
+        )
 
     def terminate(self):
         self.bus.terminate()
@@ -209,6 +212,7 @@ class Bus(TreeNode):
         else:
             real_bus = None
 
+        self.bus.metrics.bitrate = self.bitrate
         self.bus.set_bus(bus=real_bus)
 
     def set_nickname(self, name):
@@ -5,10 +5,10 @@ import pathlib
 import uuid
 
 import attr
-import canmatrix
 import twisted.internet.defer
 
 import epyqlib.canneo
+import epyqlib.matrixcache
 import epyqlib.nv
 import epyqlib.utils.twisted
 
@@ -54,8 +54,8 @@ class Definition:
     # nv_meta_enum = attr.ib()
 
     def load_can(self):
-        matrix, = canmatrix.formats.loadp(
-            str(self.base_path / self.can_path)
+        matrix, = epyqlib.matrixcache.loadp(
+            self.base_path / self.can_path
         ).values()
 
         return matrix
@@ -209,10 +209,11 @@ class Nv:
             )
 
     @twisted.internet.defer.inlineCallbacks
-    def get(self, meta=epyqlib.nv.MetaEnum.value):
+    def get(self, meta=epyqlib.nv.MetaEnum.value, max_age=None):
         value, _meta = yield self.device.nvs.protocol.read(
             nv_signal=self.nv,
             meta=meta,
+            max_age=max_age,
         )
 
         return value
@@ -258,6 +259,16 @@ class Device:
     save_nv = attr.ib(default=None)
     save_nv_value = attr.ib(default=None)
     uuid = attr.ib(default=uuid.uuid4)
+    _signal_wrappers = attr.ib(
+        default=attr.Factory(dict),
+        init=False,
+        repr=False,
+    )
+    _nv_wrappers = attr.ib(
+        default=attr.Factory(dict),
+        init=False,
+        repr=False,
+    )
 
     def load(self):
         if self.definition is not None:
@@ -276,6 +287,7 @@ class Device:
         self.neo = epyqlib.canneo.Neo(
             matrix=matrix,
             node_id_adjust=node_id_adjust,
+            lazy_multiplex=True,
         )
 
         nv_neo = epyqlib.canneo.Neo(
@@ -314,19 +326,29 @@ class Device:
         self.bus.notifier.add(self.neo)
         self.bus.notifier.add(self.nvs)
 
-    # @functools.lru_cache(maxsize=512)
     def signal(self, *path):
-        return Signal(
-            signal=self.neo.signal_by_path(*path),
-            device=self,
-        )
+        signal = self._signal_wrappers.get(path)
+
+        if signal is None:
+            signal = Signal(
+                signal=self.neo.signal_by_path(*path),
+                device=self,
+            )
+            self._signal_wrappers[path] = signal
+
+        return signal
 
-    # @functools.lru_cache(maxsize=512)
     def nv(self, *path):
-        return Nv(
-            nv=self.nvs.signal_from_names(*path),
-            device=self,
-        )
+        nv = self._nv_wrappers.get(path)
+
+        if nv is None:
+            nv = Nv(
+                nv=self.nvs.signal_from_names(*path),
+                device=self,
+            )
+            self._nv_wrappers[path] = nv
+
+        return nv
 
     @twisted.internet.defer.inlineCallbacks
     def active_to_nv(self, wait=False):
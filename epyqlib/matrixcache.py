@@ -0,0 +1,203 @@
+"""Parsed CAN matrices cached by file contents.
+
+The cache directory is trusted.  Cached matrices are unpickled, so
+anything able to write there can run code in processes loading CAN files.
+The directory is managed by this module: entries from other versions are
+removed and only the maximum_entries most recently used are kept.
+"""
+
+import contextlib
+import hashlib
+import logging
+import os
+import pathlib
+import pickle
+import shutil
+import threading
+
+import canmatrix
+import canmatrix.formats
+
+# See file COPYING in this source tree
+__copyright__ = 'Copyright 2018, EPC Power Corp.'
+__license__ = 'GPLv2+'
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cached representation changes incompatibly.
+format_version = 1
+
+# Where parsed matrices are persisted.  None selects default_directory()
+# and False disables the on disk cache.
+directory = None
+
+# How many cached matrices to keep on disk.
+maximum_entries = 20
+
+_memo = {}
+_lock = threading.Lock()
+
+
+def default_directory():
+    base = os.environ.get('LOCALAPPDATA')
+    if base is None:
+        base = pathlib.Path.home() / '.cache'
+
+    return pathlib.Path(base) / 'epyqlib' / 'matrices'
+
+
+def cache_directory():
+    if directory is None:
+        return default_directory()
+
+    if directory is False:
+        return None
+
+    return pathlib.Path(directory)
+
+
+def version_name():
+    return 'format{}-canmatrix{}'.format(
+        format_version,
+        getattr(canmatrix, '__version__', 'unknown'),
+    )
+
+
+def version_directory():
+    path = cache_directory()
+    if path is None:
+        return None
+
+    return path / version_name()
+
+
+def cache_key(content, suffix):
+    hash = hashlib.sha256()
+    for part in (
+            str(format_version),
+            getattr(canmatrix, '__version__', ''),
+            suffix.casefold(),
+    ):
+        hash.update(part.encode('utf-8'))
+        hash.update(b'\0')
+    hash.update(content)
+
+    return hash.hexdigest()
+
+
+def read(key):
+    path = version_directory()
+    if path is None:
+        return None
+
+    try:
+        pickled = (path / key).read_bytes()
+    except OSError:
+        return None
+
+    # Pruning keeps the most recently used entries.
+    with contextlib.suppress(OSError):
+        os.utime(path / key)
+
+    return pickled
+
+
+def write(key, pickled):
+    path = version_directory()
+    if path is None:
+        return
+
+    temporary = path / '{}.{}.tmp'.format(key, os.getpid())
+
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+        temporary.write_bytes(pickled)
+        os.replace(temporary, path / key)
+    except OSError:
+        logger.warning('Unable to cache matrix in {}'.format(path))
+        return
+
+    prune()
+
+
+def modified(path):
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return 0
+
+
+def prune():
+    """Remove cache entries for other versions and all but the
+    maximum_entries most recently used for this one.
+    """
+    path = cache_directory()
+    if path is None:
+        return
+
+    current = version_name()
+
+    try:
+        others = [entry for entry in path.iterdir() if entry.name != current]
+        entries = [
+            entry
+            for entry in (path / current).iterdir()
+            if entry.suffix != '.tmp'
+        ]
+    except OSError:
+        return
+
+    entries.sort(key=modified, reverse=True)
+
+    for entry in others + entries[maximum_entries:]:
+        try:
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+        except OSError:
+            logger.warning('Unable to remove cached matrix {}'.format(entry))
+
+
+def loadp(path):
+    """Load the matrices in a CAN file as canmatrix.formats.loadp() does.
+
+    The parsed matrices are kept pickled, in memory and on disk, keyed by
+    the file contents and the canmatrix version.  Each call returns a fresh
+    copy since frames are modified in place when building a Neo.
+    """
+    path = pathlib.Path(path)
+    key = cache_key(content=path.read_bytes(), suffix=path.suffix)
+
+    with _lock:
+        pickled = _memo.get(key)
+
+    if pickled is None:
+        pickled = read(key)
+
+        matrices = None
+        if pickled is not None:
+            try:
+                matrices = pickle.loads(pickled)
+            except Exception:
+                logger.warning('Discarding unreadable cached matrix {}'
+                               .format(key))
+                pickled = None
+
+        if pickled is None:
+            matrices = canmatrix.formats.loadp(os.fspath(path))
+            pickled = pickle.dumps(matrices, protocol=pickle.HIGHEST_PROTOCOL)
+            write(key, pickled)
+
+        with _lock:
+            _memo[key] = pickled
+
+        return matrices
+
+    return pickle.loads(pickled)
+
+
+def clear():
+    with _lock:
+        _memo.clear()
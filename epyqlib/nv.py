@@ -87,6 +87,29 @@ class TooManyMetaSignalsError(Exception):
     pass
 
 
+class VerificationError(Exception):
+    pass
+
+
+@attr.s
+class Difference:
+    """A parameter whose raw value on the device is not the one to be
+    written.
+    """
+    nv = attr.ib()
+    meta = attr.ib()
+    device_value = attr.ib()
+    value = attr.ib()
+
+    def __str__(self):
+        return '{} ({}): {} -> {}'.format(
+            self.nv.fields.name,
+            self.meta.name,
+            self.nv.get_human_value(value=self.device_value),
+            self.nv.get_human_value(value=self.value),
+        )
+
+
 @attr.s
 class Configuration:
     set_frame = attr.ib()
@@ -189,6 +212,7 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
     def __init__(self, neo, bus=None, stop_cyclic=None, start_cyclic=None,
                  configuration=None, hierarchy=None, metas=(MetaEnum.value,),
                  access_level_path=None, access_password_path=None,
+                 request_window=4, request_retries=2, write_max_age=None,
                  parent=None):
         TreeNode.__init__(self)
         epyqlib.canneo.QtCanListener.__init__(self, parent=parent)
@@ -201,7 +225,17 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
         self.configuration = configurations[configuration]
 
         from twisted.internet import reactor
-        self.protocol = epyqlib.twisted.nvs.Protocol()
+        # Reading or writing everything keeps up to request_window requests
+        # outstanding rather than waiting out each round trip.  Requests
+        # without a response are sent request_retries more times.  If
+        # write_max_age is given, writing some parameters of a frame fills
+        # in the rest from values seen in the last write_max_age seconds
+        # rather than reading them first.
+        self.protocol = epyqlib.twisted.nvs.Protocol(
+            window=request_window,
+            retries=request_retries,
+            write_max_age=write_max_age,
+        )
         self.transport = epyqlib.twisted.busproxy.BusProxy(
             protocol=self.protocol,
             reactor=reactor,
@@ -229,11 +263,21 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
             raise NoNv()
 
         self.set_frames = self.set_frames.multiplex_frames
+        self.set_frames_by_name = {}
+        for frame in self.set_frames.values():
+            epyqlib.canneo.index_add(
+                self.set_frames_by_name,
+                frame.mux_name,
+                frame,
+            )
         self.status_frames = [
             f for f in self.neo.frames
             if f.name == self.configuration.status_frame
         ][0].multiplex_frames
 
+        self.protocol.keys = self.receive_keys()
+        self.transport.keys_changed.emit()
+
         self.save_frame = None
         self.save_signal = None
         self.save_value = None
@@ -519,6 +563,188 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
             background=background,
         )
 
+    def write_changed_to_device(
+            self,
+            only_these=None,
+            values=(),
+            meta=None,
+            background=False,
+            dry_run=False,
+    ):
+        """Read the device and write only the frames and metas holding
+        parameters that differ, then read those back to verify them.  The
+        result is the list of :class:`Difference` found before writing.
+        With ``dry_run`` nothing is written.
+        """
+        return twisted.internet.defer.ensureDeferred(
+            self._write_changed_to_device(
+                only_these=only_these,
+                values=values,
+                meta=meta,
+                background=background,
+                dry_run=dry_run,
+            ),
+        )
+
+    async def _write_changed_to_device(
+            self,
+            only_these,
+            values,
+            meta,
+            background,
+            dry_run,
+    ):
+        if meta is None:
+            meta = meta_limits_first
+
+        if only_these is None:
+            only_these = self.all_nv()
+
+        wanted = collections.OrderedDict()
+        for enumerator in meta:
+            for nv in only_these:
+                if nv.frame.read_write.min > 0:
+                    continue
+
+                if (nv.frame.meta_signal is None
+                        and enumerator != MetaEnum.value):
+                    continue
+
+                value = self._value_to_write(
+                    signal=nv,
+                    meta=enumerator,
+                    values=values,
+                )
+                if value is not None:
+                    wanted[(nv, enumerator)] = int(value)
+
+        activity = 'Comparing with device' if dry_run else 'Writing changes'
+        if not background:
+            self.activity_started.emit('{}...'.format(activity))
+
+        try:
+            differences = await self._write_differences(
+                wanted=wanted,
+                meta=meta,
+                dry_run=dry_run,
+            )
+        except Exception:
+            if not background:
+                self.activity_ended.emit(
+                    'Failed while {}...'.format(activity.lower()),
+                )
+            raise
+
+        if not background:
+            self.activity_ended.emit('Finished {}, {} found...'.format(
+                activity.lower(),
+                len(differences),
+            ))
+
+        return differences
+
+    async def _write_differences(self, wanted, meta, dry_run):
+        differences = await self._differences(wanted=wanted)
+
+        if dry_run or len(differences) == 0:
+            return differences
+
+        changed = {
+            (difference.nv.frame, difference.meta)
+            for difference in differences
+        }
+        changed = collections.OrderedDict(
+            ((nv, enumerator), value)
+            for (nv, enumerator), value in wanted.items()
+            if (nv.frame, enumerator) in changed
+        )
+
+        # Limits are written before values as for write_all_to_device()
+        for enumerator in meta:
+            nvs = [nv for nv, m in changed if m == enumerator]
+            if len(nvs) > 0:
+                await self.write_all_to_device(
+                    only_these=nvs,
+                    values=changed,
+                    meta=(enumerator,),
+                    background=True,
+                )
+
+        remaining = await self._differences(wanted=changed)
+        if len(remaining) > 0:
+            raise VerificationError(
+                'Device values differ after writing:\n{}'.format(
+                    '\n'.join(str(d) for d in remaining),
+                ),
+            )
+
+        return differences
+
+    async def _differences(self, wanted):
+        if len(wanted) == 0:
+            return []
+
+        nvs_by_meta = collections.OrderedDict()
+        for nv, enumerator in wanted:
+            nvs_by_meta.setdefault(enumerator, []).append(nv)
+
+        # Status frames received while reading also update the local
+        # values, which are still to be written.
+        local_values = {nv: nv.value for nv, _ in wanted}
+
+        mirror = self.protocol.mirror
+        start = mirror.clock()
+        try:
+            await epyqlib.utils.twisted.gather_last([
+                self.read_all_from_device(
+                    only_these=nvs,
+                    meta=(enumerator,),
+                    background=True,
+                )
+                for enumerator, nvs in nvs_by_meta.items()
+            ])
+        finally:
+            for nv, value in local_values.items():
+                nv.set_value(value)
+
+        differences = []
+        for (nv, enumerator), value in wanted.items():
+            mirrored = mirror.get(
+                frame=nv.frame,
+                meta=enumerator,
+                status_signals=(nv.status_signal,),
+                max_age=mirror.clock() - start,
+            )
+            if mirrored is None:
+                raise VerificationError(
+                    'No value read from the device for {} ({})'.format(
+                        nv.fields.name,
+                        enumerator.name,
+                    ),
+                )
+
+            device_value, = mirrored.values()
+
+            if device_value != value:
+                differences.append(Difference(
+                    nv=nv,
+                    meta=enumerator,
+                    device_value=device_value,
+                    value=value,
+                ))
+
+        return differences
+
+    @staticmethod
+    def _value_to_write(signal, meta, values):
+        values_key = (signal, meta)
+        if values_key in values:
+            return values[values_key]
+        elif meta == MetaEnum.value:
+            return signal.value
+
+        return getattr(signal.meta, meta.name).value
+
     def _read_write_all(
             self,
             read,
@@ -539,9 +765,26 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
         d = twisted.internet.defer.Deferred()
         d.callback(None)
 
+        # With a request window all requests are queued at once and the
+        # protocol keeps the window full, otherwise each waits for the
+        # previous to finish.
+        pipelined = self.protocol.window > 1
+        pipelined_requests = []
+
+        def add_request(request):
+            if pipelined:
+                deferred = request(None)
+                if callback is not None:
+                    deferred.addCallback(callback)
+                pipelined_requests.append(deferred)
+            else:
+                d.addCallback(request)
+                if callback is not None:
+                    d.addCallback(callback)
+
         def handle_frame(frame, signals, enumerator):
             if read:
-                d.addCallback(
+                add_request(
                     lambda _, enumerator=enumerator: self.protocol.read_multiple(
                         nv_signals=signals,
                         meta=enumerator,
@@ -553,13 +796,11 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
             elif frame.read_write.min <= 0:
                 not_none_signals = {}
                 for signal in signals:
-                    values_key = (signal, enumerator)
-                    if values_key in values:
-                        value = values[values_key]
-                    elif enumerator == MetaEnum.value:
-                        value = signal.value
-                    else:
-                        value = getattr(signal.meta, enumerator.name).value
+                    value = self._value_to_write(
+                        signal=signal,
+                        meta=enumerator,
+                        values=values,
+                    )
 
                     if value is not None:
                         not_none_signals[signal] = value
@@ -567,7 +808,7 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
                 if len(not_none_signals) == 0:
                     return
 
-                d.addCallback(
+                add_request(
                     lambda _, enumerator=enumerator, not_none_signals=not_none_signals: self.protocol.write_multiple(
                         nv_signals=not_none_signals,
                         meta=enumerator,
@@ -576,11 +817,6 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
                         all_values=True,
                     )
                 )
-            else:
-                return
-
-            if callback is not None:
-                d.addCallback(callback)
 
         if only_these is None:
             only_these = self.all_nv()
@@ -598,6 +834,11 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
                     enumerator=enumerator,
                 )
 
+        if len(pipelined_requests) > 0:
+            d.addCallback(
+                lambda _: epyqlib.utils.twisted.gather_last(pipelined_requests),
+            )
+
         if not background:
             d.addCallback(epyqlib.utils.twisted.detour_result,
                           self.activity_ended.emit,
@@ -608,6 +849,11 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
 
         return d
 
+    def receive_keys(self):
+        status_frame = self.status_frames[0]
+
+        return {(status_frame.id, status_frame.extended)}
+
     def message_received(self, msg):
         if (msg.arbitration_id == self.status_frames[0].id
                 and msg.id_type == self.status_frames[0].extended):
@@ -617,15 +863,27 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
             if multiplex_message is None:
                 return
 
-            if multiplex_value is not None and multiplex_message in self.status_frames.values():
+            is_status = (
+                multiplex_value is not None
+                and self.status_frames.get(multiplex_value) is multiplex_message
+            )
+            if is_status:
                 values = multiplex_message.unpack(msg.data, only_return=True)
 
+                meta = epyqlib.nv.MetaEnum.value
                 if multiplex_message.meta_signal is not None:
                     meta = epyqlib.nv.MetaEnum(
                         values[multiplex_message.meta_signal],
                     )
-                    if meta != epyqlib.nv.MetaEnum.value:
-                        return
+
+                self.protocol.mirror.update(
+                    frame=multiplex_message.set_frame,
+                    meta=meta,
+                    signals=values,
+                )
+
+                if meta != epyqlib.nv.MetaEnum.value:
+                    return
 
                 multiplex_message.unpack(msg.data)
                 # multiplex_message.frame.update_canneo_from_matrix_signals()
@@ -861,23 +1119,20 @@ class Nvs(TreeNode, epyqlib.canneo.QtCanListener):
         return frames
 
     def signal_from_names(self, frame_name, value_name):
-        frame = [f for f in self.set_frames.values()
-                 if f.mux_name == frame_name]
+        frame = epyqlib.canneo.index_get(
+            self.set_frames_by_name,
+            frame_name,
+            'frames',
+        )
 
-        try:
-            frame, = frame
-        except ValueError as e:
-            raise NotFoundError(
-                'Frame not found: {}'.format(frame_name)) from e
+        if frame is None:
+            raise NotFoundError('Frame not found: {}'.format(frame_name))
 
-        signal = [s for s in frame.signals
-                   if s.name == value_name]
+        signal = frame.signal_by_name(value_name)
 
-        try:
-            signal, = signal
-        except ValueError as e:
+        if signal is None:
             raise NotFoundError(
-                'Signal not found: {}:{}'.format(frame_name, value_name)) from e
+                'Signal not found: {}:{}'.format(frame_name, value_name))
 
         return signal
 
@@ -993,6 +1248,9 @@ class Nv(epyqlib.canneo.Signal, TreeNode):
 
         self.reset_value = None
 
+        self.human_raw_minimum = self.to_human(self.raw_minimum)
+        self.human_raw_maximum = self.to_human(self.raw_maximum)
+
         self.clear(mark_modified=False)
 
         self.fields = Columns(
@@ -1176,60 +1434,54 @@ class Nv(epyqlib.canneo.Signal, TreeNode):
 
         self.set_meta(signal.reset_value, meta=meta)
 
-    def check_value(self, value, force=False, check_range=False):
-        min_max = {MetaEnum.minimum, MetaEnum.maximum}
+    def range_limits(self, check_range):
+        # The limits are only consulted when checking the range.
+        if not check_range or self.meta is None:
+            return {}
 
         extras = {}
 
-        if self.meta is not None:
-            if self.meta.minimum.value is None or self.meta_value in min_max:
-                extras['minimum'] = self.to_human(self.raw_minimum)
-            else:
-                extras['minimum'] = self.meta.minimum.to_human(
-                    self.meta.minimum.value,
-                )
+        min_max = {MetaEnum.minimum, MetaEnum.maximum}
 
-            if self.meta.maximum.value is None or self.meta_value in min_max:
-                extras['maximum'] = self.to_human(self.raw_maximum)
-            else:
-                extras['maximum'] = self.meta.maximum.to_human(
-                    self.meta.maximum.value,
-                )
+        if self.meta.minimum.value is None or self.meta_value in min_max:
+            extras['minimum'] = self.human_raw_minimum
+        else:
+            extras['minimum'] = self.meta.minimum.to_human(
+                self.meta.minimum.value,
+            )
+
+        if self.meta.maximum.value is None or self.meta_value in min_max:
+            extras['maximum'] = self.human_raw_maximum
+        else:
+            extras['maximum'] = self.meta.maximum.to_human(
+                self.meta.maximum.value,
+            )
+
+        return extras
+
+    def check_value(self, value, force=False, check_range=False, limits=None):
+        if limits is None:
+            limits = self.range_limits(check_range=check_range)
 
         return super().check_value(
             value=value,
             check_range=check_range,
-            **extras,
+            **limits,
         )
 
     def set_value(self, value, force=False, check_range=False):
+        extras = self.range_limits(check_range=check_range)
+
         ok = self.check_value(
             value=value,
             check_range=check_range,
+            limits=extras,
         )
         if not ok:
             return False
 
         self.reset_value = value
 
-        min_max = {MetaEnum.minimum, MetaEnum.maximum}
-
-        if self.meta is not None:
-            extras = {}
-            if self.meta.minimum.value is None or self.meta_value in min_max:
-                extras['minimum'] = self.to_human(self.raw_minimum)
-            else:
-                extras['minimum'] = self.meta.minimum.to_human(
-                    self.meta.minimum.value,
-                )
-
-            if self.meta.maximum.value is None or self.meta_value in min_max:
-                extras['maximum'] = self.to_human(self.raw_maximum)
-            else:
-                extras['maximum'] = self.meta.maximum.to_human(
-                    self.meta.maximum.value,
-                )
-
         super().set_value(
             value=value,
             force=force,
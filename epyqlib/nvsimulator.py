@@ -0,0 +1,279 @@
+import logging
+
+import attr
+import can
+
+import epyqlib.canneo
+import epyqlib.nv
+
+# See file COPYING in this source tree
+__copyright__ = 'Copyright 2018, EPC Power Corp.'
+__license__ = 'GPLv2+'
+
+
+logger = logging.getLogger(__name__)
+
+
+def to_configuration(configuration):
+    if isinstance(configuration, epyqlib.nv.Configuration):
+        return configuration
+
+    if configuration is None:
+        configuration = 'original'
+
+    return epyqlib.nv.configurations[configuration]
+
+
+def base_frame(neo, name):
+    frame, = (
+        frame
+        for frame in neo.frames
+        if frame.name == name and frame.mux_name is None
+    )
+
+    return frame
+
+
+def enumeration_key(signal, value):
+    for key, name in signal.enumeration.items():
+        if name == value:
+            return int(key)
+
+    return None
+
+
+@attr.s
+class Parameter:
+    set_index = attr.ib()
+    status_index = attr.ib()
+    signal = attr.ib()
+
+
+@attr.s
+class Multiplexer:
+    """The signal layout of one multiplexed pair of NV set and status
+    frames.
+    """
+    multiplex_value = attr.ib()
+    set_frame = attr.ib()
+    status_frame = attr.ib()
+    read_write_index = attr.ib()
+    status_read_write_index = attr.ib()
+    meta_index = attr.ib()
+    status_meta_index = attr.ib()
+    parameters = attr.ib()
+    read_only = attr.ib()
+    read_value = attr.ib()
+    status_read_value = attr.ib()
+    status_write_value = attr.ib()
+
+    @classmethod
+    def build(cls, multiplex_value, set_frame, status_frame, configuration):
+        def index(frame, name):
+            if name is None:
+                return None
+
+            for i, signal in enumerate(frame.signals):
+                if signal.name == name:
+                    return i
+
+            return None
+
+        read_write_index = index(
+            set_frame,
+            configuration.read_write_signal,
+        )
+        status_read_write_index = index(
+            status_frame,
+            configuration.read_write_status_signal,
+        )
+        meta_index = index(set_frame, configuration.meta_signal)
+        status_meta_index = index(status_frame, configuration.meta_signal)
+
+        status_indexes = {
+            signal.start_bit: i
+            for i, signal in enumerate(status_frame.signals)
+        }
+
+        skipped = {0, read_write_index, meta_index}
+        parameters = [
+            Parameter(
+                set_index=i,
+                status_index=status_indexes[signal.start_bit],
+                signal=signal,
+            )
+            for i, signal in enumerate(set_frame.signals)
+            if i not in skipped and signal.start_bit in status_indexes
+        ]
+
+        read_write = set_frame.signals[read_write_index]
+        status_read_write = status_frame.signals[status_read_write_index]
+
+        return cls(
+            multiplex_value=multiplex_value,
+            set_frame=set_frame,
+            status_frame=status_frame,
+            read_write_index=read_write_index,
+            status_read_write_index=status_read_write_index,
+            meta_index=meta_index,
+            status_meta_index=status_meta_index,
+            parameters=parameters,
+            read_only=read_write.min > 0,
+            read_value=enumeration_key(read_write, 'Read'),
+            status_read_value=enumeration_key(status_read_write, 'Read'),
+            status_write_value=enumeration_key(status_read_write, 'Write'),
+        )
+
+
+@attr.s
+class Device:
+    """Answer NV parameter requests as a device would.
+
+    Requests arriving in the configured set frame are answered in the
+    matching multiplexed status frame.  Writes are stored per meta unless
+    the frame is read only.  Values are raw and keyed by mux name, signal
+    name and meta, the latter None when the interface has no meta signal.
+    Unwritten values start at the signal default, or for the minimum and
+    maximum metas the signal limits.
+
+    Instances are responders for :class:`epyqlib.simulatedbus.SimulatedBus`
+    and :class:`epyqlib.simulatedbus.Server`.
+    """
+    neo = attr.ib()
+    configuration = attr.ib(default=None, converter=to_configuration)
+    values = attr.ib(default=attr.Factory(dict))
+    request_count = attr.ib(default=0)
+    _set_frame = attr.ib(init=False, repr=False)
+    _status_frame = attr.ib(init=False, repr=False)
+    _multiplexers = attr.ib(init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self._set_frame = base_frame(self.neo, self.configuration.set_frame)
+        self._status_frame = base_frame(
+            self.neo,
+            self.configuration.status_frame,
+        )
+
+        self._multiplexers = {}
+        status_frames = self._status_frame.multiplex_frames
+        for value, set_frame in self._set_frame.multiplex_frames.items():
+            status_frame = status_frames.get(value)
+            if status_frame is None:
+                continue
+
+            self._multiplexers[value] = Multiplexer.build(
+                multiplex_value=value,
+                set_frame=set_frame,
+                status_frame=status_frame,
+                configuration=self.configuration,
+            )
+
+    @classmethod
+    def from_matrix(cls, matrix, node_id_adjust=None, **kwargs):
+        neo = epyqlib.canneo.Neo(
+            matrix=matrix,
+            node_id_adjust=node_id_adjust,
+            strip_summary=False,
+        )
+
+        return cls(neo=neo, **kwargs)
+
+    def initial_value(self, signal, meta):
+        if meta == epyqlib.nv.MetaEnum.minimum and signal.min is not None:
+            return int(signal.from_human(signal.min))
+
+        if meta == epyqlib.nv.MetaEnum.maximum and signal.max is not None:
+            return int(signal.from_human(signal.max))
+
+        if signal.default_value is not None:
+            return int(signal.default_value)
+
+        return 0
+
+    def value(self, mux_name, name, meta=None):
+        parameter = self._parameter(mux_name=mux_name, name=name)
+
+        return self.values.get(
+            (mux_name, name, meta),
+            self.initial_value(signal=parameter.signal, meta=meta),
+        )
+
+    def set_value(self, mux_name, name, value, meta=None):
+        self._parameter(mux_name=mux_name, name=name)
+        self.values[(mux_name, name, meta)] = int(value)
+
+    def _parameter(self, mux_name, name):
+        for multiplexer in self._multiplexers.values():
+            if multiplexer.set_frame.mux_name != mux_name:
+                continue
+
+            for parameter in multiplexer.parameters:
+                if parameter.signal.name == name:
+                    return parameter
+
+        raise epyqlib.canneo.NotFoundError(
+            'Parameter not found: {}:{}'.format(mux_name, name),
+        )
+
+    def __call__(self, message):
+        set_frame = self._set_frame
+        if (message.arbitration_id != set_frame.id
+                or bool(message.id_type) != set_frame.extended):
+            return ()
+
+        multiplexer = self._multiplexers.get(
+            set_frame.codec.fields[0].extract(message.data),
+        )
+        if multiplexer is None:
+            return ()
+
+        self.request_count += 1
+
+        request = multiplexer.set_frame.codec.unpack(message.data)
+        read = request[multiplexer.read_write_index] == multiplexer.read_value
+
+        if multiplexer.meta_index is None:
+            meta = None
+        else:
+            meta = epyqlib.nv.MetaEnum(request[multiplexer.meta_index])
+
+        mux_name = multiplexer.set_frame.mux_name
+
+        if not read and not multiplexer.read_only:
+            for parameter in multiplexer.parameters:
+                self.values[(mux_name, parameter.signal.name, meta)] = (
+                    request[parameter.set_index]
+                )
+
+        status_frame = multiplexer.status_frame
+        response = [0] * len(status_frame.signals)
+        response[0] = multiplexer.multiplex_value
+
+        status_read_write = (
+            multiplexer.status_read_value
+            if read
+            else multiplexer.status_write_value
+        )
+        if status_read_write is None:
+            status_read_write = int(read)
+        response[multiplexer.status_read_write_index] = status_read_write
+
+        if multiplexer.status_meta_index is not None:
+            response[multiplexer.status_meta_index] = (
+                request[multiplexer.meta_index]
+            )
+
+        for parameter in multiplexer.parameters:
+            response[parameter.status_index] = self.values.get(
+                (mux_name, parameter.signal.name, meta),
+                self.initial_value(signal=parameter.signal, meta=meta),
+            )
+
+        return (
+            can.Message(
+                arbitration_id=status_frame.id,
+                extended_id=status_frame.extended,
+                dlc=status_frame.size,
+                data=status_frame.codec.pack(response),
+            ),
+        )
@@ -0,0 +1,201 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+import attr
+import can
+
+# See file COPYING in this source tree
+__copyright__ = 'Copyright 2018, EPC Power Corp.'
+__license__ = 'GPLv2+'
+
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s
+class Delayed:
+    """A response to be held back for an extra delay, such as for a slow
+    command.
+    """
+    message = attr.ib()
+    delay = attr.ib(default=0)
+
+
+@attr.s
+class Link:
+    """Delay and drop responses as a somewhat unreliable bus would.
+
+    Each response is delayed by ``latency`` plus up to ``jitter`` seconds
+    and dropped with probability ``drop_rate``.
+    """
+    latency = attr.ib(default=0)
+    jitter = attr.ib(default=0)
+    drop_rate = attr.ib(default=0)
+    seed = attr.ib(default=None)
+    _random = attr.ib(init=False, repr=False)
+    _pending = attr.ib(default=attr.Factory(list), init=False, repr=False)
+    _counter = attr.ib(
+        default=attr.Factory(itertools.count),
+        init=False,
+        repr=False,
+    )
+
+    def __attrs_post_init__(self):
+        self._random = random.Random(self.seed)
+
+    def schedule(self, messages, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        for message in messages:
+            if self._random.random() < self.drop_rate:
+                continue
+
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if isinstance(message, Delayed):
+                delay += message.delay
+                message = message.message
+
+            due = now + delay
+            heapq.heappush(self._pending, (due, next(self._counter), message))
+
+    def pop_due(self, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        if len(self._pending) == 0 or self._pending[0][0] > now:
+            return None
+
+        due, _, message = heapq.heappop(self._pending)
+        message.timestamp = time.time()
+
+        return message
+
+    def next_due(self):
+        if len(self._pending) == 0:
+            return None
+
+        return self._pending[0][0]
+
+
+def respond(responders, message):
+    responses = []
+
+    for responder in responders:
+        responses.extend(responder(message) or ())
+
+    return responses
+
+
+class SimulatedBus(can.BusABC):
+    """A python-can bus whose traffic is produced in process.
+
+    Each sent message is passed to every responder, a callable returning an
+    iterable of messages to be received in reply, if any.  Replies pass
+    through a :class:`Link` before they can be received.
+    """
+    def __init__(self, responders=(), link=None, channel='simulated',
+                 **kwargs):
+        super().__init__(channel=channel, **kwargs)
+
+        self.channel_info = 'Simulated bus {}'.format(channel)
+        self.responders = list(responders)
+
+        if link is None:
+            link = Link()
+        self.link = link
+
+        self._condition = threading.Condition()
+
+    def send(self, msg, timeout=None):
+        responses = respond(responders=self.responders, message=msg)
+
+        with self._condition:
+            self.link.schedule(responses)
+            self._condition.notify_all()
+
+    def _recv_internal(self, timeout):
+        end = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                message = self.link.pop_due()
+                if message is not None:
+                    return message, False
+
+                now = time.monotonic()
+                if end is not None and now >= end:
+                    return None, False
+
+                waits = [
+                    t - now
+                    for t in (end, self.link.next_due())
+                    if t is not None
+                ]
+                self._condition.wait(min(waits, default=None))
+
+
+class Server:
+    """Answer messages received on a python-can bus, such as a virtual bus
+    channel shared with the code under test, from a thread.
+    """
+    def __init__(self, bus, responders=(), link=None, poll_interval=0.05):
+        self.bus = bus
+        self.responders = list(responders)
+
+        if link is None:
+            link = Link()
+        self.link = link
+
+        self.poll_interval = poll_interval
+
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='{} server'.format(self.bus.channel_info),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            while True:
+                response = self.link.pop_due()
+                if response is None:
+                    break
+
+                self.bus.send(response)
+
+            timeout = self.poll_interval
+            due = self.link.next_due()
+            if due is not None:
+                timeout = max(0, min(timeout, due - time.monotonic()))
+
+            message = self.bus.recv(timeout=timeout)
+            if message is None:
+                continue
+
+            try:
+                responses = respond(
+                    responders=self.responders,
+                    message=message,
+                )
+            except Exception:
+                logger.exception('Unable to respond to {}'.format(message))
+                continue
+
+            self.link.schedule(responses)
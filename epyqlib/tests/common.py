@@ -3,9 +3,13 @@ import functools
 import locale
 import os
 import pathlib
+import random
 import sys
 
 import attr
+import twisted.internet.reactor
+
+import epyqlib.simulatedbus
 
 
 library_path = pathlib.Path(__file__).parents[2].resolve()
@@ -141,3 +145,74 @@ def use_locale(*s):
     yield
 
     locale.setlocale(locale.LC_ALL, old)
+
+
+@attr.s
+class LoopbackTransport:
+    protocol = attr.ib()
+    responder = attr.ib()
+
+    def write(self, message):
+        for response in self.responder(message):
+            delay = 0
+            if isinstance(response, epyqlib.simulatedbus.Delayed):
+                delay = response.delay
+                response = response.message
+
+            twisted.internet.reactor.callLater(
+                delay,
+                self.protocol.dataReceived,
+                response,
+            )
+
+        return True
+
+    write_passive = write
+
+
+@attr.s
+class DelayedTransport:
+    protocol = attr.ib()
+    responder = attr.ib()
+    delay = attr.ib(default=0.01)
+    ignored_mux_names = attr.ib(default=())
+    drop_rate = attr.ib(default=0)
+    random = attr.ib(default=attr.Factory(lambda: random.Random(0)))
+    outstanding = attr.ib(default=0)
+    maximum_outstanding = attr.ib(default=0)
+    requests = attr.ib(default=attr.Factory(list))
+    frames = attr.ib(default=attr.Factory(dict))
+
+    def write(self, message):
+        frame = self.protocol_frame(message)
+        self.requests.append(frame)
+        if frame.mux_name in self.ignored_mux_names:
+            return True
+
+        if self.random.random() < self.drop_rate:
+            return True
+
+        responses = tuple(self.responder(message))
+        self.outstanding += 1
+        self.maximum_outstanding = max(
+            self.maximum_outstanding,
+            self.outstanding,
+        )
+
+        twisted.internet.reactor.callLater(
+            self.delay,
+            self.respond,
+            responses,
+        )
+
+        return True
+
+    write_passive = write
+
+    def respond(self, responses):
+        self.outstanding -= 1
+        for response in responses:
+            self.protocol.dataReceived(response)
+
+    def protocol_frame(self, message):
+        return self.frames[message.data[0]]
@@ -8,9 +8,20 @@ import pytest
 
 with contextlib.suppress(ImportError):
     import epyqlib.collectdevices
+import epyqlib.hildevice
 import epyqlib.tests.common
 
 
+@pytest.fixture(scope='module')
+def device():
+    device = epyqlib.hildevice.Device(
+        definition_path=epyqlib.tests.common.devices['factory'],
+    )
+    device.load()
+
+    return device
+
+
 @pytest.fixture
 def zipped_customer_device_path(tmpdir):
     name = 'customer'
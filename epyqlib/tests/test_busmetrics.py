@@ -0,0 +1,79 @@
+import json
+import time
+
+import can
+
+import epyqlib.busmetrics
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_histogram():
+    histogram = epyqlib.busmetrics.Histogram(bounds=(1, 2, 4))
+
+    for value in (0.5, 1, 1.5, 3, 10):
+        histogram.add(value)
+
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.percentile(0.5) == 2
+    assert histogram.percentile(1) == 10
+    assert histogram.to_dict()['mean'] == 16 / 5
+
+
+def test_snapshot():
+    clock = Clock()
+    metrics = epyqlib.busmetrics.Metrics(bitrate=500000, clock=clock)
+    metrics.add_gauge('queue', lambda: 7)
+
+    standard = can.Message(arbitration_id=0x10, extended_id=False, dlc=8)
+    extended = can.Message(arbitration_id=0x1FFAB80, dlc=8)
+    extended.timestamp = time.time() - 0.003
+
+    for _ in range(10):
+        metrics.received(standard)
+    metrics.transmitted(extended)
+    metrics.dropped(standard, reason='rx_interval')
+    metrics.dispatched([standard, extended])
+
+    clock.now = 2
+    snapshot = metrics.snapshot()
+    json.dumps(snapshot)
+
+    assert snapshot['rx'] == {'total': 10, 'rates': {'0x010': 5}}
+    assert snapshot['tx'] == {'total': 1, 'rates': {'0x01FFAB80': 0.5}}
+    assert snapshot['bus_load_percent'] == (
+        100 * (10 * (47 + 64) + (67 + 64)) / (500000 * 2)
+    )
+    assert metrics.rx_bits == 10 * (47 + 64)
+    assert metrics.tx_bits == 67 + 64
+    assert snapshot['dropped'] == {'rx_interval': {'0x010': 1}}
+    assert snapshot['gauges'] == {'queue': 7}
+    assert snapshot['latency']['count'] == 1
+    assert snapshot['latency']['p50'] == 0.005
+
+    clock.now = 3
+    snapshot = metrics.snapshot()
+
+    assert snapshot['rx'] == {'total': 10, 'rates': {'0x010': 0}}
+    assert snapshot['bus_load_percent'] == 0
+
+
+def test_reporter(qtbot, tmpdir):
+    path = str(tmpdir.join('metrics.json'))
+    metrics = epyqlib.busmetrics.Metrics()
+    metrics.received(can.Message(arbitration_id=1))
+
+    reporter = epyqlib.busmetrics.MetricsReporter(
+        metrics={'bus': metrics},
+        path=path,
+    )
+    reporter.report()
+
+    with open(path) as f:
+        assert json.load(f)['bus']['rx']['total'] == 1
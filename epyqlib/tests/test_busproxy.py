@@ -0,0 +1,482 @@
+import select
+import socket
+import threading
+import time
+
+import can
+
+import epyqlib.busproxy
+import epyqlib.canneo
+
+
+class Recorder(epyqlib.canneo.QtCanListener):
+    def __init__(self, parent=None):
+        super().__init__(receiver=self.record, parent=parent)
+
+        self.messages = []
+        self.batches = []
+
+    def record(self, message):
+        self.messages.append(message)
+
+    def messages_received(self, messages):
+        self.batches.append(list(messages))
+        super().messages_received(messages)
+
+
+def message(id):
+    return can.Message(arbitration_id=id, data=[id & 0xff])
+
+
+def test_unbatched_delivery(qtbot):
+    recorder = Recorder()
+    notifier = epyqlib.busproxy.NotifierProxy(bus=None, listeners=[recorder])
+
+    notifier.message_received(message(1))
+    notifier.message_received(message(2))
+
+    assert [m.arbitration_id for m in recorder.messages] == [1, 2]
+    assert recorder.batches == []
+
+
+def test_batched_delivery(qtbot):
+    recorder = Recorder()
+    notifier = epyqlib.busproxy.NotifierProxy(
+        bus=None,
+        listeners=[recorder],
+        filtered_ids=[1, 3],
+        batch=True,
+    )
+
+    def produce():
+        for id in range(5):
+            notifier.message_received(message(id))
+
+    thread = threading.Thread(target=produce)
+    thread.start()
+    thread.join()
+
+    assert recorder.messages == []
+
+    qtbot.waitUntil(lambda: len(recorder.messages) == 2)
+
+    assert [m.arbitration_id for m in recorder.messages] == [1, 3]
+    assert len(recorder.batches) == 1
+
+
+def test_batches_pass_through_nested_proxies(qtbot):
+    recorder = Recorder()
+    inner = epyqlib.busproxy.NotifierProxy(bus=None, listeners=[recorder])
+    outer = epyqlib.busproxy.NotifierProxy(
+        bus=None,
+        listeners=[inner],
+        batch=True,
+    )
+
+    outer.message_received(message(1))
+    outer.message_received(message(2))
+
+    assert recorder.messages == []
+
+    qtbot.waitUntil(lambda: len(recorder.messages) == 2)
+
+    assert [m.arbitration_id for m in recorder.messages] == [1, 2]
+    assert len(recorder.batches) == 1
+
+
+def test_routed_delivery(qtbot):
+    everything = Recorder()
+    routed = Recorder()
+    declared = Recorder()
+    declared.receive_keys = lambda: {(3, True)}
+
+    notifier = epyqlib.busproxy.NotifierProxy(bus=None)
+    notifier.add(everything)
+    notifier.add(routed, keys=[(1, True), (2, False)])
+    notifier.add(declared)
+
+    for id in range(5):
+        notifier.message_received(message(id))
+
+    assert [m.arbitration_id for m in everything.messages] == list(range(5))
+    assert [m.arbitration_id for m in routed.messages] == [1]
+    assert [m.arbitration_id for m in declared.messages] == [3]
+
+    notifier.discard(routed)
+    notifier.add(declared, keys=[(4, True)])
+    notifier.messages_received([message(id) for id in range(5)])
+
+    assert [m.arbitration_id for m in routed.messages] == [1]
+    assert [m.arbitration_id for m in declared.messages] == [3, 4]
+    assert [
+        [m.arbitration_id for m in batch]
+        for batch in declared.batches
+    ] == [[4]]
+    assert len(everything.batches) == 1
+    assert notifier.listeners == {everything, declared}
+
+
+def test_acceptance_filters():
+    keys = {(0x100, False), (0x101, False), (0x102, False), (0x103, False),
+            (0x1FFAB80, True)}
+
+    assert epyqlib.busproxy.acceptance_filters(keys) == [
+        {'can_id': 0x100, 'can_mask': 0x7FC, 'extended': False},
+        {'can_id': 0x1FFAB80, 'can_mask': 0x1FFFFFFF, 'extended': True},
+    ]
+
+
+def test_acceptance_filters_exact_and_limited():
+    ids = {0b0001, 0b0011, 0b0110, 0b0111, 0b1100, 0b1111}
+    keys = {(id, True) for id in ids}
+
+    def accepted(filters):
+        return {
+            id
+            for id in range(16)
+            if any(id & f['can_mask'] == f['can_id'] for f in filters)
+        }
+
+    filters = epyqlib.busproxy.acceptance_filters(keys)
+    assert accepted(filters) == ids
+
+    limited = epyqlib.busproxy.acceptance_filters(keys, limit=2)
+    assert len(limited) <= 2
+    assert accepted(limited) >= ids
+
+
+def test_automatic_filters(qtbot):
+    real_bus = can.interface.Bus(bustype='virtual', channel='test_filters')
+    bus = epyqlib.busproxy.BusProxy(bus=real_bus, automatic_filters=True)
+    device_bus = epyqlib.busproxy.BusProxy(bus=bus)
+
+    try:
+        assert real_bus.filters is None
+
+        recorder = Recorder()
+        recorder.receive_keys = lambda: {(0x10, False)}
+        device_bus.notifier.add(recorder)
+
+        assert real_bus.filters == [
+            {'can_id': 0x10, 'can_mask': 0x7FF, 'extended': False},
+        ]
+
+        bus.receive_all(requester=recorder)
+        assert real_bus.filters is None
+        bus.receive_all(requester=recorder, enable=False)
+        assert real_bus.filters is not None
+
+        everything = Recorder()
+        device_bus.notifier.add(everything)
+        assert real_bus.filters is None
+
+        device_bus.notifier.discard(everything)
+        assert real_bus.filters is not None
+    finally:
+        bus.terminate()
+
+
+def test_observers_receive_all_on_request(qtbot):
+    real_bus = can.interface.Bus(bustype='virtual', channel='test_observer')
+    bus = epyqlib.busproxy.BusProxy(bus=real_bus, automatic_filters=True)
+    device_bus = epyqlib.busproxy.BusProxy(bus=bus)
+
+    try:
+        recorder = Recorder()
+        recorder.receive_keys = lambda: {(0x10, False)}
+        device_bus.notifier.add(recorder)
+        filters = real_bus.filters
+
+        observer = Recorder()
+        device_bus.notifier.add(observer, observer=True)
+        assert real_bus.filters == filters
+
+        device_bus.receive_all(requester=observer)
+        assert real_bus.filters is None
+
+        device_bus.notifier.message_received(message(0x20))
+        assert [m.arbitration_id for m in observer.messages] == [0x20]
+        assert recorder.messages == []
+
+        device_bus.receive_all(requester=observer, enable=False)
+        assert real_bus.filters == filters
+    finally:
+        bus.terminate()
+
+
+def test_nested_proxy_keeps_parent_filters(qtbot):
+    real_bus = can.interface.Bus(bustype='virtual', channel='test_nested')
+    explicit = [{'can_id': 0x30, 'can_mask': 0x7FF, 'extended': False}]
+    bus = epyqlib.busproxy.BusProxy(bus=real_bus, filters=explicit)
+    device_bus = epyqlib.busproxy.BusProxy(
+        bus=bus,
+        automatic_filters=True,
+    )
+
+    try:
+        recorder = Recorder()
+        recorder.receive_keys = lambda: {(0x10, False)}
+        device_bus.notifier.add(recorder)
+        device_bus.set_filters(None)
+
+        assert bus.filters == explicit
+        assert real_bus.filters == explicit
+    finally:
+        bus.terminate()
+
+
+class FlakyBus(can.BusABC):
+    def __init__(self, failures):
+        super().__init__(channel=None)
+
+        self.failures = failures
+        self.sent = []
+
+    def send(self, msg, timeout=None):
+        if self.failures > 0:
+            self.failures -= 1
+            raise can.CanError('Transmit buffer full')
+
+        self.sent.append(msg)
+
+    def _recv_internal(self, timeout):
+        time.sleep(timeout)
+        return None, False
+
+
+def test_transmit_queue(qtbot):
+    real_bus = FlakyBus(failures=3)
+    bus = epyqlib.busproxy.BusProxy(bus=real_bus, transmit_gap=0.001)
+
+    transmitted = Recorder()
+    bus.tx_notifier.add(transmitted)
+    successes = []
+
+    try:
+        start = time.perf_counter()
+        for id in range(10):
+            assert bus.send(message(id), on_success=lambda id=id: successes.append(id))
+
+        assert time.perf_counter() - start < 0.005
+
+        qtbot.waitUntil(lambda: len(successes) == 10)
+
+        assert bus.bus is real_bus
+        assert [m.arbitration_id for m in real_bus.sent] == list(range(10))
+        assert successes == list(range(10))
+        assert [m.arbitration_id for m in transmitted.messages] == list(range(10))
+    finally:
+        bus.terminate()
+
+
+def test_shared_receive_service(qtbot):
+    service = epyqlib.busproxy.ReceiveService()
+    senders = []
+    proxies = []
+    recorders = []
+
+    try:
+        for channel in ('test_shared_a', 'test_shared_b'):
+            senders.append(can.interface.Bus(bustype='virtual', channel=channel))
+            proxy = epyqlib.busproxy.BusProxy(
+                bus=can.interface.Bus(bustype='virtual', channel=channel),
+                receive_service=service,
+            )
+            proxies.append(proxy)
+            recorder = Recorder()
+            proxy.notifier.add(recorder)
+            recorders.append(recorder)
+
+        for sender, id in zip(senders, (1, 2)):
+            sender.send(message(id))
+
+        qtbot.waitUntil(
+            lambda: all(len(recorder.messages) == 1 for recorder in recorders),
+        )
+
+        assert [
+            [m.arbitration_id for m in recorder.messages]
+            for recorder in recorders
+        ] == [[1], [2]]
+        assert len([
+            thread for thread in threading.enumerate()
+            if thread.name == 'epyqlib.busproxy.ReceiveService'
+        ]) == 1
+
+        proxies[0].set_bus()
+        senders[0].send(message(3))
+        senders[1].send(message(4))
+
+        qtbot.waitUntil(lambda: len(recorders[1].messages) == 2)
+        assert len(recorders[0].messages) == 1
+    finally:
+        for proxy in proxies:
+            proxy.terminate()
+        for sender in senders:
+            sender.shutdown()
+
+
+class SocketBus:
+    def __init__(self):
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.received = []
+        self.reads = 0
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def recv(self, timeout=None):
+        self.reads += 1
+
+        try:
+            data = self.reader.recv(1)
+        except BlockingIOError:
+            return None
+
+        return message(data[0])
+
+    def on_message_received(self, message):
+        self.received.append(message)
+
+
+def test_receive_service_drops_only_unselectable_buses(qtbot):
+    service = epyqlib.busproxy.ReceiveService()
+    closed = SocketBus()
+    good = SocketBus()
+
+    try:
+        service.add(bus=closed, listener=closed)
+        service.add(bus=good, listener=good)
+
+        closed.reader.close()
+        service._wake()
+
+        good.writer.send(b'\x07')
+        qtbot.waitUntil(lambda: len(good.received) == 1)
+
+        assert closed not in service._selectable
+        assert good in service._selectable
+    finally:
+        service.remove(closed)
+        service.remove(good)
+
+
+class CountingSelect:
+    def __init__(self):
+        self.calls = 0
+
+    def select(self, *args, **kwargs):
+        self.calls += 1
+
+        return select.select(*args, **kwargs)
+
+
+def test_idle_receive_service_blocks(monkeypatch):
+    counting_select = CountingSelect()
+    monkeypatch.setattr(epyqlib.busproxy, 'select', counting_select)
+    service = epyqlib.busproxy.ReceiveService()
+    bus = SocketBus()
+
+    try:
+        service.add(bus=bus, listener=bus)
+        time.sleep(0.2)
+        calls = counting_select.calls
+        time.sleep(0.2)
+
+        assert counting_select.calls - calls <= 1
+    finally:
+        service.remove(bus)
+
+
+def test_receive_reads_past_software_filtered_messages():
+    sender = can.interface.Bus(bustype='virtual', channel='test_sw_filter')
+    bus = can.interface.Bus(
+        bustype='virtual',
+        channel='test_sw_filter',
+        can_filters=[{'can_id': 0x10, 'can_mask': 0x7FF, 'extended': False}],
+    )
+    recorder = SocketBus()
+
+    try:
+        for id in (0x20, 0x21, 0x22, 0x10, 0x23, 0x10):
+            sender.send(can.Message(arbitration_id=id, extended_id=False))
+
+        epyqlib.busproxy.ReceiveService._read(bus=bus, listener=recorder)
+
+        assert [m.arbitration_id for m in recorder.received] == [0x10, 0x10]
+    finally:
+        sender.shutdown()
+        bus.shutdown()
+
+
+def test_set_bus_timings_and_status_polling():
+    real_bus = FlakyBus(failures=0)
+    statuses = [False, False, True]
+    real_bus.status_is_ok = lambda: statuses.pop(0)
+
+    bus = epyqlib.busproxy.BusProxy(bus=real_bus)
+
+    try:
+        assert {'set_bus', 'attach', 'reset'} <= set(bus.timings)
+        assert bus.wait_for_status_ok(timeout=1, interval=0)
+        assert statuses == []
+    finally:
+        bus.terminate()
+
+    assert 'detach' in bus.timings
+    assert bus.timings['set_bus'] < 0.5
+
+
+def test_status_polling_waits_out_stale_ok():
+    real_bus = FlakyBus(failures=0)
+    bus = epyqlib.busproxy.BusProxy(bus=real_bus)
+
+    try:
+        statuses = [True, True, False, True]
+        real_bus.status_is_ok = lambda: statuses.pop(0)
+        assert bus.wait_for_status_ok(timeout=1, interval=0, settle=10)
+        assert statuses == []
+
+        polls = []
+        real_bus.status_is_ok = lambda: polls.append(None) or True
+        start = time.perf_counter()
+        assert bus.wait_for_status_ok(timeout=1, interval=0.001, settle=0.05)
+        assert time.perf_counter() - start >= 0.05
+        assert len(polls) > 1
+    finally:
+        bus.terminate()
+
+
+def test_metrics(qtbot):
+    sender = can.interface.Bus(bustype='virtual', channel='test_metrics')
+    bus = epyqlib.busproxy.BusProxy(
+        bus=can.interface.Bus(bustype='virtual', channel='test_metrics'),
+        batch_receive=True,
+    )
+    device_bus = epyqlib.busproxy.BusProxy(bus=bus)
+
+    recorder = Recorder()
+    device_bus.notifier.add(recorder)
+
+    try:
+        for id in range(3):
+            sender.send(message(id))
+        qtbot.waitUntil(lambda: len(recorder.messages) == 3)
+
+        device_bus.send(message(5))
+        qtbot.waitUntil(lambda: bus.metrics.tx_counts[(5, True)] == 1)
+
+        for metrics in (bus.metrics, device_bus.metrics):
+            snapshot = metrics.snapshot()
+            assert snapshot['rx']['total'] == 3
+            assert snapshot['tx']['total'] == 1
+            assert snapshot['latency']['count'] == 3
+
+        assert set(bus.metrics.snapshot()['gauges']) == {
+            'receive_pending',
+            'transmit_queue',
+        }
+    finally:
+        bus.terminate()
+        sender.shutdown()
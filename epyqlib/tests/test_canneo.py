@@ -0,0 +1,439 @@
+import decimal
+import math
+import random
+
+import canmatrix.canmatrix
+import canmatrix.formats
+import pytest
+
+import epyqlib.busproxy
+import epyqlib.canneo
+import epyqlib.tests.common
+
+
+def load_matrix():
+    matrix, = canmatrix.formats.loadp(
+        str(epyqlib.tests.common.symbol_files['factory']),
+    ).values()
+
+    return matrix
+
+
+@pytest.fixture
+def neo():
+    return epyqlib.canneo.Neo(matrix=load_matrix())
+
+
+def build_frame(*signals, size=8):
+    matrix_frame = canmatrix.canmatrix.Frame(
+        name='Test',
+        id=0x123,
+        size=size,
+        transmitters=[],
+    )
+    for signal in signals:
+        matrix_frame.addSignal(signal)
+
+    return epyqlib.canneo.Frame(frame=matrix_frame)
+
+
+def build_signal(name, start_bit, size, little_endian=True, signed=False,
+                 float=False):
+    signal = canmatrix.canmatrix.Signal(
+        name=name,
+        startBit=start_bit,
+        size=size,
+        is_little_endian=little_endian,
+        is_signed=signed,
+    )
+    signal.is_float = float
+
+    return signal
+
+
+def test_round_trip(neo):
+    r = random.Random(0)
+
+    for frame in neo.frames:
+        for _ in range(20):
+            data = bytes(r.getrandbits(8) for _ in range(frame.size))
+
+            values = frame.unpack(data, only_return=True)
+            if any(isinstance(v, float) and not math.isfinite(v)
+                   for v in values.values()):
+                continue
+
+            packed = frame.pack(tuple(values.values()))
+
+            assert frame.unpack(packed, only_return=True) == values
+
+
+def test_signed_little_endian():
+    frame = build_frame(
+        build_signal(name='a', start_bit=0, size=4, signed=True),
+        build_signal(name='b', start_bit=4, size=12, signed=True),
+    )
+
+    packed = frame.pack((-2, -1000))
+
+    assert packed == bytes((0x8E, 0xC1, 0, 0, 0, 0, 0, 0))
+    assert list(frame.unpack(packed, only_return=True).values()) == [-2, -1000]
+
+
+def test_float():
+    frame = build_frame(
+        build_signal(name='f', start_bit=32, size=32, float=True),
+    )
+
+    packed = frame.pack((1.5,))
+
+    assert packed == bytes((0, 0, 0, 0, 0, 0, 0xC0, 0x3F))
+    assert frame.unpack(packed, only_return=True) == {frame.signals[0]: 1.5}
+
+
+def test_unable_to_pack():
+    frame = build_frame(
+        build_signal(name='a', start_bit=0, size=8),
+    )
+
+    with pytest.raises(epyqlib.canneo.UnableToPackError):
+        frame.pack((256,))
+
+
+def test_unpack_array(neo):
+    numpy = pytest.importorskip('numpy')
+
+    r = random.Random(0)
+
+    for frame in neo.frames:
+        payloads = [
+            bytes(r.getrandbits(8) for _ in range(frame.size))
+            for _ in range(20)
+        ]
+
+        arrays = frame.unpack_array(numpy.array([list(p) for p in payloads]))
+
+        for i, payload in enumerate(payloads):
+            for signal, raw in frame.unpack(payload, only_return=True).items():
+                if raw in signal.enumeration:
+                    assert arrays[signal][i] == signal.enumeration[raw]
+                else:
+                    expected = float(signal.to_human(raw))
+                    assert arrays[signal][i] == pytest.approx(expected)
+
+
+def test_unpack_arrays_multiplexed(neo):
+    numpy = pytest.importorskip('numpy')
+
+    frame = neo.frame_by_name('ParameterQuery')
+    first, second = list(frame.multiplex_frames.values())[:2]
+
+    data = numpy.array([
+        list(first.update_from_signals(only_return=True)),
+        list(second.update_from_signals(only_return=True)),
+        list(first.update_from_signals(only_return=True)),
+    ])
+
+    unpacked = neo.unpack_arrays(
+        identifiers=numpy.array([frame.id] * 3),
+        data=data,
+    )
+
+    assert set(unpacked) == {first, second}
+    assert list(unpacked[first][0]) == [0, 2]
+    assert list(unpacked[second][0]) == [1]
+
+
+def test_unpack_array_signed_and_float():
+    numpy = pytest.importorskip('numpy')
+
+    frame = build_frame(
+        build_signal(name='a', start_bit=0, size=12, signed=True),
+        build_signal(name='b', start_bit=32, size=32, float=True),
+    )
+    a, b = frame.signals
+
+    payloads = [frame.pack((-5, 2.25)), frame.pack((5, -1.5))]
+    arrays = frame.unpack_array(numpy.array([list(p) for p in payloads]))
+
+    assert list(arrays[a]) == [-5, 5]
+    assert list(arrays[b]) == [2.25, -1.5]
+
+
+def test_field_extract():
+    r = random.Random(0)
+
+    for little_endian in (True, False):
+        for start_bit, size in ((0, 8), (3, 11), (13, 19), (56, 8)):
+            if not little_endian:
+                start_bit = 63 - start_bit - size + 1
+            frame = build_frame(
+                build_signal(
+                    name='m',
+                    start_bit=start_bit,
+                    size=size,
+                    little_endian=little_endian,
+                ),
+            )
+            field, = frame.codec.fields
+
+            for _ in range(20):
+                data = bytes(r.getrandbits(8) for _ in range(frame.size))
+                raw, = frame.codec.unpack(data)
+
+                assert field.extract(data) == raw
+
+
+def test_get_multiplex(neo):
+    frame = neo.frame_by_name('ParameterQuery')
+    multiplex_value, multiplex_frame = list(frame.multiplex_frames.items())[1]
+
+    message = multiplex_frame.to_message(
+        data=multiplex_frame.update_from_signals(only_return=True),
+    )
+
+    assert neo.get_multiplex(message) == (multiplex_frame, multiplex_value)
+
+    message.id_type = not frame.extended
+    assert neo.get_multiplex(message) == (None, None)
+
+
+def test_frame_by_id(neo):
+    frame = neo.frame_by_name('StatusBits')
+
+    assert neo.frame_by_id(frame.id) is frame
+    assert neo.frame_by_id(frame.id, extended=True) is frame
+    assert neo.frame_by_id(frame.id, extended=False) is None
+
+
+def test_add_frame(neo):
+    frame = build_frame(build_signal(name='a', start_bit=0, size=8))
+
+    assert neo.frame_by_id(frame.id, extended=False) is None
+    neo.add_frame(frame)
+    assert neo.frame_by_id(frame.id, extended=False) is frame
+    assert neo.frames[-1] is frame
+
+    message = frame.to_message(data=bytes(8))
+    assert neo.get_multiplex(message) == (frame, None)
+
+    neo.add_frame(build_frame(build_signal(name='b', start_bit=0, size=8)))
+    assert neo.frame_by_id(frame.id, extended=False) is None
+
+
+def test_signal_by_path(neo):
+    frame = neo.frame_by_name('ParameterQuery')
+    multiplex_frame = list(frame.multiplex_frames.values())[1]
+    signal = multiplex_frame.signals[-1]
+
+    path = (frame.name, multiplex_frame.mux_name, signal.name)
+    assert neo.signal_by_path(*path) is signal
+
+    for path in ((frame.name,), (frame.name, frame.signals[0].name)):
+        with pytest.raises(epyqlib.canneo.NotFoundError):
+            neo.signal_by_path(*path)
+
+
+def test_ambiguous_names(neo):
+    frame = build_frame(
+        build_signal(name='a', start_bit=0, size=8),
+        build_signal(name='a', start_bit=8, size=8),
+    )
+
+    with pytest.raises(epyqlib.canneo.AmbiguousNameError):
+        frame.signal_by_name('a')
+
+    existing = neo.frames[0]
+    neo.add_frame(frame)
+    neo.add_frame(build_frame(build_signal(name='b', start_bit=0, size=8)))
+
+    with pytest.raises(epyqlib.canneo.AmbiguousNameError):
+        neo.frame_by_name(frame.name)
+
+    assert neo.frame_by_name(existing.name) is existing
+
+
+def test_lazy_strings(monkeypatch):
+    frame = build_frame(build_signal(name='a', start_bit=0, size=8))
+    signal, = frame.signals
+
+    format_strings = signal.format_strings
+    formatted = []
+
+    def counting_format_strings(value):
+        formatted.append(value)
+        return format_strings(value=value)
+
+    monkeypatch.setattr(signal, 'format_strings', counting_format_strings)
+
+    for value in range(10):
+        signal.set_value(value)
+
+    assert formatted == []
+
+    assert signal.full_string == format_strings(value=9)[0]
+    assert signal.short_string == format_strings(value=9)[1]
+    assert formatted == [9]
+
+    signal.set_value(3)
+    assert signal.full_string == format_strings(value=3)[0]
+    signal.set_value(9)
+    assert signal.enumeration_text is None
+    assert formatted == [9, 3]
+
+
+@pytest.mark.parametrize('batch', (False, True))
+def test_coalescing(qtbot, batch):
+    neo = epyqlib.canneo.Neo(matrix=load_matrix(), coalesce_interval=1)
+    notifier = epyqlib.busproxy.NotifierProxy(
+        bus=None,
+        listeners=[neo],
+        batch=batch,
+    )
+
+    frame = neo.frame_by_name('StatusBits')
+    query = neo.frame_by_name('ParameterQuery')
+    first, second = list(query.multiplex_frames.values())[:2]
+
+    messages = [
+        frame.to_message(data=bytes((i,) + (0,) * 7))
+        for i in range(5)
+    ]
+    messages[2:2] = [
+        f.to_message(data=f.update_from_signals(only_return=True))
+        for f in (first, second, first)
+    ]
+
+    streamed = []
+    neo.message_received_signal.connect(streamed.append)
+    delivered = []
+    frame.message_received_signal.connect(delivered.append)
+    query.message_received_signal.connect(delivered.append)
+
+    for message in messages:
+        notifier.message_received(message)
+    notifier.drain()
+
+    qtbot.waitUntil(lambda: len(streamed) == len(messages))
+    assert streamed == messages
+    assert delivered == []
+
+    neo.flush()
+    assert delivered == [messages[-1], messages[4], messages[3]]
+
+    neo.flush()
+    assert len(delivered) == 3
+
+    neo.terminate()
+
+
+def test_unchanged_payload_not_decoded():
+    frame = build_frame(build_signal(name='a', start_bit=0, size=8))
+    signal, = frame.signals
+
+    changes = []
+    signal.value_changed.connect(changes.append)
+
+    message = frame.to_message(data=bytes((1,) + (0,) * 7))
+    frame.message_received(message)
+    frame.message_received(message)
+    assert changes == [1]
+
+    signal.set_value(5)
+    frame.message_received(message)
+    assert changes == [1, 5, 1]
+
+
+def test_cyclic_send_reuses_message():
+    frame = build_frame(build_signal(name='a', start_bit=0, size=8))
+    signal, = frame.signals
+
+    sent = []
+    frame.send.connect(lambda message, _: sent.append(message))
+
+    frame._send(update=True)
+    frame._send(update=True)
+    assert sent[0] is sent[1]
+
+    signal.set_value(7)
+    frame._send(update=True)
+    assert sent[2] is not sent[1]
+    assert sent[2].data[0] == 7
+
+    frame.update_from_signals(data=(9,))
+    frame._send(update=True)
+    assert sent[3].data[0] == 7
+
+    frame.update_from_signals(function=lambda s: 3)
+    frame._send()
+    assert sent[4].data[0] == 3
+    frame._send(update=True)
+    assert sent[5].data[0] == 7
+
+
+def test_lazy_multiplex():
+    eager = epyqlib.canneo.Neo(matrix=load_matrix())
+    neo = epyqlib.canneo.Neo(matrix=load_matrix(), lazy_multiplex=True)
+
+    assert len(neo.frames) < len(eager.frames)
+
+    frame = neo.frame_by_name('ParameterQuery')
+    eager_frame = eager.frame_by_name('ParameterQuery')
+    assert list(frame.multiplex_frames) == list(eager_frame.multiplex_frames)
+
+    eager_multiplex_frame = list(eager_frame.multiplex_frames.values())[3]
+    signal = eager_multiplex_frame.signals[-1]
+    path = (frame.name, eager_multiplex_frame.mux_name, signal.name)
+
+    count = len(neo.frames)
+    lazy_signal = neo.signal_by_path(*path)
+    assert len(neo.frames) == count + 1
+    assert lazy_signal.name == signal.name
+    assert neo.signal_by_path(*path) is lazy_signal
+
+    message = eager_multiplex_frame.to_message(
+        data=eager_multiplex_frame.update_from_signals(only_return=True),
+    )
+    multiplex_frame, multiplex_value = neo.get_multiplex(message)
+    assert multiplex_frame is lazy_signal.frame
+    assert multiplex_value == eager_multiplex_frame.mux_value
+
+    for base_frame in neo.frames:
+        if hasattr(base_frame, 'multiplex_frames'):
+            list(base_frame.multiplex_frames.values())
+
+    assert len(neo.frames) == len(eager.frames)
+
+
+def test_calc_human_value_enumeration():
+    matrix_signal = build_signal(name='a', start_bit=0, size=8)
+    matrix_signal.addValues(0, 'Off')
+    matrix_signal.addValues(1, 'On')
+    frame = build_frame(matrix_signal)
+    signal, = frame.signals
+
+    assert signal.calc_human_value('On') == 1
+    assert signal.calc_human_value('[0] Off') == 0
+    assert signal.calc_human_value('7') == 7
+
+    with pytest.raises(ValueError):
+        signal.calc_human_value('Unknown')
+
+
+def test_from_human_float():
+    matrix_signal = build_signal(name='a', start_bit=0, size=16)
+    matrix_signal.factor = decimal.Decimal('0.1')
+    matrix_signal.offset = decimal.Decimal('-5')
+    frame = build_frame(matrix_signal)
+    signal, = frame.signals
+
+    assert signal.from_human(2.5) == 75
+    assert signal.from_human(decimal.Decimal('2.5')) == 75
+    assert signal.calc_human_value('2.5') == 75
+
+    signal.set_value(75)
+    assert signal.scaled_value == pytest.approx(2.5)
+
+    signal.set_value(decimal.Decimal(76))
+    assert signal.scaled_value == pytest.approx(2.6)
+    assert signal.full_string == signal.format_float(2.6)
@@ -0,0 +1,125 @@
+import pytest
+
+import epyqlib.ccpsimulator
+import epyqlib.tests.common
+import epyqlib.twisted.cancalibrationprotocol as ccp
+import epyqlib.utils.twisted
+
+
+def handler(target):
+    handler = ccp.Handler(endianness=target.endianness)
+    handler.makeConnection(epyqlib.tests.common.LoopbackTransport(
+        protocol=handler,
+        responder=target,
+    ))
+
+    return handler
+
+
+@pytest.inlineCallbacks
+def test_flash_and_upload():
+    target = epyqlib.ccpsimulator.Target()
+    protocol = handler(target)
+    data = bytes(range(64))
+
+    yield protocol.connect()
+    yield protocol.set_mta(
+        address_extension=ccp.AddressExtension.configuration_registers,
+        address=0,
+    )
+    yield protocol.unlock(section=ccp.Password.dsp_flash)
+    yield protocol.set_mta(
+        address_extension=ccp.AddressExtension.flash_memory,
+        address=0,
+    )
+    yield protocol.clear_memory()
+
+    protocol.continuous_crc = None
+    yield protocol.download_block(
+        address_extension=ccp.AddressExtension.flash_memory,
+        address=0x100,
+        data=data,
+    )
+    yield protocol.build_checksum(
+        checksum=protocol.continuous_crc,
+        length=0,
+    )
+
+    wire = bytes(ccp.endianness_swap_2byte(data))
+    assert target.read(
+        address_extension=ccp.AddressExtension.flash_memory,
+        address=0x100,
+        octets=len(data),
+    ) == wire
+    assert target.continuous_crc == protocol.continuous_crc
+
+    uploaded = yield protocol.upload_block(
+        address_extension=ccp.AddressExtension.flash_memory,
+        address=0x100 + 3,
+        octets=len(data) - 6 + 1,
+    )
+    assert uploaded == wire[6:] + b'\xff'
+
+    yield protocol.disconnect()
+
+    assert not target.connected
+    assert target.command_counts[ccp.CommandCode.download_6] == 10
+    assert target.command_counts[ccp.CommandCode.download] == 1
+
+
+@pytest.inlineCallbacks
+def test_data_logger_upload():
+    log = bytes(range(256)) * 2
+    target = epyqlib.ccpsimulator.Target()
+    target.write(
+        address_extension=ccp.AddressExtension.data_logger,
+        address=0,
+        data=log,
+    )
+    protocol = handler(target)
+
+    yield protocol.connect(station_address=0)
+    data = yield protocol.upload_block(
+        address_extension=ccp.AddressExtension.data_logger,
+        address=0,
+        octets=len(log),
+    )
+    yield protocol.disconnect(end_of_session=1)
+
+    assert data == log
+
+
+@pytest.inlineCallbacks
+def test_faults_and_locking():
+    target = epyqlib.ccpsimulator.Target(
+        delays={ccp.CommandCode.set_mta: 0.05},
+    )
+    protocol = handler(target)
+
+    target.inject_fault(code=ccp.CommandCode.connect)
+    with pytest.raises(epyqlib.utils.twisted.RequestTimeoutError):
+        yield protocol.connect(timeout=0.1)
+
+    yield protocol.connect(timeout=0.1)
+    yield protocol.set_mta(
+        address_extension=ccp.AddressExtension.flash_memory,
+        address=0,
+    )
+
+    with pytest.raises(ccp.UnexpectedMessageReceived):
+        yield protocol.clear_memory()
+
+    target.inject_fault(
+        code=ccp.CommandCode.upload,
+        status=ccp.CommandStatus.processor_busy,
+    )
+    protocol = handler(target)
+    yield protocol.connect()
+    with pytest.raises(ccp.UnexpectedMessageReceived):
+        yield protocol.upload()
+
+    protocol = handler(target)
+    yield protocol.connect()
+    data = yield protocol.upload()
+    assert data == b'\xff' * 5
+    assert target.faults == []
@@ -2,6 +2,8 @@ import logging
 import os
 import shutil
 
+import can
+
 import epyqlib.busproxy
 import epyqlib.device
 import epyqlib.twisted.busproxy
@@ -76,3 +78,33 @@ def test_zip(qtbot, zipped_customer_device_path, tmpdir):
 
     assert_device_ok(device)
     device.terminate()
+
+
+def test_rx_tab_receives_all(customer_device_path, qtbot):
+    real_bus = can.interface.Bus(bustype='virtual', channel='test_rx_tab')
+    bus = epyqlib.busproxy.BusProxy(bus=real_bus, automatic_filters=True)
+
+    device = None
+
+    try:
+        device = epyqlib.device.Device(
+            file=customer_device_path,
+            node_id=247,
+            bus=bus,
+        )
+
+        assert device.rx is not None
+        tabs = device.ui.tabs
+        other = 1 if tabs.indexOf(device.ui.txrx) == 0 else 0
+        tabs.setCurrentIndex(other)
+        filters = real_bus.filters
+
+        tabs.setCurrentWidget(device.ui.txrx)
+        assert real_bus.filters is None
+
+        tabs.setCurrentIndex(other)
+        assert real_bus.filters == filters
+    finally:
+        if device is not None:
+            device.terminate()
+        bus.terminate()
@@ -3,8 +3,14 @@ import pathlib
 import attr
 import pytest
 
+import epyqlib.busproxy
+import epyqlib.canneo
 import epyqlib.tests.common
 import epyqlib.hildevice
+import epyqlib.nvsimulator
+import epyqlib.simulatedbus
+import epyqlib.utils.headless
+import epyqlib.utils.qt
 
 
 @pytest.fixture
@@ -52,3 +58,70 @@ def test_device_reload():
 
     with pytest.raises(epyqlib.hildevice.AlreadyLoadedError):
         device.load()
+
+
+def test_cached_wrappers():
+    device = epyqlib.hildevice.Device(
+        definition_path=epyqlib.tests.common.devices['factory'],
+    )
+    device.load()
+
+    path = ('StatusBits', 'WarningClr_echo')
+    assert device.signal(*path) is device.signal(*path)
+
+    path = (device.nvs.save_frame.mux_name, device.nvs.save_signal.name)
+    assert device.nv(*path) is device.save_nv
+
+
+@pytest.fixture
+def headless():
+    epyqlib.utils.qt.use_headless()
+    yield
+    epyqlib.utils.qt.use_headless(False)
+
+
+@pytest.inlineCallbacks
+def test_headless_nv_round_trip(headless):
+    device = epyqlib.hildevice.Device(
+        definition_path=epyqlib.tests.common.devices['factory'],
+    )
+    device.load()
+
+    host = epyqlib.canneo.QtCanListener.message_received_signal.qobject_host(
+        device.nvs,
+    )
+    assert isinstance(host, epyqlib.utils.headless.SignalHost)
+
+    simulator = epyqlib.nvsimulator.Device(
+        neo=device.nvs.neo,
+        configuration=device.definition.nv_configuration,
+    )
+    bus = epyqlib.busproxy.BusProxy(
+        bus=epyqlib.simulatedbus.SimulatedBus(responders=[simulator]),
+        batch_receive=True,
+    )
+    device.set_bus(bus)
+
+    nv = next(
+        nv
+        for nv in device.nvs.all_nv()
+        if nv.frame.read_write.min == 0
+        and nv.name != device.nvs.configuration.to_nv_command
+        and nv.max is not None
+        and nv.max > 0
+    )
+    wrapper = device.nv(nv.frame.mux_name, nv.name)
+    raw = nv.from_human(nv.max)
+
+    try:
+        yield wrapper.set(value=raw)
+        value = yield wrapper.get()
+    finally:
+        bus.terminate()
+
+    assert value == nv.max
+    assert simulator.value(
+        mux_name=nv.frame.mux_name,
+        name=nv.name,
+        meta=epyqlib.nv.MetaEnum.value,
+    ) == raw
@@ -0,0 +1,89 @@
+import os
+
+import canmatrix.formats
+
+import epyqlib.matrixcache
+import epyqlib.tests.common
+
+
+def matrix_summary(matrices):
+    matrix, = matrices.values()
+
+    return [
+        (frame.name, frame.id, [signal.name for signal in frame.signals])
+        for frame in matrix.frames
+    ]
+
+
+def test_matches_canmatrix(monkeypatch, tmpdir):
+    monkeypatch.setattr(epyqlib.matrixcache, 'directory', str(tmpdir))
+    epyqlib.matrixcache.clear()
+
+    path = epyqlib.tests.common.symbol_files['factory']
+
+    expected = matrix_summary(canmatrix.formats.loadp(str(path)))
+
+    assert matrix_summary(epyqlib.matrixcache.loadp(path)) == expected
+    assert len(tmpdir.listdir()) == 1
+    assert len(tmpdir.listdir()[0].listdir()) == 1
+
+    assert matrix_summary(epyqlib.matrixcache.loadp(path)) == expected
+
+    epyqlib.matrixcache.clear()
+    assert matrix_summary(epyqlib.matrixcache.loadp(path)) == expected
+
+
+def test_independent_copies(monkeypatch):
+    monkeypatch.setattr(epyqlib.matrixcache, 'directory', False)
+    epyqlib.matrixcache.clear()
+
+    path = epyqlib.tests.common.symbol_files['factory']
+
+    first, = epyqlib.matrixcache.loadp(path).values()
+    first.frames[0].id += 1
+    second, = epyqlib.matrixcache.loadp(path).values()
+
+    assert second.frames[0].id == first.frames[0].id - 1
+
+
+def test_corrupt_cache_reparsed(monkeypatch, tmpdir):
+    monkeypatch.setattr(epyqlib.matrixcache, 'directory', str(tmpdir))
+    epyqlib.matrixcache.clear()
+
+    path = epyqlib.tests.common.symbol_files['factory']
+    expected = matrix_summary(epyqlib.matrixcache.loadp(path))
+
+    version, = tmpdir.listdir()
+    cached, = version.listdir()
+    cached.write_binary(b'not a pickle')
+    epyqlib.matrixcache.clear()
+
+    assert matrix_summary(epyqlib.matrixcache.loadp(path)) == expected
+
+
+def test_prunes_stale_entries(monkeypatch, tmpdir):
+    monkeypatch.setattr(epyqlib.matrixcache, 'directory', str(tmpdir))
+    monkeypatch.setattr(epyqlib.matrixcache, 'maximum_entries', 2)
+    epyqlib.matrixcache.clear()
+
+    other = tmpdir.mkdir('format0-canmatrix0')
+    other.join('old').write_binary(b'')
+
+    version = tmpdir.mkdir(epyqlib.matrixcache.version_name())
+    for age, name in enumerate(('recent', 'older', 'oldest')):
+        entry = version.join(name)
+        entry.write_binary(b'')
+        os.utime(str(entry), (1000 - age, 1000 - age))
+
+    path = epyqlib.tests.common.symbol_files['factory']
+    epyqlib.matrixcache.loadp(path)
+
+    key = epyqlib.matrixcache.cache_key(
+        content=path.read_bytes(),
+        suffix=path.suffix,
+    )
+
+    assert tmpdir.listdir() == [version]
+    assert sorted(entry.basename for entry in version.listdir()) == sorted(
+        [key, 'recent'],
+    )
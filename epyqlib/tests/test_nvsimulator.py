@@ -0,0 +1,175 @@
+import can
+import pytest
+
+import epyqlib.busproxy
+import epyqlib.device
+import epyqlib.nv
+import epyqlib.nvsimulator
+import epyqlib.simulatedbus
+import epyqlib.tests.common
+import epyqlib.twisted.nvs
+
+
+@pytest.fixture
+def simulator(device):
+    return epyqlib.nvsimulator.Device(
+        neo=device.nvs.neo,
+        configuration=device.definition.nv_configuration,
+    )
+
+
+def writable_nv(device):
+    return next(
+        nv
+        for nv in device.nvs.all_nv()
+        if nv.frame.read_write.min == 0
+        and nv.name != device.nvs.configuration.to_nv_command
+        and nv.max is not None
+        and nv.max > 0
+    )
+
+
+def test_set_value_uses_check_value(monkeypatch, device):
+    nv = writable_nv(device)
+    before = nv.value
+    checked = []
+
+    def check_value(**kwargs):
+        checked.append(kwargs['value'])
+        return False
+
+    monkeypatch.setattr(nv, 'check_value', check_value)
+
+    assert nv.set_value(nv.from_human(nv.max)) is False
+    assert checked == [nv.from_human(nv.max)]
+    assert nv.value == before
+
+
+@pytest.inlineCallbacks
+def test_protocol_round_trip(device, simulator):
+    protocol = epyqlib.twisted.nvs.Protocol()
+    protocol.makeConnection(epyqlib.tests.common.LoopbackTransport(
+        protocol=protocol,
+        responder=simulator,
+    ))
+
+    nv = writable_nv(device)
+    nv.set_value(nv.from_human(nv.max))
+
+    yield protocol.write(nv_signal=nv, meta=epyqlib.nv.MetaEnum.value)
+
+    assert simulator.value(
+        mux_name=nv.frame.mux_name,
+        name=nv.name,
+        meta=epyqlib.nv.MetaEnum.value,
+    ) == nv.from_human(nv.max)
+
+    value, meta = yield protocol.read(
+        nv_signal=nv,
+        meta=epyqlib.nv.MetaEnum.value,
+    )
+    assert value == nv.max
+
+    minimum, meta = yield protocol.read(
+        nv_signal=nv,
+        meta=epyqlib.nv.MetaEnum.minimum,
+    )
+    assert minimum == nv.min
+
+    assert simulator.request_count >= 3
+
+
+def test_read_only_frames_ignore_writes(device, simulator):
+    nv = next(
+        nv
+        for nv in device.nvs.all_nv()
+        if nv.frame.read_write.min > 0
+    )
+    path = dict(
+        mux_name=nv.frame.mux_name,
+        name=nv.name,
+        meta=epyqlib.nv.MetaEnum.value,
+    )
+    original = simulator.value(**path)
+
+    write, = (
+        key
+        for key, value in nv.frame.read_write.enumeration.items()
+        if value == 'Write'
+    )
+    data = [0] * len(nv.frame.signals)
+    data[0] = nv.frame.mux.value
+    data[nv.frame.signals.index(nv.frame.read_write)] = int(write)
+    data[nv.frame.signals.index(nv)] = original + 1
+
+    response, = simulator(nv.frame.to_message(nv.frame.pack(data)))
+
+    assert response.arbitration_id == nv.frame.status_frame.id
+    assert simulator.value(**path) == original
+
+
+def test_simulated_bus(qtbot, device, simulator):
+    nv = writable_nv(device)
+    read, = (
+        key
+        for key, value in nv.frame.read_write.enumeration.items()
+        if value == 'Read'
+    )
+    data = [0] * len(nv.frame.signals)
+    data[0] = nv.frame.mux.value
+    data[nv.frame.signals.index(nv.frame.read_write)] = int(read)
+    request = nv.frame.to_message(nv.frame.pack(data))
+
+    received = []
+    listener = epyqlib.canneo.QtCanListener(receiver=received.append)
+
+    link = epyqlib.simulatedbus.Link(latency=0.01, jitter=0.01, seed=0)
+    real_bus = epyqlib.simulatedbus.SimulatedBus(
+        responders=[simulator],
+        link=link,
+    )
+    bus = epyqlib.busproxy.BusProxy(bus=real_bus)
+    bus.notifier.add(listener)
+
+    try:
+        bus.send(request)
+        qtbot.waitUntil(lambda: len(received) == 1)
+
+        assert received[0].arbitration_id == nv.frame.status_frame.id
+
+        link.drop_rate = 1
+        bus.send(request)
+        qtbot.wait(100)
+
+        assert len(received) == 1
+    finally:
+        bus.terminate()
+
+
+def test_server(device, simulator):
+    nv = writable_nv(device)
+    read, = (
+        key
+        for key, value in nv.frame.read_write.enumeration.items()
+        if value == 'Read'
+    )
+    data = [0] * len(nv.frame.signals)
+    data[0] = nv.frame.mux.value
+    data[nv.frame.signals.index(nv.frame.read_write)] = int(read)
+
+    client = can.interface.Bus(bustype='virtual', channel='test_nv_server')
+    server = epyqlib.simulatedbus.Server(
+        bus=can.interface.Bus(bustype='virtual', channel='test_nv_server'),
+        responders=[simulator],
+    )
+    server.start()
+
+    try:
+        client.send(nv.frame.to_message(nv.frame.pack(data)))
+        response = client.recv(timeout=2)
+    finally:
+        server.stop()
+        client.shutdown()
+        server.bus.shutdown()
+
+    assert response.arbitration_id == nv.frame.status_frame.id
@@ -0,0 +1,510 @@
+import time
+
+import pytest
+import twisted.internet.defer
+
+import epyqlib.device
+import epyqlib.nv
+import epyqlib.nvsimulator
+import epyqlib.tests.common
+import epyqlib.twisted.nvs
+
+
+def connect(device, window, **kwargs):
+    simulator = epyqlib.nvsimulator.Device(
+        neo=device.nvs.neo,
+        configuration=device.definition.nv_configuration,
+    )
+    protocol = epyqlib.twisted.nvs.Protocol(window=window, **kwargs)
+    transport = epyqlib.tests.common.DelayedTransport(
+        protocol=protocol,
+        responder=simulator,
+        frames={
+            frame.mux.value: frame
+            for frame in device.nvs.set_frames.values()
+        },
+    )
+    protocol.makeConnection(transport)
+
+    return protocol, transport, simulator
+
+
+def frames_with_metas(device):
+    return [
+        frame
+        for frame in device.nvs.set_frames.values()
+        if frame.meta_signal is not None
+        and len(frame.parameter_signals) > 0
+    ]
+
+
+@pytest.inlineCallbacks
+def test_window_reads(device):
+    protocol, transport, simulator = connect(device=device, window=4)
+    frames = frames_with_metas(device)[:6]
+
+    results = yield twisted.internet.defer.gatherResults([
+        protocol.read_multiple(
+            nv_signals=frame.parameter_signals,
+            meta=meta,
+            all_values=True,
+        )
+        for frame in frames
+        for meta in (epyqlib.nv.MetaEnum.value, epyqlib.nv.MetaEnum.maximum)
+    ])
+
+    assert transport.maximum_outstanding == 4
+    assert simulator.request_count == 2 * len(frames)
+
+    for (values, meta), frame in zip(results[1::2], frames):
+        assert meta == epyqlib.nv.MetaEnum.maximum
+        for signal in frame.parameter_signals:
+            assert values[signal.status_signal] == signal.status_signal.to_human(
+                simulator.value(
+                    mux_name=frame.mux_name,
+                    name=signal.name,
+                    meta=meta,
+                ),
+            )
+
+
+@pytest.inlineCallbacks
+def test_window_keeps_write_order(device):
+    protocol, transport, simulator = connect(device=device, window=4)
+    frame = next(
+        frame
+        for frame in frames_with_metas(device)
+        if frame.read_write.min == 0
+    )
+    signal = frame.parameter_signals[0]
+
+    deferreds = [
+        protocol.write_multiple(
+            nv_signals={s: 0 for s in frame.parameter_signals},
+            meta=meta,
+            all_values=True,
+        )
+        for meta in epyqlib.nv.meta_limits_first
+    ]
+    deferreds.append(protocol.read(
+        nv_signal=signal,
+        meta=epyqlib.nv.MetaEnum.value,
+    ))
+
+    yield twisted.internet.defer.gatherResults(deferreds)
+
+    assert transport.maximum_outstanding == 1
+    assert transport.requests == [frame] * len(deferreds)
+
+
+@pytest.inlineCallbacks
+def test_window_timeouts_are_per_request(device):
+    protocol, transport, simulator = connect(
+        device=device,
+        window=4,
+        timeout=0.1,
+    )
+    frames = frames_with_metas(device)[:3]
+    transport.ignored_mux_names = (frames[1].mux_name,)
+
+    deferreds = [
+        protocol.read_multiple(
+            nv_signals=frame.parameter_signals,
+            meta=epyqlib.nv.MetaEnum.value,
+        )
+        for frame in frames
+    ]
+
+    yield deferreds[0]
+    yield deferreds[2]
+
+    with pytest.raises(epyqlib.twisted.nvs.RequestTimeoutError):
+        yield deferreds[1]
+
+
+@pytest.inlineCallbacks
+def test_read_all_uses_window(device):
+    protocol, transport, simulator = connect(device=device, window=4)
+    original = device.nvs.protocol
+    device.nvs.protocol = protocol
+
+    try:
+        yield device.nvs.read_all_from_device(
+            only_these=[
+                nv
+                for frame in frames_with_metas(device)[:5]
+                for nv in frame.parameter_signals
+            ],
+            meta=(epyqlib.nv.MetaEnum.value,),
+            background=True,
+        )
+    finally:
+        device.nvs.protocol = original
+
+    assert transport.maximum_outstanding == 4
+    assert simulator.request_count == 5
+
+
+@pytest.inlineCallbacks
+def test_duplicate_reads_coalesce(device):
+    protocol, transport, simulator = connect(device=device, window=1)
+    busy, frame = frames_with_metas(device)[:2]
+    signal = frame.parameter_signals[0]
+    meta = epyqlib.nv.MetaEnum.value
+
+    deferreds = [
+        protocol.read_multiple(nv_signals=busy.parameter_signals, meta=meta),
+    ]
+    deferreds.extend(
+        protocol.read_multiple(
+            nv_signals=frame.parameter_signals,
+            meta=meta,
+            all_values=True,
+        )
+        for _ in range(3)
+    )
+    deferreds.append(protocol.read(
+        nv_signal=signal,
+        meta=meta,
+        priority=epyqlib.twisted.nvs.Priority.user,
+    ))
+
+    results = yield twisted.internet.defer.gatherResults(deferreds)
+
+    assert transport.requests == [busy, frame]
+
+    expected = signal.status_signal.to_human(
+        simulator.value(mux_name=frame.mux_name, name=signal.name, meta=meta),
+    )
+    for values, _ in results[1:4]:
+        assert values[signal.status_signal] == expected
+    assert results[4] == (expected, meta)
+
+
+@pytest.inlineCallbacks
+def test_reads_after_write_do_not_coalesce(device):
+    protocol, transport, simulator = connect(device=device, window=1)
+    busy, frame = next(
+        (busy, frame)
+        for busy, frame in zip(
+            frames_with_metas(device),
+            frames_with_metas(device)[1:],
+        )
+        if frame.read_write.min == 0
+    )
+    signal = frame.parameter_signals[0]
+    meta = epyqlib.nv.MetaEnum.value
+
+    deferreds = [
+        protocol.read_multiple(nv_signals=busy.parameter_signals, meta=meta),
+        protocol.read(nv_signal=signal, meta=meta),
+        protocol.write_multiple(
+            nv_signals={s: 0 for s in frame.parameter_signals},
+            meta=meta,
+            all_values=True,
+        ),
+        protocol.read(nv_signal=signal, meta=meta),
+        protocol.read(nv_signal=signal, meta=meta),
+    ]
+
+    yield twisted.internet.defer.gatherResults(deferreds)
+
+    assert transport.requests == [busy, frame, frame, frame]
+
+
+@pytest.inlineCallbacks
+def test_reads_after_partial_write_see_it(device):
+    protocol, transport, simulator = connect(device=device, window=1)
+    frame = writable_frame(device)
+    busy = next(f for f in frames_with_metas(device) if f is not frame)
+    signal = frame.parameter_signals[0]
+    meta = epyqlib.nv.MetaEnum.value
+    old = simulator.value(mux_name=frame.mux_name, name=signal.name, meta=meta)
+
+    deferreds = [
+        protocol.read_multiple(nv_signals=busy.parameter_signals, meta=meta),
+        protocol.write_multiple(nv_signals={signal: old + 1}, meta=meta),
+        protocol.read(nv_signal=signal, meta=meta),
+    ]
+
+    results = yield twisted.internet.defer.gatherResults(deferreds)
+
+    assert transport.requests == [busy, frame, frame, frame]
+    assert results[2] == (signal.status_signal.to_human(old + 1), meta)
+
+
+def test_round_trip_estimator():
+    estimator = epyqlib.twisted.nvs.RoundTripEstimator(
+        minimum=0.05,
+        maximum=1,
+    )
+    assert estimator.timeout() == 1
+
+    for _ in range(20):
+        estimator.add(0.002)
+    assert estimator.timeout() == 0.05
+
+    for _ in range(20):
+        estimator.add(0.2)
+    assert 0.2 < estimator.timeout() < 1
+
+    for _ in range(5):
+        estimator.add(10)
+    assert estimator.timeout() == 1
+    assert estimator.to_dict()['count'] == 45
+
+
+@pytest.inlineCallbacks
+def test_retries_on_lossy_link(device):
+    protocol, transport, simulator = connect(
+        device=device,
+        window=4,
+        retries=3,
+    )
+    frames = frames_with_metas(device)[:8]
+    metas = (epyqlib.nv.MetaEnum.value, epyqlib.nv.MetaEnum.maximum)
+
+    def read_all():
+        return twisted.internet.defer.gatherResults([
+            protocol.read_multiple(nv_signals=frame.parameter_signals, meta=meta)
+            for frame in frames
+            for meta in metas
+        ])
+
+    # Learn the round trip time on a good link
+    yield read_all()
+
+    transport.drop_rate = 0.2
+    start = time.monotonic()
+    for _ in range(3):
+        yield read_all()
+    elapsed = time.monotonic() - start
+
+    statistics = protocol.statistics()
+    assert statistics['retries'] > 0
+    assert statistics['timeouts'] == 0
+    assert statistics['read_round_trip']['timeout'] == 0.05
+    # A fixed timeout would cost a second for each drop
+    assert elapsed < statistics['retries'] * 0.5
+
+
+@pytest.inlineCallbacks
+def test_retries_exhausted(device):
+    protocol, transport, simulator = connect(
+        device=device,
+        window=1,
+        retries=2,
+        timeout=0.1,
+    )
+    frame = frames_with_metas(device)[0]
+    transport.ignored_mux_names = (frame.mux_name,)
+
+    with pytest.raises(epyqlib.twisted.nvs.RequestTimeoutError):
+        yield protocol.read_multiple(
+            nv_signals=frame.parameter_signals,
+            meta=epyqlib.nv.MetaEnum.value,
+        )
+
+    assert transport.requests == [frame] * 3
+    assert protocol.statistics()['retries'] == 2
+    assert protocol.statistics()['timeouts'] == 1
+
+
+def writable_frame(device):
+    return next(
+        frame
+        for frame in frames_with_metas(device)
+        if frame.read_write.min == 0 and len(frame.parameter_signals) > 1
+    )
+
+
+def test_nvs_reads_before_partial_writes_by_default(device):
+    assert device.nvs.protocol.write_max_age is None
+
+
+@pytest.inlineCallbacks
+def test_partial_write_uses_mirror(device):
+    protocol, transport, simulator = connect(
+        device=device,
+        window=1,
+        write_max_age=60,
+    )
+    frame = writable_frame(device)
+    signal, other = frame.parameter_signals[:2]
+    meta = epyqlib.nv.MetaEnum.value
+
+    yield protocol.read_multiple(nv_signals=frame.parameter_signals, meta=meta)
+    before = simulator.value(mux_name=frame.mux_name, name=other.name, meta=meta)
+
+    values, _ = yield protocol.write_multiple(
+        nv_signals={signal: signal.from_human(0)},
+        meta=meta,
+        all_values=True,
+    )
+
+    assert transport.requests == [frame] * 2
+    assert list(values) == [signal.status_signal]
+    assert simulator.value(
+        mux_name=frame.mux_name,
+        name=other.name,
+        meta=meta,
+    ) == before
+
+    protocol.write_max_age = 0
+    yield protocol.write_multiple(
+        nv_signals={signal: signal.from_human(0)},
+        meta=meta,
+    )
+
+    assert transport.requests == [frame] * 4
+
+
+@pytest.inlineCallbacks
+def test_read_max_age(device):
+    protocol, transport, simulator = connect(device=device, window=1)
+    frame = frames_with_metas(device)[0]
+    signal = frame.parameter_signals[0]
+    meta = epyqlib.nv.MetaEnum.minimum
+
+    read = yield protocol.read(nv_signal=signal, meta=meta)
+    mirrored = yield protocol.read(nv_signal=signal, meta=meta, max_age=60)
+
+    assert mirrored == read
+    assert transport.requests == [frame]
+
+    yield protocol.read(
+        nv_signal=signal,
+        meta=epyqlib.nv.MetaEnum.maximum,
+        max_age=60,
+    )
+    yield protocol.read(nv_signal=signal, meta=meta, max_age=0)
+
+    assert transport.requests == [frame] * 3
+
+
+@pytest.inlineCallbacks
+def test_observed_status_fills_mirror(device):
+    protocol, transport, simulator = connect(device=device, window=1)
+    frame = frames_with_metas(device)[0]
+    meta = epyqlib.nv.MetaEnum.user_default
+
+    def observe(message):
+        responses = tuple(simulator(message))
+        for response in responses:
+            device.nvs.message_received(response)
+
+        return responses
+
+    transport.responder = observe
+
+    values, _ = yield protocol.read_multiple(
+        nv_signals=frame.parameter_signals,
+        meta=meta,
+        all_values=True,
+    )
+
+    mirrored = device.nvs.protocol.mirror.get(
+        frame=frame,
+        meta=meta,
+        status_signals=list(values),
+        max_age=60,
+    )
+
+    assert {
+        signal: signal.to_human(value=value)
+        for signal, value in mirrored.items()
+    } == values
+
+
+@pytest.inlineCallbacks
+def test_write_changed(device):
+    protocol, transport, simulator = connect(
+        device=device,
+        window=4,
+        write_max_age=2,
+    )
+    frames = [
+        frame
+        for frame in frames_with_metas(device)
+        if frame.read_write.min == 0
+    ][:3]
+    nvs = [nv for frame in frames for nv in frame.parameter_signals]
+    metas = (epyqlib.nv.MetaEnum.user_default, epyqlib.nv.MetaEnum.value)
+
+    values = {
+        (nv, meta): simulator.value(
+            mux_name=nv.frame.mux_name,
+            name=nv.name,
+            meta=meta,
+        )
+        for nv in nvs
+        for meta in metas
+    }
+    changes = (
+        (frames[0].parameter_signals[0], epyqlib.nv.MetaEnum.value),
+        (frames[2].parameter_signals[-1], epyqlib.nv.MetaEnum.user_default),
+    )
+    for key in changes:
+        values[key] += 1
+
+    original = device.nvs.protocol
+    device.nvs.protocol = protocol
+
+    try:
+        differences = yield device.nvs.write_changed_to_device(
+            only_these=nvs,
+            values=values,
+            meta=metas,
+            background=True,
+            dry_run=True,
+        )
+
+        assert simulator.request_count == len(frames) * len(metas)
+        assert [(d.nv, d.meta) for d in differences] == list(changes[::-1])
+        for difference in differences:
+            assert difference.value == difference.device_value + 1
+
+        simulator.request_count = 0
+        written = yield device.nvs.write_changed_to_device(
+            only_these=nvs,
+            values=values,
+            meta=metas,
+            background=True,
+        )
+    finally:
+        device.nvs.protocol = original
+
+    assert written == differences
+    # read everything, write the two changed frames and read them back
+    assert simulator.request_count == len(frames) * len(metas) + 2 + 2
+    for (nv, meta), value in values.items():
+        assert simulator.value(
+            mux_name=nv.frame.mux_name,
+            name=nv.name,
+            meta=meta,
+        ) == value
+
+
+@pytest.inlineCallbacks
+def test_write_changed_without_device_values(device):
+    protocol, transport, simulator = connect(device=device, window=4)
+    frame = writable_frame(device)
+    protocol.mirror.update = lambda frame, meta, signals: None
+
+    original = device.nvs.protocol
+    device.nvs.protocol = protocol
+
+    try:
+        with pytest.raises(epyqlib.nv.VerificationError):
+            yield device.nvs.write_changed_to_device(
+                only_these=frame.parameter_signals,
+                values={
+                    (nv, epyqlib.nv.MetaEnum.value): 0
+                    for nv in frame.parameter_signals
+                },
+                meta=(epyqlib.nv.MetaEnum.value,),
+                background=True,
+                dry_run=True,
+            )
+    finally:
+        device.nvs.protocol = original
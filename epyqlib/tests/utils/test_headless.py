@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+import epyqlib.utils.headless
+import epyqlib.utils.twisted
+
+
+class Emitter:
+    def __init__(self):
+        self.host = epyqlib.utils.headless.SignalHost()
+        self.signal = self.host.signal
+
+
+@pytest.inlineCallbacks
+def test_signal_delivery():
+    emitter = Emitter()
+    received = []
+
+    def slot(value):
+        received.append((value, threading.current_thread()))
+
+    emitter.signal.connect(slot)
+    emitter.signal.emit(1)
+    assert received == [(1, threading.current_thread())]
+
+    thread = threading.Thread(target=emitter.signal.emit, args=(2,))
+    thread.start()
+    thread.join()
+    assert len(received) == 1
+
+    yield epyqlib.utils.twisted.wait_for(lambda: len(received) == 2)
+    assert received[1] == (2, threading.current_thread())
+
+    emitter.signal.disconnect(slot)
+    emitter.signal.emit(3)
+    assert len(received) == 2
+
+    with pytest.raises(TypeError):
+        emitter.signal.disconnect(slot)
+
+
+def test_unthreaded_host_calls_directly():
+    emitter = Emitter()
+    emitter.host.moveToThread(None)
+    received = []
+    emitter.signal.connect(
+        lambda: received.append(threading.current_thread()),
+    )
+
+    thread = threading.Thread(target=emitter.signal.emit)
+    thread.start()
+    thread.join()
+
+    assert received == [thread]
+
+
+@pytest.inlineCallbacks
+def test_timer():
+    timer = epyqlib.utils.headless.Timer()
+    timer.setInterval(10)
+    fired = []
+    timer.timeout.connect(lambda: fired.append(None))
+
+    timer.start()
+    yield epyqlib.utils.twisted.wait_for(lambda: len(fired) >= 3, period=0.01)
+    timer.stop()
+
+    assert not timer.isActive()
+    count = len(fired)
+
+    timer.setSingleShot(True)
+    timer.start()
+    yield epyqlib.utils.twisted.sleep(0.05)
+    assert not timer.isActive()
+    assert len(fired) == count + 1
@@ -8,16 +8,21 @@ __copyright__ = ('\n'.join([
 __license__ = 'GPLv2+'
 
 
+import epyqlib.busmetrics
 import epyqlib.canneo
+import epyqlib.utils.qt
 
 
 class BusProxy(epyqlib.canneo.QtCanListener):
+    keys_changed = epyqlib.utils.qt.Signal()
+
     def __init__(self, protocol, reactor, bus=None, parent=None):
         super().__init__(receiver=self.readEvent, parent=parent)
 
         self._bus = bus
         self._reactor = reactor
         self._protocol = protocol
+        self.metrics = epyqlib.busmetrics.Metrics()
 
         if self._bus is not None:
             self.set_bus(bus=self._bus)
@@ -31,15 +36,33 @@ class BusProxy(epyqlib.canneo.QtCanListener):
         self._bus = bus
 
     def write(self, message):
-        return self._bus.send(msg=message)
+        sent = self._bus.send(msg=message)
+        if sent:
+            self.metrics.transmitted(message)
+
+        return sent
 
     def write_passive(self, message):
-        return self._bus.send_passive(msg=message)
+        sent = self._bus.send_passive(msg=message)
+        if sent:
+            self.metrics.transmitted(message)
+
+        return sent
+
+    def receive_keys(self):
+        receive_keys = getattr(self._protocol, 'receive_keys', None)
+        if receive_keys is None:
+            return None
+
+        return receive_keys()
 
     def readEvent(self, message):
         """
         Some data's readable from serial device.
         """
+        self.metrics.received(message)
+        self.metrics.dispatched((message,))
+
         return self._protocol.dataReceived(message)
 
 
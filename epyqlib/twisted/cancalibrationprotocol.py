@@ -527,6 +527,9 @@ class Handler(QObject, twisted.protocols.policies.TimeoutMixin):
         self.setTimeout(timeout)
         logger.debug('Timeout set to {}'.format(packet.command_code.timeout))
 
+    def receive_keys(self):
+        return {(self._rx_id, self._extended)}
+
     def dataReceived(self, msg):
         if not (msg.arbitration_id == self._rx_id and
                     bool(msg.id_type) == self._extended):
@@ -1,13 +1,13 @@
+import bisect
 import collections
 import enum
+import itertools
 import logging
-import queue
 import textwrap
 import time
 
 import attr
 import twisted.internet.defer
-import twisted.protocols.policies
 
 import epyqlib.nv
 import epyqlib.utils.general
@@ -68,6 +68,110 @@ class Priority(enum.IntEnum):
     background = 1
 
 
+_sequence = itertools.count()
+
+
+@attr.s
+class RoundTripEstimator:
+    """Smoothed round trip time and the resulting response timeout as
+    for TCP retransmission (RFC 6298).
+
+    The timeout is ``maximum`` until the first sample arrives and is
+    otherwise kept between ``minimum`` and ``maximum``.
+    """
+    minimum = attr.ib(default=0.05)
+    maximum = attr.ib(default=1)
+    gain = attr.ib(default=1/8)
+    variation_gain = attr.ib(default=1/4)
+    smoothed = attr.ib(default=None)
+    variation = attr.ib(default=None)
+    count = attr.ib(default=0)
+    shortest = attr.ib(default=None)
+    longest = attr.ib(default=None)
+
+    def add(self, round_trip):
+        if self.smoothed is None:
+            self.smoothed = round_trip
+            self.variation = round_trip / 2
+        else:
+            self.variation += self.variation_gain * (
+                abs(self.smoothed - round_trip) - self.variation
+            )
+            self.smoothed += self.gain * (round_trip - self.smoothed)
+
+        self.count += 1
+        if self.shortest is None or round_trip < self.shortest:
+            self.shortest = round_trip
+        if self.longest is None or round_trip > self.longest:
+            self.longest = round_trip
+
+    def timeout(self):
+        if self.smoothed is None:
+            return self.maximum
+
+        timeout = self.smoothed + 4 * self.variation
+
+        return min(self.maximum, max(self.minimum, timeout))
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'smoothed': self.smoothed,
+            'variation': self.variation,
+            'shortest': self.shortest,
+            'longest': self.longest,
+            'timeout': self.timeout(),
+        }
+
+
+@attr.s
+class Mirror:
+    """The last raw value seen from the device for each parameter and meta
+    along with when it was seen.
+    """
+    clock = attr.ib(default=time.monotonic, repr=False)
+    values = attr.ib(default=attr.Factory(dict), repr=False)
+
+    @staticmethod
+    def _meta(frame, meta):
+        if frame.meta_signal is None:
+            return epyqlib.nv.MetaEnum.value
+
+        return meta
+
+    def update(self, frame, meta, signals):
+        """Record the parameter values of the set frame found in the
+        signals unpacked from a status frame.
+        """
+        meta = self._meta(frame=frame, meta=meta)
+        now = self.clock()
+
+        for parameter in frame.parameter_signals:
+            value = signals.get(parameter.status_signal)
+            if value is not None:
+                self.values[(parameter.status_signal, meta)] = (value, now)
+
+    def get(self, frame, meta, status_signals, max_age):
+        """The raw values of the status signals by signal if all were seen
+        within max_age seconds, otherwise None.
+        """
+        meta = self._meta(frame=frame, meta=meta)
+        oldest = self.clock() - max_age
+
+        values = {}
+        for signal in status_signals:
+            value, seen = self.values.get((signal, meta), (None, None))
+            if seen is None or seen < oldest:
+                return None
+
+            values[signal] = value
+
+        return values
+
+    def clear(self):
+        self.values.clear()
+
+
 @attr.s
 class Request:
     priority = attr.ib()
@@ -79,23 +183,77 @@ class Request:
     all_values = attr.ib(cmp=False)
     frame = attr.ib(cmp=False)
     send_time = attr.ib(default=None)
+    # Keeps requests of equal priority first in, first out
+    sequence = attr.ib(default=attr.Factory(lambda: next(_sequence)))
+    timeout_call = attr.ib(default=None, cmp=False, repr=False)
+    message = attr.ib(default=None, cmp=False, repr=False)
+    attempts = attr.ib(default=0, cmp=False)
+    # Later reads of the same frame and meta answered by this request
+    coalesced = attr.ib(default=attr.Factory(list), cmp=False, repr=False)
+
+    def key(self):
+        """The multiplexer and meta values the response will carry."""
+        meta = None
+        if self.frame.meta_signal is not None:
+            meta = self.meta
+
+        return self.frame.mux.value, meta
 
+    def all_requests(self):
+        return (self, *self.coalesced)
 
-class Protocol(twisted.protocols.policies.TimeoutMixin):
-    def __init__(self, timeout=1):
-        self._deferred = None
 
+class Protocol:
+    def __init__(self, timeout=1, window=1, retries=0, minimum_timeout=0.05,
+                 backoff=2, write_max_age=None):
         self._state = State.idle
         self._previous_state = self._state
 
-        self._active = False
+        # Values in responses, and any status frames passed to observe(),
+        # are kept so partial writes can skip reading the rest of the frame
+        # first when the other values were seen within write_max_age
+        # seconds.  Reads may also be served from here, see read().
+        self.mirror = Mirror()
+        self.write_max_age = write_max_age
+
+        # Responses are waited for as long as the round trips seen so far
+        # suggest, up to timeout.  A request is sent up to retries more
+        # times, each time waiting backoff times longer, before failing.
+        # The last attempt waits the full timeout so a device gone slow is
+        # not given up on sooner than without retries.  Writes are timed
+        # separately since storing values may take longer than reading.
+        self.round_trips = {
+            read: RoundTripEstimator(minimum=minimum_timeout, maximum=timeout)
+            for read in (True, False)
+        }
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_count = 0
+        self.timeout_count = 0
+
+        # The number of requests awaiting responses at once.  Outstanding
+        # requests are always for different multiplexer and meta values
+        # and a write is never outstanding alongside another request for
+        # the same multiplexer so writes to a frame apply in order.
+        self.window = window
+        self._in_flight = collections.OrderedDict()
+        self._settling = 0
+
+        # Pending requests sorted by priority and then age
+        self.requests = []
+        # Pending reads by key which a new read of the same key can join
+        # rather than being sent on its own.  Reads queued before a write
+        # to the frame are not joined since they may not see it.
+        self._pending_reads = {}
 
-        self._request_memory = None
-        self._timeout = timeout
+        self.cancel_queued = False
 
-        self.requests = queue.PriorityQueue()
+        # The (id, extended) keys of the status frames responses arrive in,
+        # None if unknown.
+        self.keys = None
 
-        self.cancel_queued = False
+    def receive_keys(self):
+        return self.keys
 
     @property
     def state(self):
@@ -111,28 +269,41 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
         self._transport = transport
         logger.debug('Protocol.makeConnection(): {}'.format(transport))
 
-    def _start_transaction(self):
-        if self._active:
-            raise Exception('Protocol is already active')
+    def _start_transaction(self, request):
+        key = request.key()
+        if key in self._in_flight:
+            raise Exception('Protocol is already handling {}'.format(key))
+
+        self._in_flight[key] = request
 
-        self._active = True
+    def _transaction_over(self, request):
+        if request.timeout_call is not None:
+            if request.timeout_call.active():
+                request.timeout_call.cancel()
+            request.timeout_call = None
 
-    def _transaction_over(self):
-        self.setTimeout(None)
-        import twisted.internet
-        twisted.internet.reactor.callLater(0, self._transaction_over_after_delay)
-        d = self._deferred
-        self._deferred = None
-        self._request_memory = None
-        self.state = State.idle
-        return d
+        if self._in_flight.get(request.key()) is request:
+            del self._in_flight[request.key()]
+
+        if len(self._in_flight) == 0:
+            self.state = State.idle
+
+        # The slot is only freed once handling of this response is done.
+        self._settling += 1
+        from twisted.internet import reactor
+        reactor.callLater(0, self._transaction_over_after_delay)
+
+        return request.deferred
 
     def _transaction_over_after_delay(self):
-        self._active = False
+        self._settling -= 1
         self._get()
 
     def read(self, nv_signal, meta, priority=Priority.background, passive=False,
-             all_values=False):
+             all_values=False, max_age=None):
+        """Read from the device, or from values seen within max_age
+        seconds if given.
+        """
         return self._read_write_request(
             nv_signals=(nv_signal,),
             read=True,
@@ -140,10 +311,11 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
             priority=priority,
             passive=passive,
             all_values=all_values,
+            max_age=max_age,
         )
 
     def read_multiple(self, nv_signals, meta, priority=Priority.background,
-                      passive=False, all_values=False):
+                      passive=False, all_values=False, max_age=None):
         # TODO: make sure all signals are from the same frame
         return self._read_write_request(
             nv_signals=nv_signals,
@@ -152,6 +324,7 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
             priority=priority,
             passive=passive,
             all_values=all_values,
+            max_age=max_age,
         )
 
     def write(self, nv_signal, meta, priority=Priority.background,
@@ -200,7 +373,8 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
         )
 
     def _read_write_request(self, nv_signals, read, meta, priority, passive,
-                            all_values):
+                            all_values, sequence=None, coalesce=True,
+                            max_age=None):
         deferred = twisted.internet.defer.Deferred()
 
         if not isinstance(nv_signals, dict):
@@ -215,7 +389,7 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
 
         frame = tuple(nv_signals.keys())[0].frame
 
-        self._put(Request(
+        request = Request(
             read=read,
             meta=meta,
             signals=nv_signals,
@@ -224,31 +398,107 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
             passive=passive,
             all_values=all_values,
             frame=frame,
-        ))
+        )
+        if sequence is not None:
+            request.sequence = sequence
+
+        if max_age is not None:
+            mirrored = self.mirror.get(
+                frame=frame,
+                meta=meta,
+                status_signals=[s.status_signal for s in nv_signals],
+                max_age=max_age,
+            )
+            if mirrored is not None:
+                deferred.callback((self._value(request, mirrored), meta))
+                return deferred
+
+        self._put(request, coalesce=coalesce)
 
         return deferred
 
-    def _put(self, request):
-        self.requests.put(request)
+    def _put(self, request, coalesce=True):
+        key = request.key()
+
+        # The reads done before a write neither join nor are joined by
+        # other reads since those pending may have been made after the
+        # write and must see it.
+        if request.read and coalesce:
+            pending = self._pending_reads.get(key)
+            if pending is not None and pending.passive == request.passive:
+                self._coalesce(pending=pending, request=request)
+                return
+
+            self._pending_reads[key] = request
+        elif not request.read:
+            mux = request.frame.mux.value
+            for pending_key in tuple(self._pending_reads):
+                if pending_key[0] == mux:
+                    del self._pending_reads[pending_key]
+
+        bisect.insort(self.requests, request)
         self._get()
 
+    def _coalesce(self, pending, request):
+        pending.coalesced.append(request)
+
+        if request.priority < pending.priority:
+            self.requests.remove(pending)
+            pending.priority = request.priority
+            bisect.insort(self.requests, pending)
+            self._get()
+
     def _get(self):
-        if not self._active:
-            while True:
-                try:
-                    request = self.requests.get(block=False)
-                except queue.Empty:
-                    self.cancel_queued = False
-                else:
-                    if self.cancel_queued:
-                        request.deferred.errback(CanceledError())
-                    elif request.read:
-                        self._read_write(request)
-                    else:
-                        self._read_before_write(request)
-
-                if not self.cancel_queued:
-                    break
+        while True:
+            if self.cancel_queued:
+                requests = self.requests
+                self.requests = []
+                self._pending_reads.clear()
+                self.cancel_queued = False
+
+                for request in requests:
+                    for each in request.all_requests():
+                        each.deferred.errback(CanceledError())
+
+                continue
+
+            if len(self._in_flight) + self._settling >= self.window:
+                return
+
+            index = self._next_index()
+            if index is None:
+                return
+
+            request = self.requests.pop(index)
+            if self._pending_reads.get(request.key()) is request:
+                del self._pending_reads[request.key()]
+
+            if request.read:
+                self._read_write(request)
+            else:
+                self._read_before_write(request)
+
+    def _next_index(self):
+        # Requests for a frame are started in the order they were made so
+        # once one has to wait so do the rest for that frame.
+        waiting = set()
+
+        for index, request in enumerate(self.requests):
+            if request.frame not in waiting and not self._conflicts(request):
+                return index
+
+            waiting.add(request.frame)
+
+        return None
+
+    def _conflicts(self, request):
+        key = request.key()
+
+        return any(
+            other.frame is request.frame
+            and (not (other.read and request.read) or other_key == key)
+            for other_key, other in self._in_flight.items()
+        )
 
     def _read_before_write(self, request):
         if isinstance(request.signals, dict):
@@ -267,6 +517,15 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
             set(request.frame.parameter_signals) - set(nonskip.keys())
         )
 
+        mirrored = None
+        if len(skip_signals) > 0 and self.write_max_age is not None:
+            mirrored = self.mirror.get(
+                frame=request.frame,
+                meta=request.meta,
+                status_signals=[s.status_signal for s in skip_signals],
+                max_age=self.write_max_age,
+            )
+
         if len(skip_signals) == 0:
             try:
                 self._read_write(request)
@@ -285,10 +544,14 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
                         if s not in data:
                             data[s] = s.from_human(v)
 
-                return self.write_multiple(
+                return self._read_write_request(
                     nv_signals=data,
+                    read=False,
                     meta=request.meta,
+                    priority=request.priority,
+                    passive=request.passive,
                     all_values=True,
+                    sequence=request.sequence,
                 )
 
             def write_response(args, nonskip=nonskip, request=request):
@@ -300,20 +563,30 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
 
                 request.deferred.callback((data, request.meta))
 
-            d.addCallback(lambda _: self.read_multiple(
-                request.frame.parameter_signals,
-                meta=request.meta,
-                all_values=True
-            ))
+            # Recently seen values stand in for reading the rest of the
+            # frame.  Otherwise the read keeps the original place in the
+            # queue so that writes to the frame still apply in order.
+            if mirrored is not None:
+                d.addCallback(lambda _: (
+                    {s: s.to_human(value=v) for s, v in mirrored.items()},
+                    request.meta,
+                ))
+            else:
+                d.addCallback(lambda _: self._read_write_request(
+                    nv_signals=request.frame.parameter_signals,
+                    read=True,
+                    meta=request.meta,
+                    priority=request.priority,
+                    passive=request.passive,
+                    all_values=True,
+                    sequence=request.sequence,
+                    coalesce=False,
+                ))
             d.addCallback(read_then_write)
             d.addCallback(write_response)
             d.addErrback(lambda e: request.deferred.errback(e))
 
     def _read_write(self, request):
-        self._deferred = request.deferred
-        self._start_transaction()
-        self.state = State.reading if request.read else State.writing
-
         read_write, = (k for k, v
                        in request.frame.read_write.enumeration.items()
                        if v == ('Read' if request.read else 'Write'))
@@ -350,42 +623,65 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
             data=data.values(),
             only_return=True,
         )
+        request.message = request.frame.to_message(data)
+
+        self._start_transaction(request)
+        self.state = State.reading if request.read else State.writing
+
+        self._send(request)
 
+    def _send(self, request):
         if request.passive:
             write = self._transport.write_passive
         else:
             write = self._transport.write
 
-        self._request_memory = request
-
-        if not write(request.frame.to_message(data)):
-            self.send_failed()
-            return
+        round_trip = self.round_trips[request.read]
+        if request.attempts >= self.retries:
+            timeout = round_trip.maximum
+        else:
+            timeout = min(
+                round_trip.maximum,
+                round_trip.timeout() * self.backoff ** request.attempts,
+            )
 
         request.send_time = time.time()
+        from twisted.internet import reactor
+        request.timeout_call = reactor.callLater(
+            timeout,
+            self.timeoutConnection,
+            request,
+        )
 
-        self.setTimeout(self._timeout)
+        if not write(request.message):
+            self.send_failed(request)
 
-    def dataReceived(self, msg):
+    def statistics(self):
+        """A JSON serializable summary of round trips and retries."""
+        return {
+            'read_round_trip': self.round_trips[True].to_dict(),
+            'write_round_trip': self.round_trips[False].to_dict(),
+            'retries': self.retry_count,
+            'timeouts': self.timeout_count,
+        }
 
-        if not self._active:
-            return
-
-        if self._deferred is None:
-            return
+    def dataReceived(self, msg):
+        for request in tuple(self._in_flight.values()):
+            if self._in_flight.get(request.key()) is not request:
+                continue
 
-        request = self._request_memory
-        if request is None:
-            return
+            if not (msg.arbitration_id == request.frame.status_frame.id and
+                        bool(msg.id_type) == request.frame.status_frame.extended):
+                return
 
-        if not (msg.arbitration_id == request.frame.status_frame.id and
-                    bool(msg.id_type) == request.frame.status_frame.extended):
-            return
+            if self._response(request=request, msg=msg):
+                return
 
+    def _response(self, request, msg):
         status_signal = tuple(request.signals)[0].status_signal
 
         if status_signal is None:
-            return
+            return False
 
         signals = status_signal.frame.unpack(msg.data, only_return=True)
 
@@ -395,7 +691,7 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
             if k.name.endswith('_MUX')
         )
         if response_mux_value != mux:
-            return
+            return False
         meta_mux_value = tuple(
             v for k, v in signals.items()
             if k.enumeration_name == 'Meta'
@@ -403,39 +699,53 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
         if len(meta_mux_value) == 1:
             meta_mux_value, = meta_mux_value
             if meta_mux_value != request.meta.value:
-                print(' -- skipping due to unmatched meta')
-                return
+                logger.debug('skipping due to unmatched meta')
+                return False
 
         response_read_write_value = signals[status_signal.frame.command_signal]
         # TODO: handle the enumeration
         if response_read_write_value != request.read:
-            return
+            return False
 
-        self.setTimeout(None)
+        self.mirror.update(frame=request.frame, meta=request.meta, signals=signals)
+        self.callback(request, signals)
 
+        return True
+
+    @staticmethod
+    def _value(request, signals):
         if request.all_values:
             status_signals = {s.status_signal for s in request.signals}
-            value = {s: s.to_human(value=v) for s, v in signals.items()
-                     if s in status_signals}
-        else:
-            raw_value = signals[status_signal]
-            value = status_signal.to_human(value=raw_value)
+            return {s: s.to_human(value=v) for s, v in signals.items()
+                    if s in status_signals}
 
-        self.callback(value, request.meta)
+        status_signal = tuple(request.signals)[0].status_signal
 
-    def send_failed(self):
+        return status_signal.to_human(value=signals[status_signal])
+
+    def send_failed(self, request):
         self.cancel_queued = True
-        deferred = self._transaction_over()
-        deferred.errback(SendFailedError())
+        self._transaction_over(request)
+        for each in request.all_requests():
+            each.deferred.errback(SendFailedError())
+
+    def timeoutConnection(self, request):
+        request.timeout_call = None
+
+        if request.attempts < self.retries:
+            request.attempts += 1
+            self.retry_count += 1
+            logger.debug('Retrying {}'.format(request))
+            self._send(request)
+            return
 
-    def timeoutConnection(self):
-        request = self._request_memory
+        self.timeout_count += 1
         # TODO: report all requested signals
         signal = tuple(request.signals)[0]
         mux_name = signal.frame.mux_name
 
         e = RequestTimeoutError(
-            state=self.state,
+            state=State.reading if request.read else State.writing,
             item=(
                 f'{mux_name}:{signal.name} '
                 f'({request.meta.name}, {request.send_time}, {time.time()}'
@@ -443,22 +753,35 @@ class Protocol(twisted.protocols.policies.TimeoutMixin):
         )
 
         logger.debug(str(e))
-        if self._previous_state in [State.idle]:
-            self.state = self._previous_state
-        deferred = self._transaction_over()
-        deferred.errback(e)
-
-    def callback(self, payload, meta):
-        deferred = self._transaction_over()
-        logger.debug('calling back for {}'.format(deferred))
-        deferred.callback((payload, meta))
-
-    def errback(self, payload):
-        deferred = self._transaction_over()
-        logger.debug('erring back for {}'.format(deferred))
-        logger.debug('with payload {}'.format(payload))
-        deferred.errback(payload)
+        self._transaction_over(request)
+        for each in request.all_requests():
+            each.deferred.errback(e)
+
+    def callback(self, request, signals):
+        """Answer the request, and any reads coalesced with it, from the
+        unpacked response signals.
+        """
+        # A response to a resent request may be for any of the sends so
+        # only first attempts are timed.
+        if request.attempts == 0:
+            self.round_trips[request.read].add(time.time() - request.send_time)
+
+        self._transaction_over(request)
+        for each in request.all_requests():
+            logger.debug('calling back for {}'.format(each.deferred))
+            each.deferred.callback(
+                (self._value(request=each, signals=signals), each.meta),
+            )
+
+    def errback(self, request, payload):
+        self._transaction_over(request)
+        for each in request.all_requests():
+            logger.debug('erring back for {}'.format(each.deferred))
+            logger.debug('with payload {}'.format(payload))
+            each.deferred.errback(payload)
 
     def cancel(self):
-        deferred = self._transaction_over()
-        deferred.cancel()
+        for request in tuple(self._in_flight.values()):
+            self._transaction_over(request)
+            for each in request.all_requests():
+                each.deferred.cancel()
@@ -0,0 +1,139 @@
+import threading
+
+import attr
+
+__copyright__ = 'Copyright 2018, EPC Power Corp.'
+__license__ = 'GPLv2+'
+
+
+# Same value as Qt.QueuedConnection so callers need not care which backend
+# is hosting a signal.
+queued_connection = 2
+
+
+def reactor():
+    # Imported late to leave reactor selection, such as qt5reactor, to the
+    # application.
+    import twisted.internet.reactor
+
+    return twisted.internet.reactor
+
+
+class BoundSignal:
+    """The subset of ``pyqtBoundSignal`` used with
+    :class:`epyqlib.utils.qt.Signal`, implemented with plain callbacks.
+    """
+    def __init__(self, host):
+        self._host = host
+        # Replaced rather than modified so emitting needs no copy to
+        # tolerate slots connecting and disconnecting.
+        self._slots = ()
+
+    def connect(self, slot, type=None):
+        self._slots += ((slot, type == queued_connection),)
+
+    def disconnect(self, slot=None):
+        if slot is None:
+            self._slots = ()
+            return
+
+        for i, (connected, queued) in enumerate(self._slots):
+            if connected == slot:
+                self._slots = self._slots[:i] + self._slots[i + 1:]
+                return
+
+        raise TypeError('disconnect() failed between signal and {}'.format(
+            slot,
+        ))
+
+    def emit(self, *args):
+        ident = self._host.thread_ident
+        direct = ident is None or ident == threading.get_ident()
+
+        for slot, queued in self._slots:
+            if direct and not queued:
+                slot(*args)
+            else:
+                reactor().callFromThread(slot, *args)
+
+    __call__ = emit
+
+
+class SignalHost:
+    """Stands in for the hidden ``QObject`` hosting a signal.
+
+    Slots are called directly when emitting from the thread the host
+    belongs to and are otherwise passed to that thread through the Twisted
+    reactor, much like a Qt auto connection.  A host moved to no thread
+    calls slots directly from any thread.  Any thread other than a
+    ``threading.Thread``, such as a ``QThread``, is taken to be the main
+    thread running the reactor.
+    """
+    def __init__(self):
+        self._thread = threading.current_thread()
+        self.thread_ident = self._thread.ident
+        self.signal = BoundSignal(host=self)
+
+    def moveToThread(self, thread):
+        if thread is not None and not isinstance(thread, threading.Thread):
+            thread = threading.main_thread()
+
+        self._thread = thread
+        self.thread_ident = None if thread is None else thread.ident
+
+    def thread(self):
+        return self._thread
+
+
+@attr.s
+class Timer:
+    """The subset of ``QTimer`` used in epyqlib, run on the Twisted reactor.
+    Intervals are in milliseconds as for ``QTimer``.
+    """
+    _interval = attr.ib(default=0)
+    _single_shot = attr.ib(default=False)
+    _call = attr.ib(default=None, init=False, repr=False)
+    _host = attr.ib(default=attr.Factory(SignalHost), init=False, repr=False)
+
+    @property
+    def timeout(self):
+        return self._host.signal
+
+    def interval(self):
+        return self._interval
+
+    def setInterval(self, interval):
+        self._interval = interval
+
+    def isSingleShot(self):
+        return self._single_shot
+
+    def setSingleShot(self, single_shot):
+        self._single_shot = single_shot
+
+    def isActive(self):
+        return self._call is not None
+
+    def start(self, interval=None):
+        if interval is not None:
+            self._interval = interval
+
+        self.stop()
+        self._schedule()
+
+    def stop(self):
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+    def _schedule(self):
+        self._call = reactor().callLater(self._interval / 1000, self._fire)
+
+    def _fire(self):
+        if self._single_shot:
+            self._call = None
+        else:
+            self._schedule()
+
+        self.timeout.emit()
@@ -10,6 +10,7 @@ import traceback
 import weakref
 
 import epyqlib.utils.general
+import epyqlib.utils.headless
 
 import attr
 from PyQt5 import QtCore
@@ -1167,6 +1168,34 @@ def setup_sigint():
 #     )
 
 
+_headless = False
+
+
+def use_headless(headless=True):
+    """Host :class:`Signal` instances, and create timers with
+    :func:`create_timer`, using plain Python callbacks and the Twisted
+    reactor rather than hidden ``QObject``s and ``QTimer``s.  This allows
+    running without a ``QApplication`` in a plain reactor and avoids Qt
+    dispatch overhead.  Only signals first accessed afterwards are
+    affected.
+    """
+    global _headless
+
+    _headless = headless
+
+
+def headless():
+    return _headless
+
+
+def create_timer():
+    """A ``QTimer``, or a reactor based equivalent when headless."""
+    if _headless:
+        return epyqlib.utils.headless.Timer()
+
+    return QtCore.QTimer()
+
+
 class Signal:
     attribute_name = None
 
@@ -1188,7 +1217,10 @@ class Signal:
 
         o = d.get(self.object_cls)
         if o is None:
-            o = self.object_cls()
+            if _headless:
+                o = epyqlib.utils.headless.SignalHost()
+            else:
+                o = self.object_cls()
             d[self.object_cls] = o
 
         signal = o.signal
@@ -140,6 +140,23 @@ def timeout_retry(function, times=3, acceptable=None):
     return retry(function=function, times=times, acceptable=acceptable)
 
 
+def gather_last(deferreds):
+    """Wait for all of the deferreds and then fire with the result of the
+    last of them, or fail with the first failure.
+    """
+    d = twisted.internet.defer.gatherResults(deferreds, consumeErrors=True)
+    d.addCallback(lambda results: results[-1])
+
+    def first_failure(failure):
+        failure.trap(twisted.internet.defer.FirstError)
+
+        return failure.value.subFailure
+
+    d.addErrback(first_failure)
+
+    return d
+
+
 def sleep(seconds=None):
     d = twisted.internet.defer.Deferred()
 
@@ -56,6 +56,9 @@ setuptools.setup(
         'dulwich': [
             'dulwich',
         ],
+        'numpy': [
+            'numpy',
+        ],
         'test': [
             'pytest',
             'pytest-qt',